@@ -17,6 +17,9 @@
 
 from gettext import gettext as _
 
+import time
+_STARTED_AT = time.time()
+
 import gtk
 gtk.gdk.threads_init()
 import sys
@@ -31,6 +34,7 @@ import ka_debug
 import ka_controller
 import ka_widget
 import ka_status
+import ka_render
 import kandidtube
 
 
@@ -47,11 +51,14 @@ class KandidActivity(activity.Activity):
     """
 
     def __init__(self, handle):
+        # worker processes are forked before any rendering thread exists
+        ka_render.start_pool()
         activity.Activity.__init__(self, handle)
         self._name = handle
         self.metadata['mime_type'] = 'application/x-kandid-activity'
         self._print_greetings(handle)
         self._status = ka_status.Status.instance()
+        self._status.set_start_time(_STARTED_AT)
         self._joined_buddies =  set([])
         self._new_tubes =  []
         # Set title for our Activity
@@ -96,6 +103,7 @@ class KandidActivity(activity.Activity):
         self._start_collaboration()
 
         self.show_all()
+        self._status.startup_step('window')
         if handle.object_id is None:
             self._controller.switch_page('GettingstartedController')
 
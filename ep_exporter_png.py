@@ -48,7 +48,8 @@ class PngExporter(object):
         """
         task = ka_task.GeneratorTask(self.task_render, 
                                      self.on_render_completed,
-                                     'export_png'+self._protozoon.get_unique_id())
+                                     'export_png'+self._protozoon.get_unique_id(),
+                                     ka_task.PRIORITY_EXPORT)
         task.start(self._protozoon, -1, width, height)
         ka_debug.info('export: start_calculation %ux%u for %s' %  
                             (width, height, self._protozoon.get_unique_id()))
@@ -55,7 +55,7 @@ class CircularArc(model_layer.Layer):
             {'bind'  : SAMPLERTYPE_CONSTRAINT,
              'name'  : 'Permitted sampler types',
              'domain': model_constraintpool.STRING_1_OF_N,
-             'enum'  : ka_factory.get_factory('sampler').keys()},
+             'enum'  : lambda: ka_factory.get_factory('sampler').keys()},
             ]
 
     def __init__(self, trunk):
@@ -47,11 +47,11 @@ class FilledSpline(model_layer.Layer):
             {'bind'  : SAMPLERTYPE_CONSTRAINT,
              'name'  : 'Permitted sampler types',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('sampler').keys()},
+             'enum'  : lambda: ka_factory.get_factory('sampler').keys()},
             {'bind'  : COLORGAMUTTYPE_CONSTRAINT,
              'name'  : 'Permitted color gamut',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('colorgamut').keys()},
+             'enum'  : lambda: ka_factory.get_factory('colorgamut').keys()},
            ]
 
     def __init__(self, trunk):
@@ -60,7 +60,7 @@ class LcaLayer(model_layer.Layer):
             {'bind'  : COLORGAMUTTYPE_CONSTRAINT,
              'name'  : 'Permitted color gamut',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('colorgamut').keys()},
+             'enum'  : lambda: ka_factory.get_factory('colorgamut').keys()},
            ]
 
     def __init__(self, trunk):
@@ -24,6 +24,7 @@ import pango
 import pangocairo
 
 import ka_debug
+import ka_layoutcache
 import model_layer
 import model_random
 import ka_factory
@@ -67,7 +68,7 @@ class LetterPress(model_layer.Layer):
             {'bind'  : SAMPLERTYPE_CONSTRAINT,
              'name'  : 'Permitted sampler types',
              'domain': model_constraintpool.STRING_1_OF_N,
-             'enum'  : ka_factory.get_factory('sampler').keys()},
+             'enum'  : lambda: ka_factory.get_factory('sampler').keys()},
             ]
 
     font_style = {pango.STYLE_NORMAL:  'Normal', 
@@ -199,6 +200,7 @@ class LetterPress(model_layer.Layer):
         ctx.scale(1.0/width, 1.0/height)
 #        ka_debug.matrix(ctx.get_matrix())
         pango_ctx = pangocairo.CairoContext(ctx)
+        layout_cache = ka_layoutcache.LayoutCache.instance()
         points = self.sampler.get_sample_points()
         if len(points) > 0:
             fi = di = -1
@@ -208,23 +210,32 @@ class LetterPress(model_layer.Layer):
                 py = self.center.y_pos + points[di][1]
     
                 try:
-                    layout = pango_ctx.create_layout()
                     fi = (fi+1) % len(self.family)
-                    desc = pango.FontDescription(self.family[fi])
-                    desc.set_size(int(self.size * width * 0.01 * pango.SCALE))
-                    desc.set_style(self.style)
-                    desc.set_weight(self.weight)
-                    layout.set_text(word.encode('utf-8'))
-                    layout.set_font_description(desc)
-                    layout.set_alignment(pango.ALIGN_CENTER)
+                    font_size = int(self.size * width * 0.01 * pango.SCALE)
+                    key = (word, self.family[fi], font_size,
+                           self.style, self.weight)
+                    entry = layout_cache.checkout(key)
+                    if entry is None:
+                        layout = pango_ctx.create_layout()
+                        desc = pango.FontDescription(self.family[fi])
+                        desc.set_size(font_size)
+                        desc.set_style(self.style)
+                        desc.set_weight(self.weight)
+                        layout.set_text(word.encode('utf-8'))
+                        layout.set_font_description(desc)
+                        layout.set_alignment(pango.ALIGN_CENTER)
+                        pango_ctx.update_layout(layout)
+                        entry = (layout, layout.get_pixel_size())
+                    else:
+                        pango_ctx.update_layout(entry[0])
+                    layout, pixel_size = entry
                     rgba = self.textcolor.rgba
                     pango_ctx.set_source_rgba(rgba[0], rgba[1], rgba[2], rgba[3])
-                    pango_ctx.update_layout(layout)
         
-                    pixel_size = layout.get_pixel_size()
                     dx, dy = 0.5 * pixel_size[0], 0.9 * pixel_size[1]
                     pango_ctx.move_to((width * px) - dx, (height * py) - dy)
                     pango_ctx.show_layout(layout)
+                    layout_cache.checkin(key, entry)
                 except:
                     ka_debug.err('failed on pango [%s] [%s]' % \
                            (sys.exc_info()[0], sys.exc_info()[1]))
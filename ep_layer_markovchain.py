@@ -20,6 +20,7 @@ from gettext import gettext as _
 import random
 
 import ka_debug
+import ka_profile
 import model_locus
 import model_layer
 import model_constraintpool
@@ -47,15 +48,15 @@ class MarkovChainLayer(model_layer.Layer):
             {'bind'  : SAMPLERTYPE_CONSTRAINT,
              'name'  : 'Permitted sampler types',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('sampler').keys()},
+             'enum'  : lambda: ka_factory.get_factory('sampler').keys()},
             {'bind'  : STAMPTYPE_CONSTRAINT,
              'name'  : 'Permitted stamp types',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('stamp').keys()},
+             'enum'  : lambda: ka_factory.get_factory('stamp').keys()},
             {'bind'  : COLORGAMUTTYPE_CONSTRAINT,
              'name'  : 'Permitted color gamut',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('colorgamut').keys()},
+             'enum'  : lambda: ka_factory.get_factory('colorgamut').keys()},
            ]
 
     def __init__(self, trunk):
@@ -273,7 +274,9 @@ class MarkovChainLayer(model_layer.Layer):
         self.stamp.set_stamp_extent(dw, dh)
         cell_rand = random.Random(self.random_seed)
         cell_state = 0
-        for point in self.sampler.get_sample_points():
+        points = self.sampler.get_sample_points()
+        ka_profile.count(ka_profile.STAMPS, len(points))
+        for point in points:
             rgba = self.cell_colors[cell_state].rgba
             ctx.set_source_rgba(rgba[0], rgba[1], rgba[2], rgba[3])
             self.stamp.render(ctx, point, cell_state)
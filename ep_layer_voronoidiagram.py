@@ -18,12 +18,20 @@
 from gettext import gettext as _
 
 import math
+import random
+import cairo
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import ka_debug
+import ka_profile
 import model_random
 import ka_factory
 import model_locus
 import model_layer
+import model_sampler
 import model_constraintpool
 import exon_position
 
@@ -32,6 +40,94 @@ SAMPLERTYPE_CONSTRAINT = 'samplertypeconstraint'
 STAMPTYPE_CONSTRAINT = 'stamptypeconstraint'
 NUMBER_OF_SITES_CONSTRAINT = 'sitenumberofconstraint'
 COLORGAMUTTYPE_CONSTRAINT = 'colorgamuttypeconstraint'
+RENDERMODE_CONSTRAINT = 'rendermodeconstraint'
+
+# Special cases of the Minkowski distance
+MANHATTAN, EUCLIDEAN, CHEBYSHEV, MINKOWSKI = 1, 2, 3, 4
+EPSILON = 0.000001
+# Number of points processed at once. Limits the size of temporary arrays.
+CHUNK_SIZE = 16384
+
+def minkowski_kind(p):
+    """Classify order p, common values have cheaper distance functions."""
+    if abs(p - 1.0) < EPSILON:
+        return MANHATTAN
+    if abs(p - 2.0) < EPSILON:
+        return EUCLIDEAN
+    if p > 1.0 / EPSILON:
+        return CHEBYSHEV
+    return MINKOWSKI
+
+def _nearest_sites_numpy(points_x, points_y, sites, p):
+    """Compare all points against all sites in one pass."""
+    kind = minkowski_kind(p)
+    sites_x = numpy.array([site[0] for site in sites], dtype=float)
+    sites_y = numpy.array([site[1] for site in sites], dtype=float)
+    result = numpy.empty(len(points_x), dtype=int)
+    for start in range(0, len(points_x), CHUNK_SIZE):
+        stop = start + CHUNK_SIZE
+        dx = numpy.abs(points_x[start:stop, numpy.newaxis] - sites_x)
+        dy = numpy.abs(points_y[start:stop, numpy.newaxis] - sites_y)
+        if kind == MANHATTAN:
+            distance = dx + dy
+        elif kind == EUCLIDEAN:
+            distance = dx * dx + dy * dy
+        elif kind == CHEBYSHEV:
+            distance = numpy.maximum(dx, dy)
+        else:
+            # Scale by the larger component. Avoids overflow for big p
+            # and loss of all precision for small p.
+            larger = numpy.maximum(dx, dy)
+            scale = numpy.where(larger > 0.0, larger, 1.0)
+            distance = larger * ((dx / scale) ** p + (dy / scale) ** p) \
+                                                               ** (1.0 / p)
+        # argmin returns the first index for equal distances
+        result[start:stop] = numpy.argmin(distance, axis=1)
+    return result
+
+def _nearest_sites_python(points, sites, p):
+    kind = minkowski_kind(p)
+    inverse_p = 1.0 / p
+    result = []
+    for point in points:
+        min_distance, at_index = None, 0
+        for index, site in enumerate(sites):
+            dx, dy = math.fabs(point[0] - site[0]), math.fabs(point[1] - site[1])
+            if kind == MANHATTAN:
+                distance = dx + dy
+            elif kind == EUCLIDEAN:
+                distance = dx * dx + dy * dy
+            elif kind == CHEBYSHEV:
+                distance = dx if dx > dy else dy
+            else:
+                larger = dx if dx > dy else dy
+                if larger > 0.0:
+                    distance = larger * ((dx / larger) ** p
+                                         + (dy / larger) ** p) ** inverse_p
+                else:
+                    distance = 0.0
+            if min_distance is None or distance < min_distance:
+                min_distance, at_index = distance, index
+        result.append(at_index)
+    return result
+
+def nearest_sites(points, sites, order):
+    """Index of the nearest site for each point.
+    Distances are measured by the Minkowski distance of order p = exp(order).
+    see http://en.wikipedia.org/wiki/Minkowski_distance
+    pre: len(sites) > 0
+    post: len(__return__) == len(points)
+    """
+    p = math.exp(order)
+    if numpy is not None and len(points) > 0:
+        if isinstance(points, model_sampler.PointBuffer):
+            return _nearest_sites_numpy(numpy.array(points.x_values()),
+                                        numpy.array(points.y_values()),
+                                        sites, p).tolist()
+        points_array = numpy.asarray(points, dtype=float)
+        return _nearest_sites_numpy(points_array[:, 0], points_array[:, 1],
+                                    sites, p).tolist()
+    return _nearest_sites_python(points, sites, p)
 
 class VoronoiDiagramLayer(model_layer.Layer):
     """VoronoiDiagramLayer
@@ -52,15 +148,20 @@ class VoronoiDiagramLayer(model_layer.Layer):
             {'bind'  : SAMPLERTYPE_CONSTRAINT,
              'name'  : 'Permitted sampler types',
              'domain': model_constraintpool.STRING_1_OF_N,
-             'enum'  : ka_factory.get_factory('sampler').keys()},
+             'enum'  : lambda: ka_factory.get_factory('sampler').keys()},
             {'bind'  : STAMPTYPE_CONSTRAINT,
              'name'  : 'Permitted stamp types',
              'domain': model_constraintpool.STRING_1_OF_N,
-             'enum'  : ka_factory.get_factory('stamp').keys()},
+             'enum'  : lambda: ka_factory.get_factory('stamp').keys()},
             {'bind'  : COLORGAMUTTYPE_CONSTRAINT,
              'name'  : 'Permitted color gamut',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('colorgamut').keys()},
+             'enum'  : lambda: ka_factory.get_factory('colorgamut').keys()},
+            {'bind'  : RENDERMODE_CONSTRAINT,
+             'name'  : 'Paint stamps at sample points or fill each pixel',
+             'domain': model_constraintpool.INT_1_OF_N,
+             'enum'  : [('Stamps', 0),
+                        ('Raster', 1),]},
            ]
 
     def __init__(self, trunk):
@@ -80,6 +181,7 @@ class VoronoiDiagramLayer(model_layer.Layer):
         stamp_factory = ka_factory.get_factory('stamp')
         stamp_key = stamp_factory.keys()[0]
         self.stamp = stamp_factory.create(stamp_key, self.path, len(self.sites_point))
+        self.raster = 0
 
     def dot(self):
         result = ""
@@ -99,6 +201,7 @@ class VoronoiDiagramLayer(model_layer.Layer):
                 and len(self.sites_point) == len(other.sites_point) \
                 and len(self.sites_color) == len(other.sites_color) \
                 and self.order == other.order \
+                and self._is_raster() == other._is_raster() \
                 and self.sampler == other.sampler \
                 and self.stamp == other.stamp
         if equal:
@@ -146,6 +249,9 @@ class VoronoiDiagramLayer(model_layer.Layer):
                                               self.path, len(self.sites_point))
         self.stamp.randomize()
 
+        rendermode_constraint = cpool.get(self, RENDERMODE_CONSTRAINT)
+        self.raster = random.choice(rendermode_constraint)
+
     def mutate(self):
         """Make small random changes to the layers components."""
         super(VoronoiDiagramLayer, self).mutate()
@@ -168,6 +274,9 @@ class VoronoiDiagramLayer(model_layer.Layer):
 
         self.sampler.mutate()
         self.stamp.mutate()
+        if model_random.is_mutating():
+            rendermode_constraint = cpool.get(self, RENDERMODE_CONSTRAINT)
+            self.raster = random.choice(rendermode_constraint)
 
     def swap_places(self):
         """Shuffle similar components."""
@@ -186,7 +295,7 @@ class VoronoiDiagramLayer(model_layer.Layer):
         post: model_locus.unique_check(__return__, self, other) == ''
         """
         new_one = VoronoiDiagramLayer(self.get_trunk())
-        cross_sequence = self.crossingover_base(new_one, other, 2)
+        cross_sequence = self.crossingover_base(new_one, other, 3)
         new_one.sites_point = model_random.crossingover_list(self.sites_point,
                                                              other.sites_point)
 
@@ -198,6 +307,8 @@ class VoronoiDiagramLayer(model_layer.Layer):
             new_one.colorgamut.adjust_color(new_one.sites_color[cix])
 
         new_one.order = self.order if cross_sequence[1] else other.order
+        new_one.raster = self._is_raster() if cross_sequence[2] \
+                                           else other._is_raster()
         new_one.sampler = model_random.crossingover_elem(self.sampler,
                                                          other.sampler)
         new_one.stamp = model_random.crossingover_elem(self.stamp,
@@ -212,36 +323,65 @@ class VoronoiDiagramLayer(model_layer.Layer):
         pre: width == height
         """
         self.begin_render(ctx, width, height)
+        if self._is_raster() and numpy is not None:
+            self._render_raster(ctx, width, height)
+            return
         dw, dh = self.sampler.get_sample_extent()
         self.stamp.set_stamp_extent(dw, dh)
-        for point in self.sampler.get_sample_points():
-            at_index, color = self._site_color_min_dist(point)
+        points = self.sampler.get_sample_points()
+        ka_profile.count(ka_profile.STAMPS, len(points))
+        indices = nearest_sites(points, self._site_positions(), self.order)
+        for point, at_index in zip(points, indices):
+            color = self.sites_color[at_index % len(self.sites_color)]
             rgba = color.rgba
             ctx.set_source_rgba(rgba[0], rgba[1], rgba[2], rgba[3])
             self.stamp.render(ctx, point, at_index)
 
-    def _site_color_min_dist(self, point):
-        """ Minkowski distance
-        see http://en.wikipedia.org/wiki/Minkowski_distance
-        pre: len(point) == 2
+    def _is_raster(self):
+        # upgrade from a release without raster mode
+        return self.raster if self.__dict__.has_key('raster') else 0
+
+    def _render_raster(self, ctx, width, height):
+        """Fill each pixel with the color of its nearest site.
+        The whole diagram is composed in an image buffer and painted at once.
+        pre: numpy is not None
         """
-        
-        min_distance, at_index = 999999.9, 0
-        for index, site_point in enumerate(self.sites_point):
-#            distance = self._distance(point, site[0])
-            p = math.exp(self.order)
-            try:
-                distance = (math.fabs(point[0]-site_point.x_pos)**p + 
-                            math.fabs(point[1]-site_point.y_pos)**p) ** (1.0/p)
-                if(distance < min_distance):
-                    min_distance, at_index = distance, index
-            except OverflowError:
-#                import sys
-#                print OverflowError, sys.exc_info()[0], \
-#                      '_site_color_min_dist', self.order, p, \
-#                      point[0], site_point.x_pos, point[1], site_point.y_pos
-                pass
-        return at_index, self.sites_color[at_index % len(self.sites_color)]
+        # map the center of each device pixel back to user space
+        matrix = ctx.get_matrix()
+        matrix.invert()
+        x0, y0 = matrix.transform_point(0.0, 0.0)
+        xx, yx = matrix.transform_distance(1.0, 0.0)
+        xy, yy = matrix.transform_distance(0.0, 1.0)
+        device_x = numpy.arange(width, dtype=float) + 0.5
+        device_y = numpy.arange(height, dtype=float)[:, numpy.newaxis] + 0.5
+        user_x = (x0 + xx * device_x + xy * device_y).ravel()
+        user_y = (y0 + yx * device_x + yy * device_y).ravel()
+        indices = _nearest_sites_numpy(user_x, user_y, self._site_positions(),
+                                       math.exp(self.order))
+
+        # cairo stores premultiplied colors in native endian 32 bit words
+        palette = numpy.empty(len(self.sites_color), dtype=numpy.uint32)
+        for cix, site_color in enumerate(self.sites_color):
+            red, green, blue, alpha = site_color.rgba
+            palette[cix] = (int(alpha * 255.0 + 0.5) << 24) \
+                           | (int(alpha * red * 255.0 + 0.5) << 16) \
+                           | (int(alpha * green * 255.0 + 0.5) << 8) \
+                           | int(alpha * blue * 255.0 + 0.5)
+        pixels = palette[indices % len(palette)].reshape(height, width)
+        surface = cairo.ImageSurface.create_for_data(pixels,
+                                                     cairo.FORMAT_ARGB32,
+                                                     width, height, width * 4)
+        ka_profile.count(ka_profile.SURFACES)
+        ctx.save()
+        ctx.identity_matrix()
+        ctx.set_source_surface(surface, 0, 0)
+        ctx.paint()
+        ctx.restore()
+        surface.finish()
+
+    def _site_positions(self):
+        return [(site_point.x_pos, site_point.y_pos)
+                                         for site_point in self.sites_point]
 
 #    @staticmethod
 #    def _euclidean_square_distance(point, site):
@@ -278,6 +418,8 @@ class VoronoiDiagramLayer(model_layer.Layer):
         self.colorgamut.explain(formater)
         formater.text_item(_('Natural logarithm of order p used in Minkowski distance: ')
                            + str(self.order))
+        if self._is_raster():
+            formater.text_item(_('Each pixel is filled with the color of the nearest site.'))
         formater.position_array(self.sites_point, _('center points for sites:'))
         self.colorgamut.explain(formater)
         formater.color_array(self.sites_color, _('site colors:'))
@@ -303,6 +445,7 @@ class VoronoiDiagramLayer(model_layer.Layer):
         new_one.sites_point = model_random.copy_list(self.sites_point)
         new_one.sites_color = model_random.copy_list(self.sites_color)
         new_one.order = self.order
+        new_one.raster = self._is_raster()
         new_one.sampler = self.sampler.copy()
         new_one.stamp = self.stamp.copy()
         # upgrade from a release older than 'v4'
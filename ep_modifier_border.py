@@ -23,6 +23,7 @@ import random
 import cairo
 
 import ka_debug
+import ka_profile
 import model_locus
 import model_allele
 import model_random
@@ -90,6 +91,7 @@ class BorderModifier(model_allele.Allele):
             # paint one layer
             msk_surface = ctx.get_target().create_similar(cairo.CONTENT_ALPHA, 
                                                           width, height)
+            ka_profile.count(ka_profile.SURFACES)
             msk_ctx = cairo.Context(msk_surface)
             msk_width  = msk_surface.get_width()
             msk_height = msk_surface.get_height()
@@ -24,6 +24,9 @@ import gtk
 import model_history
 
 _SCALE = math.sqrt(2.0)
+# Generations drawn. Each generation is drawn smaller by _SCALE,
+# older ones would hardly be visible but double the work.
+MAX_DEPTH = 10
 
 class AncestorsController(object):
     """
@@ -100,7 +103,7 @@ class AncestorsController(object):
                 event.area.width, event.area.height)
         ctx.fill()
 
-        self._paint_next(ctx, event.area.width/2, 3, self._protozoon_id)
+        self._paint_next(ctx, event.area.width/2, 3, self._protozoon_id, 0)
 
     def _paint_connector(self, ctx, mx, my, x0, y0, my_parent):
         if my_parent is not None:
@@ -110,8 +113,9 @@ class AncestorsController(object):
             ctx.line_to(x0, y0)
             ctx.stroke()
 
-    def _collision(self, my_id):
-        if my_id is not None and self._history.contains(my_id):
+    def _collision(self, my_id, depth):
+        if my_id is not None and self._history.contains(my_id) \
+           and depth < MAX_DEPTH:
             p01, p10 = None, None
             my_parents = self._history.get_parents(my_id)
             if my_parents[0] is not None and self._history.contains(my_parents[0]):
@@ -124,21 +128,24 @@ class AncestorsController(object):
                     p10 = self._history.get_parents(p1[0])
             distance = 1.0 if p01 is None or p10 is None else _SCALE
             return 0.5 * distance * \
-                (self._collision(my_parents[0]) + self._collision(my_parents[1]))
+                (self._collision(my_parents[0], depth+1)
+                 + self._collision(my_parents[1], depth+1))
         else:
             return 0.5
             
-    def _paint_next(self, ctx, xpos, ypos, my_id):
-        if my_id is not None and self._history.contains(my_id):
+    def _paint_next(self, ctx, xpos, ypos, my_id, depth):
+        if my_id is not None and self._history.contains(my_id) \
+           and depth < MAX_DEPTH:
 #            ka_debug.info('my_id: ' + my_id) 
             surface = self._history.get_surface(my_id)
             width = surface.get_width() if surface is not None else 200
             height = surface.get_height() if surface is not None else 200
 
             if self._history.contains(my_id):
+                collision = self._collision(my_id, depth)
                 mx, my = xpos, ypos+height
-                x0, y0 = xpos-(self._collision(my_id)*width+23), ypos+height+23
-                x1, y1 = xpos+(self._collision(my_id)*width+23), ypos+height+23
+                x0, y0 = xpos-(collision*width+23), ypos+height+23
+                x1, y1 = xpos+(collision*width+23), ypos+height+23
                 my_parents = self._history.get_parents(my_id)
                 self._paint_connector(ctx, mx, my, x0, y0, my_parents[0])
                 self._paint_connector(ctx, mx, my, x1, y1, my_parents[1])
@@ -147,8 +154,10 @@ class AncestorsController(object):
 #                ka_debug.matrix_s(ctx.get_matrix())
                 ctx.scale(1.0/_SCALE, 1.0/_SCALE)
 #                ka_debug.matrix(ctx.get_matrix())
-                self._paint_next(ctx, _SCALE*x0, _SCALE*y0, my_parents[0])
-                self._paint_next(ctx, _SCALE*x1, _SCALE*y1, my_parents[1])
+                self._paint_next(ctx, _SCALE*x0, _SCALE*y0, my_parents[0],
+                                 depth+1)
+                self._paint_next(ctx, _SCALE*x1, _SCALE*y1, my_parents[1],
+                                 depth+1)
 #                ka_debug.matrix_r(ctx.get_matrix())
                 ctx.restore()
 
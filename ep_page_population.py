@@ -17,12 +17,12 @@
 
 from gettext import gettext as _
 
-import cairo
 import gtk
 import gobject
 
 import ka_debug
 import ka_task
+import ka_render
 import ka_controller
 import ka_extensionpoint
 import model_population
@@ -54,13 +54,14 @@ class PopulationController(object):
         self._status = ka_status.Status.instance()
         self._gencount = 0
         self._task_lock = -1
+        self._startup_pending = set(range(POPULATION_CAPACITY))
         self.model = None
         self.incoming = ka_incoming.KandidIncoming(self, widget_list)
         self.position = 100
 
     def close(self):
         """Clean up"""
-        pass
+        model_history.KandidHistory.instance().close()
 
     def _create_box_toolbar(self):
         """ """
@@ -273,10 +274,7 @@ class PopulationController(object):
         if self.surface_cache.has_key(cell_index):
 #            ka_debug.info('_draw_from_cache: ' + widget.name + ' '
 #                          + str(cell_index))
-            ctx = ka_controller.create_context(widget)
-            ctx.set_operator(cairo.OPERATOR_SOURCE)
-            ctx.set_source_surface(self.surface_cache[cell_index])
-            ctx.paint()
+            ka_controller.paint_surface(widget, self.surface_cache[cell_index])
 
     def on_notebook_switch_page(self, *args):
         """Test if status page will be displayed.
@@ -352,6 +350,7 @@ class PopulationController(object):
             self._widget_list.get_widget('vbox_' + str(cell_index)). \
                                                           set_sensitive(False)
         self.start_calculation(args[0])
+        self._send_changes()
 #        ka_debug.info('on_model_completed exit')
 
     def on_timer(self, *args):
@@ -401,7 +400,9 @@ class PopulationController(object):
             widget = self._widget_list.get_widget(widget_name)
             task = ka_task.GeneratorTask(self.task_render,
                                          self.on_image_completed,
-                                         widget_name)
+                                         widget_name,
+                                         ka_task.PRIORITY_VISIBLE,
+                                         self.on_image_progress)
             task.start(self.model.protozoans[cell_index], cell_index,
                        widget.allocation.width, widget.allocation.height)
 #            ka_debug.info('start_calculation %ux%u for %s' % 
@@ -441,15 +442,25 @@ class PopulationController(object):
         protozoon, cell_index, width, height = \
                                              args[0], args[1], args[2], args[3]
 #        ka_debug.info('task_render entry: ' + str(cell_index))
-        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
-        ctx = cairo.Context(surface)
-        protozoon.render(task, ctx, width, height)
-        self.surface_cache[cell_index] = surface
-        history = model_history.KandidHistory.instance()
-        history.link_surface(protozoon.get_unique_id(), surface)
+        def on_preview(preview):
+            self.surface_cache[cell_index] = preview
+            task.progress(cell_index)
+        surface = ka_render.render_progressive(task, protozoon, width, height,
+                                               on_preview)
+        if surface is not None:
+            self.surface_cache[cell_index] = surface
+            history = model_history.KandidHistory.instance()
+            history.link_surface(protozoon.get_unique_id(), surface)
 #        ka_debug.info('task_render exit: ' + str(cell_index))
         return cell_index
 
+    def on_image_progress(self, *args):
+        """Show coarse preview while rendering is going on."""
+        cell_index = args[0]
+        widget = self._widget_list.get_widget('drawingarea_'
+                                                    + str(cell_index))
+        self._draw_from_cache(widget, cell_index)
+
     def on_image_completed(self, *args):
 #        ka_debug.info('on_image_completed: ' + str(args[0]))
         cell_index = args[0]
@@ -460,6 +471,10 @@ class PopulationController(object):
                                                             set_sensitive(True)
         self._widget_list.get_widget('fitness_' + str(cell_index)). \
                                       set_value(self.model.fitness[cell_index]) 
+        if self._startup_pending:
+            self._startup_pending.discard(cell_index)
+            if not self._startup_pending:
+                self._status.startup_step('first population')
 
     def on_flurry_value_changed(self, *args):
         """
@@ -493,7 +508,9 @@ class PopulationController(object):
         ka_debug.info('on_publishprotozoon_activate [%s]' % args[0].get_name())
         if self._tube:
             proto = self.model.protozoans[ka_controller.name_to_index(args[0].get_name())]
-            self._tube.publish_protozoon(model_population.to_buffer(proto))
+            # published to all peers, older releases only read pickles
+            self._tube.publish_protozoon(
+                                  model_population.to_legacy_buffer(proto))
 
     def on_exportpng_activate(self, *args):
         """Publish single protozoon to all other buddies.
@@ -566,34 +583,93 @@ class PopulationController(object):
             self._status.set(ka_status.TOPIC_COLLABORATION,
                              ka_status.SUB_RECEIVED,
                              'Population from ' + nick)
-            if self.is_overwrite_allowed():
-                self._update_model(model_population.from_buffer(code_element))
-                self.start_all_calculations()
-            else:
-                in_model = model_population.from_buffer(code_element)
-                max_fit, best_ix, second_ix = -1, -1, -1
-                for index, fit in enumerate(in_model.fitness):
-                    if fit > max_fit:
-                        second_ix = best_ix
-                        best_ix, max_fit = index, fit
-                if best_ix >= 0:
-                    self.incoming.append_protozoon(in_model.protozoans[best_ix])
-                if second_ix >= 0:
-                    self.incoming.append_protozoon(in_model.protozoans[second_ix])
-                if best_ix >= 0 or second_ix >= 0:
-                    ka_debug.info("I've already an evolved population, proposing protozoon %d, %d." % (best_ix, second_ix))
-                else:
-                    ka_debug.info("I've already an evolved population, ignore incoming protozoon.")
+            ka_task.GeneratorTask(self.task_decode_population,
+                                  self.on_population_decoded,
+                                  'decode_population',
+                                  ka_task.PRIORITY_INTERACTIVE) \
+                                                  .start(code_element, nick)
+        elif code_type == kandidtube.SEND_DELTA:
+            ka_task.GeneratorTask(self.task_decode_delta,
+                                  self.on_delta_decoded,
+                                  'decode_delta',
+                                  ka_task.PRIORITY_INTERACTIVE) \
+                                                  .start(code_element, nick)
         elif code_type == kandidtube.SEND_PROTOZOON:
             ka_debug.info('Proposing protozoon.')
             self._status.set(ka_status.TOPIC_COLLABORATION,
                              ka_status.SUB_RECEIVED,
                              'Protozoon from ' + nick)
-            self.incoming.append_protozoon(model_population.from_buffer(code_element))
+            self.incoming.receive(code_element, nick)
         else:
             ka_debug.err('Somebody called me using an illegal type [%s]'
                           % code_type)
 
+    def task_decode_population(self, task, *args, **kwargs):
+        """Decode a received population outside of the GUI thread.
+        pre: len(args) == 2
+        """
+        in_model = model_population.from_buffer(args[0])
+        return in_model, args[1]
+
+    def task_decode_delta(self, task, *args, **kwargs):
+        """Decode received changes outside of the GUI thread.
+        pre: len(args) == 2
+        """
+        return model_population.read_delta(args[0]), args[1]
+
+    def on_delta_decoded(self, *args):
+        """Apply received changes if they fit to my population.
+        pre: len(args) == 1
+        """
+        delta, nick = args[0]
+        changed = None
+        if delta is not None and self.model is not None:
+            changed = model_population.apply_delta(self.model, delta)
+        if changed is None:
+            ka_debug.info("My population has changed, ignore incoming delta.")
+            self._announce_population()
+        else:
+            self._status.set(ka_status.TOPIC_COLLABORATION,
+                             ka_status.SUB_RECEIVED,
+                             'Changes from ' + nick)
+            self._update_population_gui()
+            if changed:
+                self.start_calculation(changed)
+            self._announce_population()
+
+    def on_population_decoded(self, *args):
+        """Take over the received population or propose its best protozoans.
+        pre: len(args) == 1
+        """
+        in_model, nick = args[0]
+        if in_model is None:
+            self._announce_population()
+            return
+        if self.is_overwrite_allowed():
+            self._update_model(in_model)
+            self.start_all_calculations()
+            self._announce_population()
+        else:
+            # the sender has to know that I keep my own population
+            self._announce_population()
+            max_fit, best_ix, second_ix = -1, -1, -1
+            for index, fit in enumerate(in_model.fitness):
+                if fit > max_fit:
+                    second_ix = best_ix
+                    best_ix, max_fit = index, fit
+            if best_ix >= 0:
+                self.incoming.offer_protozoon(in_model.protozoans[best_ix],
+                                    in_model.protozoans[best_ix].digest(),
+                                    nick)
+            if second_ix >= 0:
+                self.incoming.offer_protozoon(in_model.protozoans[second_ix],
+                                    in_model.protozoans[second_ix].digest(),
+                                    nick)
+            if best_ix >= 0 or second_ix >= 0:
+                ka_debug.info("I've already an evolved population, proposing protozoon %d, %d." % (best_ix, second_ix))
+            else:
+                ka_debug.info("I've already an evolved population, ignore incoming protozoon.")
+
     def on_new_tube(self, telepathy_conn, tube, my_id, is_initiator, get_buddy):
         """Creates communication object and sends population
         pre: tube > 0
@@ -611,6 +687,23 @@ class PopulationController(object):
         """Serialize population to a string buffer."""
         return model_population.to_buffer(self.model)
 
+    def serialize_legacy_model(self):
+        """Serialize population for peers running an older release."""
+        return model_population.to_legacy_buffer(self.model)
+
+    def _announce_population(self):
+        """Tell the initiator which population I really hold."""
+        if self._tube and self.model is not None:
+            self._tube.announce_population(self.model.version)
+
+    def _send_changes(self):
+        """Send protozoans replaced since the last sending to all peers."""
+        if self._tube and self.model is not None:
+            self._tube.send_changes(self.model.version,
+                  lambda version: model_population.to_delta_buffer(self.model,
+                                                                   version),
+                  self.serialize_model)
+
     def read_file(self, file_path):
         """Delegate reading from journal to data model
         pre: (file_path is not None) and (len(file_path) >= 1)
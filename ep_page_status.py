@@ -24,6 +24,7 @@ import gobject
 import ka_debug
 import ka_status
 import ka_preference
+import ka_profile
 
 class StatusController(object):
     """
@@ -71,6 +72,23 @@ class StatusController(object):
             cb.set_active(0)
         param_panel.pack_start(cb, expand=False, fill=False)
         page.pack_start(param_panel, expand=False, fill=True)
+
+        process_panel = gtk.HBox()
+        process_panel.set_border_width(10)
+        check = gtk.CheckButton(_('Render images in separate processes (after restart)'))
+        check.set_active(bool(preference.get(ka_preference.RENDER_PROCESSES)))
+        check.connect("toggled", self.on_render_processes_toggled)
+        process_panel.pack_start(check, expand=False, fill=False)
+        check = gtk.CheckButton(_('Show coarse previews while rendering'))
+        check.set_active(bool(preference.get(ka_preference.PROGRESSIVE)))
+        check.connect("toggled", self.on_progressive_toggled)
+        process_panel.pack_start(check, expand=False, fill=False)
+        ka_profile.set_enabled(preference.get(ka_preference.PROFILE))
+        check = gtk.CheckButton(_('Profile rendering'))
+        check.set_active(ka_profile.is_enabled())
+        check.connect("toggled", self.on_profile_toggled)
+        process_panel.pack_start(check, expand=False, fill=False)
+        page.pack_start(process_panel, expand=False, fill=True)
         
         self._widget_list.remember('statusPage', page)
         scrolled_window = gtk.ScrolledWindow(hadjustment=None, vadjustment=None)
@@ -143,3 +161,19 @@ class StatusController(object):
             preference.set(ka_preference.EXPORT_SIZE, (1000, 1000))
         preference.store()
         
+
+    def on_render_processes_toggled(self, widget):
+        preference = ka_preference.Preference.instance()
+        preference.set(ka_preference.RENDER_PROCESSES, widget.get_active())
+        preference.store()
+
+    def on_progressive_toggled(self, widget):
+        preference = ka_preference.Preference.instance()
+        preference.set(ka_preference.PROGRESSIVE, widget.get_active())
+        preference.store()
+
+    def on_profile_toggled(self, widget):
+        ka_profile.set_enabled(widget.get_active())
+        preference = ka_preference.Preference.instance()
+        preference.set(ka_preference.PROFILE, widget.get_active())
+        preference.store()
@@ -17,11 +17,11 @@
 
 from gettext import gettext as _
 
-import cairo
 import gtk
 
 import ka_debug
 import ka_task
+import ka_render
 import ka_controller
 
 class ZoomController(object):
@@ -102,9 +102,13 @@ class ZoomController(object):
         protozoon, dummy, width, height = \
                                              args[0], args[1], args[2], args[3]
 #        ka_debug.info('task_render entry: ')
-        self._surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
-        ctx = cairo.Context(self._surface)
-        protozoon.render(task, ctx, width, height)
+        def on_preview(preview):
+            self._surface = preview
+            task.progress(None)
+        surface = ka_render.render_progressive(task, protozoon, width, height,
+                                               on_preview)
+        if surface is not None:
+            self._surface = surface
 #        ka_debug.info('task_render exit: ')
 
     def start_calculation(self, zoom_protozoon):
@@ -114,7 +118,9 @@ class ZoomController(object):
             widget = self._widget_list.get_widget('zoomarea')
             task = ka_task.GeneratorTask(self.task_render,
                                          self.on_zoom_completed,
-                                         'zoomarea')
+                                         'zoomarea',
+                                         ka_task.PRIORITY_INTERACTIVE,
+                                         self.on_zoom_completed)
             task.start(self._protozoon, -1,
                        widget.allocation.width, widget.allocation.height)
 #            ka_debug.info('start_calculation %ux%u for %s' % 
@@ -125,10 +131,4 @@ class ZoomController(object):
         pre: widget is not None
         """
         if self._surface is not None:
-            ctx = ka_controller.create_context(widget)
-#            ctx.set_operator(cairo.OPERATOR_CLEAR)
-#            ctx.paint()
-            ctx.set_operator(cairo.OPERATOR_SOURCE)
-#            ctx.set_operator(cairo.OPERATOR_OVER)
-            ctx.set_source_surface(self._surface)
-            ctx.paint()
+            ka_controller.paint_surface(widget, self._surface)
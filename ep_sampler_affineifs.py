@@ -15,11 +15,14 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-import copy
+try:
+    import numpy
+except ImportError:
+    numpy = None
 import ka_utils
 import model_random
 import model_locus
-import model_allele
+import model_sampler
 import model_constraintpool
 from gettext import gettext as _
 import random
@@ -35,10 +38,14 @@ Y_STAMP_SIZE_CONSTRAINT = 'ystampsizeconstraint'
 
 MAX_TRANSFORMATIONS = 8
 MAX_MATCHER = 128
+# The first points of an orbit are not valid.
+SKIP_STEPS = 25
+# Points used to calculate the bounding box.
+MAXIMA_STEPS = 200
 
 
 
-class AffineIfsSampler(model_allele.Allele):
+class AffineIfsSampler(model_sampler.Sampler):
     """AffineIfsSampler: Affine iterated function system.
     inv: self.symmetry >= 0
     inv: self.num_transformations <= MAX_TRANSFORMATIONS
@@ -72,6 +79,11 @@ class AffineIfsSampler(model_allele.Allele):
              'min'   : 0.01, 'max': 0.25},
            ]
 
+    transient_members = model_sampler.Sampler.transient_members \
+                        + ['x_point', 'y_point', 'xmin', 'ymin', 'xmax', 'ymax',
+                           'tr_rand', 'matcher',
+                           'mta', 'mtb', 'mtc', 'mtd', 'mte', 'mtf', ]
+
     def __init__(self, trunk):
         """Constructor for Affine iterated function system."""
         super(AffineIfsSampler, self).__init__(trunk)
@@ -97,20 +109,6 @@ class AffineIfsSampler(model_allele.Allele):
         self.x_stamp_size = 1
         self.y_stamp_size = 1
 
-    def __deepcopy__ ( self,  memo ):
-        """Don't store transient members."""
-#        x = AffineIfsSampler(self.get_trunk())
-        x = self.__class__(self.get_trunk())
-        memo[id(self)] = x
-        # deep copy members
-        for n, v in self.__dict__.iteritems():
-            # do not copy transient members
-            if n not in ['x_point', 'y_point', 'xmin', 'ymin', 'xmax', 'ymax', \
-                         'tr_rand', 'matcher', \
-                         'mta', 'mtb', 'mtc', 'mtd', 'mte', 'mtf', ]:
-                setattr(x, n, copy.deepcopy(v, memo))
-        return x
-
     def __eq__(self, other):
         """Equality based persistent."""
         equal = isinstance(other, AffineIfsSampler) \
@@ -144,6 +142,7 @@ class AffineIfsSampler(model_allele.Allele):
     def randomize(self):
         """Randomize tranformations.
         """
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         symmetry_constraint = cpool.get(self, SYMMETRY_CONSTRAINT)
         #TODO symmetry 0, 25 Binominal
@@ -179,6 +178,7 @@ class AffineIfsSampler(model_allele.Allele):
 
     def mutate(self):
         """Mutate transformations."""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         #TODO self.pol_transf polar coordinaten mutieren
         if model_random.is_mutating():
@@ -219,6 +219,7 @@ class AffineIfsSampler(model_allele.Allele):
 
     def swap_places(self):
         """Exchange x- and y-stamp_size."""
+        self._invalidate_points()
         self.x_stamp_size, self.y_stamp_size = model_random.swap_parameters(self.x_stamp_size,
                                                              self.y_stamp_size)
 
@@ -382,81 +383,109 @@ class AffineIfsSampler(model_allele.Allele):
             trigger += 1.0 / MAX_MATCHER
             mix += 1
 
-    def _iterate(self):
-        """Calculate one iteration."""
-        tnumber = self.matcher[self.tr_rand.randrange(0, MAX_MATCHER)] \
-                                        if self.num_transformations > 1 else 0
-        tnumber = tnumber % self.num_transformations
-        x_tmp = self.x_point * self.mta[tnumber] \
-                + self.y_point * self.mtb[tnumber] + self.mte[tnumber]
-        y_tmp = self.x_point * self.mtc[tnumber] \
-                + self.y_point * self.mtd[tnumber] + self.mtf[tnumber]
-        self.x_point, self.y_point = x_tmp, y_tmp
-        if self.symmetry > 0:
-            angel  = 2.0 * math.pi * self.tr_rand.randint(0, self.symmetry-1) \
-                     / float(self.symmetry)
-            cosinus = math.cos(angel)
-            sinus   = math.sin(angel)
-            x_tmp = cosinus * self.x_point - sinus * self.y_point
-            y_tmp = sinus * self.x_point + cosinus * self.y_point
-            self.x_point = x_tmp
-            self.y_point = -y_tmp if self.Dn > 0 and self.tr_rand.randrange(0, 2) == 0 \
-                                  else y_tmp
-        return tnumber
-
-    def _skip(self):
-        """The first values from this iteration are not valid."""
-        loop = 0
-        while loop < 25:
-            self._iterate()
-            loop += 1
-
-    def _maxima(self):
-        """Iterate and calculate maxima"""
-        self._iterate()
-        self.xmin = self.x_point
-        self.ymin = self.y_point
-        self.xmax = self.x_point
-        self.ymax = self.y_point
-        loop = 0
-        while loop < 199:
-            self._iterate()
-            if self.x_point < self.xmin:
-                self.xmin = self.x_point
-            if self.y_point < self.ymin:
-                self.ymin = self.y_point
-            if self.x_point > self.xmax:
-                self.xmax = self.x_point
-            if self.y_point > self.ymax:
-                self.ymax = self.y_point
-            loop += 1
-
-    def _enumerate_points(self):
-        """Iterate and collect sample points"""
+    def _draw_steps(self, steps):
+        """Draw the random choices of all iteration steps.
+        Random numbers are drawn in the same order as a step by step iteration
+        would do. Returns one tuple (tnumber, cosinus, sinus, reflect) per step.
+        """
+        tr_rand = self.tr_rand
+        matcher = self.matcher
+        num_transformations = self.num_transformations
+        symmetry = self.symmetry
+        rotations = [(math.cos(2.0 * math.pi * rix / float(symmetry)),
+                      math.sin(2.0 * math.pi * rix / float(symmetry)))
+                     for rix in range(symmetry)]
+        draws = []
+        for dummy in xrange(steps):
+            tnumber = matcher[tr_rand.randrange(0, MAX_MATCHER)] \
+                                            if num_transformations > 1 else 0
+            tnumber = tnumber % num_transformations
+            if symmetry > 0:
+                cosinus, sinus = rotations[tr_rand.randint(0, symmetry-1)]
+                reflect = self.Dn > 0 and tr_rand.randrange(0, 2) == 0
+                draws.append((tnumber, cosinus, sinus, reflect))
+            else:
+                draws.append((tnumber, 1.0, 0.0, False))
+        return draws
+
+    def _iterate_python(self, draws):
+        """Calculate the orbit one step after the other."""
+        x_point, y_point = self.x_point, self.y_point
+        mta, mtb, mtc, mtd, mte, mtf = self.mta, self.mtb, self.mtc, \
+                                       self.mtd, self.mte, self.mtf
+        orbit = []
+        for tnumber, cosinus, sinus, reflect in draws:
+            x_tmp = x_point * mta[tnumber] + y_point * mtb[tnumber] + mte[tnumber]
+            y_tmp = x_point * mtc[tnumber] + y_point * mtd[tnumber] + mtf[tnumber]
+            x_point = cosinus * x_tmp - sinus * y_tmp
+            y_point = sinus * x_tmp + cosinus * y_tmp
+            if reflect:
+                y_point = -y_point
+            orbit.append((x_point, y_point))
+        return orbit
+
+    def _iterate_numpy(self, draws):
+        """Calculate the whole orbit with a parallel prefix scan.
+        Each step is an affine map. Composing all maps up to step n and
+        applying the result to the start point gives the n-th point.
+        """
+        tnumbers = numpy.array([draw[0] for draw in draws])
+        cosinus = numpy.array([draw[1] for draw in draws])
+        sinus = numpy.array([draw[2] for draw in draws])
+        flip = numpy.where([draw[3] for draw in draws], -1.0, 1.0)
+        mta, mtb, mtc, mtd, mte, mtf = [numpy.array(coefficients)[tnumbers]
+                       for coefficients in (self.mta, self.mtb, self.mtc,
+                                            self.mtd, self.mte, self.mtf)]
+        # rotate and reflect after transforming
+        map_a = cosinus * mta - sinus * mtc
+        map_b = cosinus * mtb - sinus * mtd
+        map_c = flip * (sinus * mta + cosinus * mtc)
+        map_d = flip * (sinus * mtb + cosinus * mtd)
+        map_e = cosinus * mte - sinus * mtf
+        map_f = flip * (sinus * mte + cosinus * mtf)
+        shift = 1
+        while shift < len(draws):
+            # compose each map with the map 'shift' steps before
+            pa, pb, pc, pd, pe, pf = [prior[:-shift].copy() for prior in
+                           (map_a, map_b, map_c, map_d, map_e, map_f)]
+            la, lb, lc, ld = map_a[shift:].copy(), map_b[shift:].copy(), \
+                             map_c[shift:].copy(), map_d[shift:].copy()
+            map_a[shift:] = la * pa + lb * pc
+            map_b[shift:] = la * pb + lb * pd
+            map_c[shift:] = lc * pa + ld * pc
+            map_d[shift:] = lc * pb + ld * pd
+            map_e[shift:] += la * pe + lb * pf
+            map_f[shift:] += lc * pe + ld * pf
+            shift *= 2
+        x_orbit = map_a * self.x_point + map_b * self.y_point + map_e
+        y_orbit = map_c * self.x_point + map_d * self.y_point + map_f
+        return zip(x_orbit.tolist(), y_orbit.tolist())
+
+    def _calculate_points(self):
+        """Skip the first points of the orbit, use the following points to
+        calculate the bounding box and scale the remaining points into it.
+        """
+        self._prepare_transient_members()
+        draws = self._draw_steps(SKIP_STEPS + MAXIMA_STEPS + self.orbits)
+        if numpy is not None:
+            orbit = self._iterate_numpy(draws)
+        else:
+            orbit = self._iterate_python(draws)
+        bounding = orbit[SKIP_STEPS:SKIP_STEPS+MAXIMA_STEPS]
+        self.xmin = min([point[0] for point in bounding])
+        self.xmax = max([point[0] for point in bounding])
+        self.ymin = min([point[1] for point in bounding])
+        self.ymax = max([point[1] for point in bounding])
         x_delta, y_delta = self.xmax - self.xmin, self.ymax - self.ymin
         sample_points = []
         if x_delta > 0.001 and y_delta > 0.001:
-            loop = 0
-            while loop < self.orbits:
-                tnumber = self._iterate()
-                x_rel = (self.x_point - self.xmin) / x_delta
-                y_rel = (self.y_point - self.ymin) / y_delta
+            for x_point, y_point in orbit[SKIP_STEPS+MAXIMA_STEPS:]:
+                x_rel = (x_point - self.xmin) / x_delta
+                y_rel = (y_point - self.ymin) / y_delta
 #TODO dritter parameter            sample_points.append( (x_rel-0.5, y_rel-0.5, tnumber) )
                 sample_points.append( (x_rel-0.5, y_rel-0.5) )
-                loop += 1
         return sample_points
 
-    def get_sample_points(self):
-        """ Produces a list of sampling points.
-        """
-#        self.tr_rand = random.Random(self.random_seed)
-#        self.x_point, self.y_point = 0.5, 0.5
-        #transient members
-        self._prepare_transient_members()
-        self._skip()
-        self._maxima()
-        return self._enumerate_points()
-
     def get_sample_extent(self):
         """'Size' of one sample as a fraction of 1.
         """
@@ -70,11 +70,11 @@ class CenteredWalkSampler(ep_sampler_randomwalk.RandomWalkSampler):
             return -1
         return 0
 
-    def get_sample_points(self):
+    def _calculate_points(self):
         """ Produces a list of sampling points.
         The points describes an random walk starting near (0.5, 0.5).
         """
-        sample_points = super(CenteredWalkSampler, self).get_sample_points()
+        sample_points = super(CenteredWalkSampler, self)._calculate_points()
         sample_points.sort(cmp=CenteredWalkSampler._numeric_compare,
                            reverse=False)
         return sample_points
@@ -18,7 +18,7 @@
 import ka_utils
 import model_random
 import model_locus
-import model_allele
+import model_sampler
 import model_constraintpool
 from gettext import gettext as _
 import math
@@ -29,7 +29,7 @@ STEPS_CONSTRAINT = 'stepsconstraint'
 ANGLE_CONSTRAINT = 'angleconstraint'
 C_CONSTRAINT = 'cconstraint'
 
-class FermatSpiralSampler(model_allele.Allele):
+class FermatSpiralSampler(model_sampler.Sampler):
     """FermatSpiralSampler: Reverse the layer horizontally or vertically.
     """
 
@@ -78,6 +78,7 @@ class FermatSpiralSampler(model_allele.Allele):
 
     def randomize(self):
         """Randomize"""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         x_center_constraint = cpool.get(self, X_CENTER_CONSTRAINT)
         self.x_center = model_random.uniform_constrained(x_center_constraint)
@@ -93,6 +94,7 @@ class FermatSpiralSampler(model_allele.Allele):
 
     def mutate(self):
         """Mutate"""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         x_center_constraint = cpool.get(self, X_CENTER_CONSTRAINT)
         self.x_center = model_random.jitter_constrained(self.x_center,
@@ -114,6 +116,7 @@ class FermatSpiralSampler(model_allele.Allele):
 
     def swap_places(self):
         """Exchange x- and y-center."""
+        self._invalidate_points()
         self.x_center, self.y_center = model_random.swap_parameters(self.x_center,
                                                                     self.y_center)
 
@@ -136,7 +139,7 @@ class FermatSpiralSampler(model_allele.Allele):
         new_one.c = self.c if cross_sequence[5] else other.c
         return new_one
 
-    def get_sample_points(self):
+    def _calculate_points(self):
         """Produces a list of sampling points.
         """
         sample_points = []
@@ -18,7 +18,7 @@
 import ka_utils
 import model_random
 import model_locus
-import model_allele
+import model_sampler
 import model_constraintpool
 from gettext import gettext as _
 import math
@@ -30,7 +30,7 @@ STEPS_CONSTRAINT = 'stepsconstraint'
 A_CONSTRAINT = 'aconstraint'
 B_CONSTRAINT = 'bconstraint'
 
-class LogarithmicSpiralSampler(model_allele.Allele):
+class LogarithmicSpiralSampler(model_sampler.Sampler):
     """LogarithmicSpiralSampler: Reverse the layer horizontally or vertically.
     inv: self.a >= 0.0
     inv: self.b >= 0.0
@@ -86,6 +86,7 @@ class LogarithmicSpiralSampler(model_allele.Allele):
 
     def randomize(self):
         """Randomize"""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         x_center_constraint = cpool.get(self, X_CENTER_CONSTRAINT)
         self.x_center = model_random.uniform_constrained(x_center_constraint)
@@ -102,6 +103,7 @@ class LogarithmicSpiralSampler(model_allele.Allele):
 
     def mutate(self):
         """Mutate"""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         x_center_constraint = cpool.get(self, X_CENTER_CONSTRAINT)
         self.x_center = model_random.jitter_constrained(self.x_center,
@@ -123,6 +125,7 @@ class LogarithmicSpiralSampler(model_allele.Allele):
 
     def swap_places(self):
         """Exchange x- and y-center."""
+        self._invalidate_points()
         self.x_center, self.y_center = model_random.swap_parameters(self.x_center,
                                                                     self.y_center)
 
@@ -145,7 +148,7 @@ class LogarithmicSpiralSampler(model_allele.Allele):
         new_one.b = self.b if cross_sequence[5] else other.b
         return new_one
 
-    def get_sample_points(self):
+    def _calculate_points(self):
         """ Produces a list of sampling points.
         """
         sample_points = []
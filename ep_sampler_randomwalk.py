@@ -23,13 +23,13 @@ import ka_debug
 import ka_utils
 import model_random
 import model_locus
-import model_allele
+import model_sampler
 import model_constraintpool
 import exon_direction
 
 SECTIONS_CONSTRAINT = 'sectionsconstraint'
 
-class RandomWalkSampler(model_allele.Allele):
+class RandomWalkSampler(model_sampler.Sampler):
     """RandomWalkSampler: 
     inv: len(self.direction_steps) > 0
     """
@@ -63,6 +63,7 @@ class RandomWalkSampler(model_allele.Allele):
 
     def randomize(self):
         """Randomizes the walk."""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         sections_constraint = cpool.get(self, SECTIONS_CONSTRAINT)
         for dummy in range(model_random.randint_constrained(sections_constraint)):
@@ -72,6 +73,7 @@ class RandomWalkSampler(model_allele.Allele):
 
     def mutate(self):
         """Mutates the random walk."""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         sections_constraint = cpool.get(self, SECTIONS_CONSTRAINT)
         if model_random.is_mutating():
@@ -80,6 +82,7 @@ class RandomWalkSampler(model_allele.Allele):
 
     def swap_places(self):
         """Reorder steps."""
+        self._invalidate_points()
         model_random.swap_places(self.direction_steps)
 
     def crossingover(self, other):
@@ -96,7 +99,7 @@ class RandomWalkSampler(model_allele.Allele):
                                                               other.direction_steps)
         return new_one
 
-    def get_sample_points(self):
+    def _calculate_points(self):
         """ Produces a list of sampling points.
         The points describes an random walk starting near (0.0, 0.0).
         """
@@ -18,14 +18,14 @@
 import ka_utils
 import model_random
 import model_locus
-import model_allele
+import model_sampler
 import model_constraintpool
 from gettext import gettext as _
 
 X_TILES_CONSTRAINT = 'xtilesconstraint'
 Y_TILES_CONSTRAINT = 'ytilesconstraint'
 
-class RectilinearGridSampler(model_allele.Allele):
+class RectilinearGridSampler(model_sampler.Sampler):
     """RectilinearGridSampler: Reverse the layer horizontally or vertically.
     inv: self.x_tiles > 0
     inv: self.y_tiles > 0
@@ -56,6 +56,7 @@ class RectilinearGridSampler(model_allele.Allele):
 
     def randomize(self):
         """Randomizes the number of tiles."""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         x_tiles_constraint = cpool.get(self, X_TILES_CONSTRAINT)
         self.x_tiles = model_random.randint_constrained(x_tiles_constraint)
@@ -64,6 +65,7 @@ class RectilinearGridSampler(model_allele.Allele):
 
     def mutate(self):
         """Mutates the number of tiles."""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         if model_random.is_mutating():
             x_tiles_constraint = cpool.get(self, X_TILES_CONSTRAINT)
@@ -76,6 +78,7 @@ class RectilinearGridSampler(model_allele.Allele):
 
     def swap_places(self):
         """Exchange x- and y-tiles."""
+        self._invalidate_points()
         self.x_tiles, self.y_tiles = model_random.swap_parameters(self.x_tiles,
                                                              self.y_tiles)
 
@@ -94,7 +97,7 @@ class RectilinearGridSampler(model_allele.Allele):
         new_one.y_tiles = self.y_tiles if cross_sequence[1] else other.y_tiles
         return new_one
 
-    def get_sample_points(self):
+    def _calculate_points(self):
         """ Produces a list of sampling points.
         """
         sample_points = []
@@ -18,13 +18,13 @@
 import ka_utils
 import model_random
 import model_locus
-import model_allele
+import model_sampler
 import model_constraintpool
 from gettext import gettext as _
 
 TILES_CONSTRAINT = 'tilesconstraint'
 
-class SquareGridSampler(model_allele.Allele):
+class SquareGridSampler(model_sampler.Sampler):
     """SquareGridSampler: Reverse the layer horizontally or vertically.
     inv: self.tiles > 0
     """
@@ -48,12 +48,14 @@ class SquareGridSampler(model_allele.Allele):
 
     def randomize(self):
         """Randomizes the number of tiles."""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         tiles_constraint = cpool.get(self, TILES_CONSTRAINT)
         self.tiles = model_random.randint_constrained(tiles_constraint)
 
     def mutate(self):
         """Mutates the number of tiles."""
+        self._invalidate_points()
         cpool = model_constraintpool.ConstraintPool.get_pool()
         if model_random.is_mutating():
             tiles_constraint = cpool.get(self, TILES_CONSTRAINT)
@@ -77,7 +79,7 @@ class SquareGridSampler(model_allele.Allele):
         new_one.tiles = self.tiles if cross_sequence[0] else other.tiles
         return new_one
 
-    def get_sample_points(self):
+    def _calculate_points(self):
         """Produces a list of sampling points.
         """
         sample_points = []
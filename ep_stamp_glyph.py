@@ -18,6 +18,7 @@
 import unicodedata
 import random
 import cairo
+import ka_glyphatlas
 import model_random
 import model_locus
 import model_allele
@@ -219,6 +220,18 @@ class GlyphStamp(model_allele.Allele):
         pre: len(point) == 2
         """
         uc = self.unichr_list[self.mapping[state % len(self.mapping)] % len(self.unichr_list)]
+        matrix = ctx.get_matrix()
+        scale_x, skew_y = matrix.transform_distance(1.0, 0.0)
+        skew_x, scale_y = matrix.transform_distance(0.0, 1.0)
+        if skew_x == 0.0 and skew_y == 0.0 \
+           and scale_x != 0.0 and scale_y != 0.0 and self.size > 0.0:
+            # flipping is done by the context, the mask is never mirrored
+            glyph = ka_glyphatlas.GlyphAtlas.instance().get(self.family,
+                                        self.size, uc,
+                                        round(abs(scale_x), 3),
+                                        round(abs(scale_y), 3))
+            glyph.stamp(ctx, point[0], point[1])
+            return
         ctx.select_font_face(self.family,
                              cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
         ctx.set_font_size(self.size)
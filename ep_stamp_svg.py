@@ -17,10 +17,15 @@
 
 from gettext import gettext as _
 
+import os
+import math
 import random
+import threading
+import cairo
 import rsvg
 
 import ka_debug
+import ka_cache
 import model_random
 import model_locus
 import model_allele
@@ -30,6 +35,57 @@ import ka_importer
 STAMPREPEATER_CONSTRAINT = 'stamprepaeterconstraint'
 THEME_CONSTRAINT = 'themeconstraint'
 
+# SVG files are drawn in a 100 by 100 units area.
+SVG_EXTENT = 100.0
+# Parsed SVG files kept in memory.
+HANDLE_CAPACITY = 64
+# Memory budget for pre rasterized stamps in bytes.
+IMAGE_BUDGET = 8 * 1024 * 1024
+# Bigger stamps are drawn as vector graphics.
+MAX_IMAGE_SIZE = 512
+
+# rsvg handles must not be used by more than one thread at a time.
+_svg_lock = threading.Lock()
+_handle_cache = ka_cache.LruCache(HANDLE_CAPACITY)
+_image_cache = ka_cache.LruCache(IMAGE_BUDGET, ka_cache.surface_size)
+
+def clear_cache():
+    """Forget all parsed and rasterized SVG files."""
+    _svg_lock.acquire()
+    try:
+        _handle_cache.clear()
+        _image_cache.clear()
+    finally:
+        _svg_lock.release()
+
+def _get_handle(svg_pathname, mtime):
+    """Returns parsed SVG file. Caller must hold _svg_lock."""
+    key = (svg_pathname, mtime)
+    svg = _handle_cache.get(key)
+    if svg is None:
+        svg = rsvg.Handle(file=svg_pathname)
+        _handle_cache.put(key, svg)
+    return svg
+
+def _get_image(svg_pathname, mtime, pixel_width, pixel_height):
+    """Returns SVG file rendered to an image of the given size.
+    pre: pixel_width > 0 and pixel_height > 0
+    """
+    key = (svg_pathname, mtime, pixel_width, pixel_height)
+    image = _image_cache.get(key)
+    if image is None:
+        image = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                   pixel_width, pixel_height)
+        image_ctx = cairo.Context(image)
+        image_ctx.scale(pixel_width / SVG_EXTENT, pixel_height / SVG_EXTENT)
+        _svg_lock.acquire()
+        try:
+            _get_handle(svg_pathname, mtime).render_cairo(image_ctx)
+        finally:
+            _svg_lock.release()
+        _image_cache.put(key, image)
+    return image
+
 class SvgStamp(model_allele.Allele):
     """SvgStamp:.
     inv: self.max_states >= 0
@@ -44,10 +100,14 @@ class SvgStamp(model_allele.Allele):
             {'bind'  : THEME_CONSTRAINT,
              'name'  : 'Permitted themes for stamps',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_importer.get_theme_list()
+             'enum'  : lambda: ka_importer.get_theme_list()
             },
            ]
 
+    # Stamp extent is set by the layer just before rendering.
+    # Modification times of the SVG files are looked up once per rendering.
+    transient_members = ['dw', 'dh', '_mtimes']
+
     def __init__(self, trunk, maxstates):
         """Constructor for a flip merger.
         pre: maxstates >= 0
@@ -60,6 +120,12 @@ class SvgStamp(model_allele.Allele):
         self.mapping = [ix for ix in range(len(svg_image_list))]
         self.repeating = [1 for ix in range(self.max_states)]
 
+    def __setstate__(self, state):
+        """Decoded stamps have no extent, it is not stored."""
+        super(SvgStamp, self).__setstate__(state)
+        self.__dict__.setdefault('dw', 1.0)
+        self.__dict__.setdefault('dh', 1.0)
+
     def __eq__(self, other):
         """Equality based on radius."""
         equal = isinstance(other, SvgStamp) \
@@ -153,8 +219,18 @@ class SvgStamp(model_allele.Allele):
         return new_one
     
     def set_stamp_extent(self, dw, dh):
-        """Set extent of stamp."""
+        """Set extent of stamp. Called once before each rendering."""
         self.dw, self.dh = dw, dh
+        self._mtimes = {}
+
+    def _get_mtime(self, svg_pathname):
+        """Modification time of a SVG file, asked once per rendering."""
+        mtimes = self.__dict__.setdefault('_mtimes', {})
+        mtime = mtimes.get(svg_pathname, None)
+        if mtime is None:
+            mtime = os.path.getmtime(svg_pathname)
+            mtimes[svg_pathname] = mtime
+        return mtime
 
     def render(self, ctx, point, state):
         """
@@ -170,16 +246,43 @@ class SvgStamp(model_allele.Allele):
                                           % len(svg_image_list)]
                 ctx.save()
 #                ka_debug.matrix_s(ctx.get_matrix())
-                svg = rsvg.Handle(file=svg_pathname)
                 ctx.translate(-self.dw/2.0+point[0], -self.dh/2.0+point[1])
 #                ka_debug.matrix(ctx.get_matrix())
-                ctx.scale(self.dw/100.0, self.dh/100.0)
-#                ka_debug.matrix(ctx.get_matrix())
-                svg.render_cairo(ctx)
-                svg.close()
+                self._render_svg(ctx, svg_pathname)
 #                ka_debug.matrix_r(ctx.get_matrix())
                 ctx.restore()
 
+    def _render_svg(self, ctx, svg_pathname):
+        """Draw SVG file into the stamp area starting at the current origin.
+        Stamps are pre rasterized at device resolution if the context is
+        neither rotated nor skewed.
+        """
+        mtime = self._get_mtime(svg_pathname)
+        matrix = ctx.get_matrix()
+        xy, yx = matrix.transform_distance(0.0, 1.0)[0], \
+                 matrix.transform_distance(1.0, 0.0)[1]
+        device_width, device_height = ctx.user_to_device_distance(self.dw,
+                                                                  self.dh)
+        pixel_width = int(math.ceil(abs(device_width)))
+        pixel_height = int(math.ceil(abs(device_height)))
+        if xy == 0.0 and yx == 0.0 \
+           and 0 < pixel_width <= MAX_IMAGE_SIZE \
+           and 0 < pixel_height <= MAX_IMAGE_SIZE:
+            image = _get_image(svg_pathname, mtime, pixel_width, pixel_height)
+            ctx.scale(self.dw/pixel_width, self.dh/pixel_height)
+            ctx.set_operator(cairo.OPERATOR_OVER)
+            ctx.set_source_surface(image, 0.0, 0.0)
+            ctx.rectangle(0.0, 0.0, pixel_width, pixel_height)
+            ctx.fill()
+        else:
+            ctx.scale(self.dw/SVG_EXTENT, self.dh/SVG_EXTENT)
+#            ka_debug.matrix(ctx.get_matrix())
+            _svg_lock.acquire()
+            try:
+                _get_handle(svg_pathname, mtime).render_cairo(ctx)
+            finally:
+                _svg_lock.release()
+
     def explain(self):
         """
         post: len(__return__) == 3
@@ -34,7 +34,7 @@ class Buzzword(model_allele.Allele):
     cdef = [{'bind'  : BUZZWORD_CONSTRAINTS,
              'name'  : 'Buzzwords',
              'domain': model_constraintpool.STRING_1_OF_N,
-             'enum'  : ka_extensionpoint.list_extensions(BUZZWORD_CONSTRAINTS)
+             'enum'  : lambda: ka_extensionpoint.list_extensions(BUZZWORD_CONSTRAINTS)
             },
            ]
 
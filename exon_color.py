@@ -26,6 +26,18 @@ import model_allele
 EPSILON = 0.00001
 COLOR_CONSTRAINT = 'colorconstraint'
 
+# Color constraints have no state of their own.
+# All colors share one instance for each kind of constraint.
+_shared_constraints = {}
+
+def _get_constraint(constraint_name):
+    """Returns the shared color constraint."""
+    constraint = _shared_constraints.get(constraint_name, None)
+    if constraint is None:
+        constraint = ka_extensionpoint.create(constraint_name, '/')
+        _shared_constraints[constraint_name] = constraint
+    return constraint
+
 class Color(model_allele.Allele):
     """Color
     inv: len(self.rgba) == 4
@@ -38,10 +50,13 @@ class Color(model_allele.Allele):
     cdef = [{'bind'  : COLOR_CONSTRAINT,
              'name'  : 'Color constraint',
              'domain': model_constraintpool.STRING_1_OF_N,
-             'enum'  : ka_extensionpoint.list_extensions(COLOR_CONSTRAINT)
+             'enum'  : lambda: ka_extensionpoint.list_extensions(COLOR_CONSTRAINT)
             },
            ]
 
+    __slots__ = ['constraint', 'rgba', 'base_diff_hue',
+                 'base_diff_lightness', 'base_diff_saturation']
+
     def __init__(self, trunk, red, green, blue, alpha):
         """Color constructor
         pre: 0.0 <= red <= 1.0
@@ -52,7 +67,7 @@ class Color(model_allele.Allele):
         super(Color, self).__init__(trunk)
         cpool = model_constraintpool.ConstraintPool.get_pool()
         constraint_name = cpool.get(self, COLOR_CONSTRAINT)[0]
-        self.constraint = ka_extensionpoint.create(constraint_name, self.path)
+        self.constraint = _get_constraint(constraint_name)
         self.rgba = self.constraint.filter((red, green, blue, alpha))
         self.base_diff_hue = 0 
         self.base_diff_lightness = 0 
@@ -80,11 +95,9 @@ class Color(model_allele.Allele):
         #TODO prefer a single constraint
         #TODO Remove pushing colorconstraint_none by a more generalized solution 
         if 'colorconstraint_none' in constraints and random.random() < 0.5:
-            self.constraint = ka_extensionpoint.create(random.choice(['colorconstraint_none']),
-                                                       self.path)
+            self.constraint = _get_constraint('colorconstraint_none')
         else:
-            self.constraint = ka_extensionpoint.create(random.choice(constraints),
-                                                       self.path)
+            self.constraint = _get_constraint(random.choice(constraints))
         self.rgba = self.constraint.randomize()
 
     def mutate(self):
@@ -93,8 +106,7 @@ class Color(model_allele.Allele):
             if model_random.is_mutating():
                 cpool = model_constraintpool.ConstraintPool.get_pool()
                 constraints = cpool.get(self, COLOR_CONSTRAINT)
-                self.constraint = ka_extensionpoint.create(
-                                        random.choice(constraints), self.path)
+                self.constraint = _get_constraint(random.choice(constraints))
             self.rgba = self.constraint.mutate(self.rgba)
 
     def swap_places(self):
@@ -121,7 +133,7 @@ class Color(model_allele.Allele):
         new_one.rgba = (self.rgba[0], self.rgba[1], self.rgba[2], self.rgba[3])
         new_one.constraint = self.constraint
         # upgrade from a release older than 'v4'
-        if self.__dict__.has_key('base_diff_hue'):
+        if hasattr(self, 'base_diff_hue'):
             new_one.base_diff_hue = self.base_diff_hue 
             new_one.base_diff_lightness = self.base_diff_lightness 
             new_one.base_diff_saturation = self.base_diff_saturation
@@ -37,10 +37,12 @@ class Direction(model_allele.Allele):
     cdef = [{'bind'  : DIRECTION_CONSTRAINT,
              'name'  : 'Direction constraint',
              'domain': model_constraintpool.STRING_1_OF_N,
-             'enum'  : ka_extensionpoint.list_extensions(DIRECTION_CONSTRAINT)
+             'enum'  : lambda: ka_extensionpoint.list_extensions(DIRECTION_CONSTRAINT)
             },
            ]
 
+    __slots__ = ['constraint', 'radian', 'offset']
+
     def __init__(self, trunk, radian, offset):
         """Direction constructor
         """
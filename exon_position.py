@@ -35,10 +35,12 @@ class Position(model_allele.Allele):
     cdef = [{'bind'  : POSITION_CONSTRAINT,
              'name'  : 'Position',
              'domain': model_constraintpool.STRING_1_OF_N,
-             'enum'  : ka_extensionpoint.list_extensions(POSITION_CONSTRAINT)
+             'enum'  : lambda: ka_extensionpoint.list_extensions(POSITION_CONSTRAINT)
             },
            ]
 
+    __slots__ = ['constraint', 'x_pos', 'y_pos']
+
     def __init__(self, trunk, x_pos, y_pos):
         """Position constructor
         """
@@ -0,0 +1,130 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Headless batch renderer.
+Renders every protozoon of saved Kandid populations to PNG files.
+Runs without GTK, Sugar or D-Bus, so it can be used on a render farm.
+
+    python ka_batchrender.py -s 800 -o /tmp/out population.kandid ...
+"""
+
+import os
+import sys
+import time
+import traceback
+from optparse import OptionParser
+
+import cairo
+
+import ka_debug
+import ka_render
+import model_population
+
+def render_job(job):
+    """Render a single protozoon to a PNG file. Executed inside a worker
+    process. Returns target path, seconds used and an error message.
+    """
+    code_element, width, height, png_path = job
+    start = time.time()
+    try:
+        protozoon = model_population.from_buffer(code_element)
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        ctx = cairo.Context(surface)
+        protozoon.render(ka_render.DetachedTask(png_path), ctx, width, height)
+        surface.write_to_png(png_path)
+        return png_path, time.time() - start, None
+    except:
+        traceback.print_exc(file=sys.__stderr__)
+        return png_path, time.time() - start, \
+               '%s %s' % (sys.exc_info()[0], sys.exc_info()[1])
+
+def collect_jobs(file_list, output_dir, size):
+    """Create a rendering job for each protozoon found in the population
+    files. Returns list of jobs and number of unreadable files.
+    """
+    jobs, failed = [], 0
+    for file_path in file_list:
+        model = model_population.read_file(file_path)
+        if model is None:
+            ka_debug.err('no population in [%s]' % file_path)
+            failed += 1
+            continue
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        for index, protozoon in enumerate(model.protozoans):
+            png_path = os.path.join(output_dir,
+                                    '%s_%02u.png' % (base_name, index))
+            jobs.append((model_population.to_buffer(protozoon),
+                         size, size, png_path))
+    return jobs, failed
+
+def run_jobs(jobs, processes):
+    """Render all jobs, using a pool of processes if more than one is wanted.
+    Yields result tuples in order of completion.
+    """
+    if processes > 1 and len(jobs) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=processes)
+        try:
+            for result in pool.imap_unordered(render_job, jobs):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            yield render_job(job)
+
+def _default_processes():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except:
+        return 1
+
+def main(argv):
+    parser = OptionParser(usage='%prog [options] population_file ...')
+    parser.add_option('-s', '--size', type='int', dest='size', default=400,
+                      help='width and height of the images in pixels')
+    parser.add_option('-o', '--output', dest='output', default='.',
+                      help='folder for the PNG files')
+    parser.add_option('-j', '--jobs', type='int', dest='processes',
+                      default=_default_processes(),
+                      help='number of rendering processes')
+    options, file_list = parser.parse_args(argv)
+    if len(file_list) == 0:
+        parser.error('no population file given')
+    if options.size < 1 or options.processes < 1:
+        parser.error('size and number of jobs must be positive')
+    if not os.path.isdir(options.output):
+        os.makedirs(options.output)
+
+    jobs, failed = collect_jobs(file_list, options.output, options.size)
+    start = time.time()
+    rendered = 0
+    for png_path, seconds, error in run_jobs(jobs, options.processes):
+        if error is None:
+            rendered += 1
+            print '%8.3f s  %s' % (seconds, png_path)
+        else:
+            failed += 1
+            print '  failed  %s  %s' % (png_path, error)
+    print '%u images in %.3f s, %u failures' % \
+          (rendered, time.time() - start, failed)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,224 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Rendering benchmark.
+Protozoa are built from a seeded random generator, so every run renders
+exactly the same images. Each layer, sampler, stamp, merger and modifier
+type is measured on its own, followed by some deep trees mixing all types.
+Results are written as JSON so runs can be compared over time.
+
+    python ka_benchmark.py -s 100,400 -r 3 -o benchmark.json
+"""
+
+import sys
+import time
+import json
+import random
+import platform
+from optparse import OptionParser
+
+import cairo
+
+import ka_cache
+import ka_factory
+import ka_render
+import ka_profile
+import ka_glyphatlas
+import ka_layoutcache
+import ka_extensionpoint
+import model_protozoon
+import model_treenode
+import model_sampler
+import model_constraintpool
+import ep_stamp_svg
+
+# Layers painting stamps at sampled points. Used for sampler and stamp cases.
+STAMPING_LAYER = 'voronoidiagram'
+# Render mode of the stamping layer. Raster mode neither samples nor stamps.
+RENDERMODE_CONSTRAINT = 'rendermodeconstraint'
+RENDERMODE_STAMPS = 0
+
+class BenchmarkCase(object):
+    """Describes how to build one deterministic protozoon."""
+
+    def __init__(self, name, category, constraints, single_child=False):
+        """
+        pre: len(name) > 0
+        """
+        self.name = name
+        self.category = category
+        self.constraints = constraints
+        self.single_child = single_child
+
+    def build(self, seed):
+        """Create protozoon. Constraints restrict the permitted gene types.
+        post: __return__ is not None
+        """
+        cpool = model_constraintpool.ConstraintPool.get_pool()
+        cpool.clear_all()
+        for attribute_key, constraint in self.constraints.iteritems():
+            cpool.set('*', attribute_key, constraint)
+        random.seed(seed)
+        protozoon = model_protozoon.Protozoon()
+        protozoon.randomize()
+        if self.single_child:
+            # a single child node will be rendered by the modifier
+            root = protozoon.treenode
+            root.right_treenode = None
+            root.left_treenode = model_treenode.TreeNode(root.path)
+            root.left_treenode.path += 'Left'
+            root.left_treenode.randomize()
+        cpool.clear_all()
+        return protozoon
+
+def _single_node():
+    return {model_treenode.NUMBER_OF_LAYERS_CONSTRAINT: (0, 0)}
+
+def list_cases():
+    """All benchmark cases, ordered by category."""
+    cases = []
+    for key in ka_factory.get_factory('layer').keys():
+        constraints = _single_node()
+        constraints[model_treenode.LAYERTYPE_CONSTRAINT] = [key]
+        cases.append(BenchmarkCase('layer_' + key, 'layer', constraints))
+    for key in ka_factory.get_factory('sampler').keys():
+        constraints = _single_node()
+        constraints[model_treenode.LAYERTYPE_CONSTRAINT] = [STAMPING_LAYER]
+        constraints[RENDERMODE_CONSTRAINT] = [RENDERMODE_STAMPS]
+        constraints['samplertypeconstraint'] = [key]
+        cases.append(BenchmarkCase('sampler_' + key, 'sampler', constraints))
+    for key in ka_factory.get_factory('stamp').keys():
+        constraints = _single_node()
+        constraints[model_treenode.LAYERTYPE_CONSTRAINT] = [STAMPING_LAYER]
+        constraints[RENDERMODE_CONSTRAINT] = [RENDERMODE_STAMPS]
+        constraints['stamptypeconstraint'] = [key]
+        cases.append(BenchmarkCase('stamp_' + key, 'stamp', constraints))
+    for key in ka_factory.get_factory('merger').keys():
+        constraints = {model_treenode.NUMBER_OF_LAYERS_CONSTRAINT: (1, 1),
+                       model_treenode.MERGERTYPE_CONSTRAINT: [key]}
+        cases.append(BenchmarkCase('merger_' + key, 'merger', constraints))
+    for key in ka_factory.get_factory('modifier').keys():
+        constraints = _single_node()
+        constraints[model_treenode.MODIFIERTYPE_CONSTRAINT] = [key]
+        cases.append(BenchmarkCase('modifier_' + key, 'modifier',
+                                   constraints, single_child=True))
+    for depth in [2, 3, 4]:
+        constraints = {model_treenode.NUMBER_OF_LAYERS_CONSTRAINT:
+                                                              (depth, depth)}
+        cases.append(BenchmarkCase('tree_depth_%u' % depth, 'tree',
+                                   constraints))
+    return cases
+
+def clear_caches():
+    """Forget everything remembered from earlier renderings."""
+    ka_cache.SurfaceCache.instance().clear()
+    ka_cache.SurfaceCache.subtree_instance().clear()
+    model_sampler.clear_point_cache()
+    ep_stamp_svg.clear_cache()
+    ka_glyphatlas.GlyphAtlas.instance().clear()
+    ka_layoutcache.LayoutCache.instance().clear()
+
+def time_render(protozoon, size):
+    """Render once into a new surface. All caches are cleared and the
+    protozoon is copied before, so genes don't keep calculated points.
+    Otherwise only the first run would measure anything.
+    Returns elapsed seconds.
+    """
+    clear_caches()
+    protozoon = protozoon.copy()
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+    ctx = cairo.Context(surface)
+    task = ka_render.DetachedTask('benchmark')
+    profile = ka_profile.begin_profile('%s %ux%u' % \
+                                 (protozoon.get_unique_id(), size, size))
+    start = time.time()
+    protozoon.render(task, ctx, size, size)
+    surface.flush()
+    elapsed = time.time() - start
+    ka_profile.end_profile(profile)
+    return elapsed
+
+def run_case(case, seed, sizes, repeats):
+    """Measure one case at all sizes.
+    pre: repeats > 0
+    """
+    protozoon = case.build(seed)
+    results = []
+    for size in sizes:
+        timings = sorted([time_render(protozoon, size)
+                          for dummy in range(repeats)])
+        results.append({'case': case.name,
+                        'category': case.category,
+                        'seed': seed,
+                        'size': size,
+                        'repeats': repeats,
+                        'min': timings[0],
+                        'median': timings[len(timings) / 2],
+                        'max': timings[-1],
+                        'digest': protozoon.digest(),
+                       })
+    return results
+
+def main(argv):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--sizes', dest='sizes', default='100,400',
+                      help='comma separated list of image sizes in pixels')
+    parser.add_option('-r', '--repeats', type='int', dest='repeats',
+                      default=3, help='number of renderings per size')
+    parser.add_option('--seed', type='int', dest='seed', default=4254,
+                      help='seed for building the protozoa')
+    parser.add_option('-k', '--keyword', dest='keyword', default='',
+                      help='only run cases containing this keyword')
+    parser.add_option('-o', '--output', dest='output', default='',
+                      help='write JSON results to this file')
+    parser.add_option('-p', '--profile', dest='profile', default='',
+                      help='write per node profiles of the latest renderings'
+                           ' to this file')
+    options, dummy = parser.parse_args(argv)
+    sizes = [int(size) for size in options.sizes.split(',')]
+    if options.repeats < 1 or min(sizes) < 1:
+        parser.error('sizes and repeats must be positive')
+
+    ka_profile.set_enabled(len(options.profile) > 0)
+    if options.profile:
+        ka_profile.RECENT_CAPACITY = len(sizes) * options.repeats \
+                                     * len(list_cases())
+    results = []
+    for case in list_cases():
+        if options.keyword in case.name:
+            for result in run_case(case, options.seed, sizes, options.repeats):
+                print '%-28s %5u  %8.4f s' % (result['case'], result['size'],
+                                              result['median'])
+                results.append(result)
+    report = {'revision': ka_extensionpoint.get_revision_number(),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': results,
+             }
+    if options.output:
+        out_file = open(options.output, 'w')
+        try:
+            json.dump(report, out_file, indent=1, sort_keys=True)
+        finally:
+            out_file.close()
+    if options.profile:
+        ka_profile.dump(options.profile)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,256 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Least recently used caches for rendered images."""
+
+import threading
+
+import ka_status
+
+# Memory budget for all cached surfaces in bytes.
+SURFACE_BUDGET = 48 * 1024 * 1024
+# Memory budget for intermediate surfaces of subtrees in bytes.
+SUBTREE_BUDGET = 16 * 1024 * 1024
+
+def surface_size(surface):
+    """Approximate memory used by an image surface in bytes."""
+    return surface.get_stride() * surface.get_height()
+
+# Fields of a cache entry. Entries are linked in order of their last use.
+_PREV, _NEXT, _KEY, _VALUE, _SIZE = 0, 1, 2, 3, 4
+
+class LruCache(object):
+    """Thread safe cache. Least recently used entries are dropped first
+    when the sum of all entry sizes exceeds the budget.
+    Entries form a ring ordered by their last use, the oldest follows
+    self._root. So finding the entry to drop does not depend on the
+    number of entries.
+    inv: self._used >= 0
+    """
+
+    def __init__(self, budget, sizeof=None, on_drop=None):
+        """on_drop is called with key and value of each entry dropped
+        to stay within the budget. It is called while the cache is locked.
+        pre: budget > 0
+        """
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._root = [None, None, None, None, 0]
+        self._root[_PREV] = self._root[_NEXT] = self._root
+        self._budget = budget
+        self._sizeof = sizeof if sizeof is not None else lambda value: 1
+        self._used = 0
+        self._on_drop = on_drop
+        self.hits, self.misses = 0, 0
+
+    def _unlink(self, entry):
+        entry[_PREV][_NEXT] = entry[_NEXT]
+        entry[_NEXT][_PREV] = entry[_PREV]
+
+    def _link_newest(self, entry):
+        last = self._root[_PREV]
+        entry[_PREV], entry[_NEXT] = last, self._root
+        last[_NEXT] = self._root[_PREV] = entry
+
+    def get(self, key):
+        """Returns the cached value or None.
+        A found entry becomes the most recently used one.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                self._unlink(entry)
+                self._link_newest(entry)
+                self.hits += 1
+                return entry[_VALUE]
+            self.misses += 1
+            return None
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        """Insert or replace a value. Values bigger than the budget
+        are not cached at all.
+        Returns True if the value was cached.
+        pre: value is not None
+        """
+        size = self._sizeof(value)
+        if size > self._budget:
+            return False
+        self._lock.acquire()
+        try:
+            self._remove(key)
+            while self._used + size > self._budget:
+                self._drop_oldest()
+            entry = [None, None, key, value, size]
+            self._link_newest(entry)
+            self._entries[key] = entry
+            self._used += size
+            return True
+        finally:
+            self._lock.release()
+
+    def _remove(self, key):
+        """Caller must hold self._lock."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unlink(entry)
+            self._used -= entry[_SIZE]
+
+    def _drop_oldest(self):
+        """Remove least recently used entry.
+        Caller must hold self._lock.
+        pre: len(self._entries) > 0
+        """
+        entry = self._root[_NEXT]
+        self._remove(entry[_KEY])
+        if self._on_drop is not None:
+            self._on_drop(entry[_KEY], entry[_VALUE])
+
+    def discard(self, key):
+        """Remove an entry if it is cached."""
+        self._lock.acquire()
+        try:
+            self._remove(key)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._root[_PREV] = self._root[_NEXT] = self._root
+            self._used = 0
+        finally:
+            self._lock.release()
+
+    def items(self):
+        """Returns a list of all (key, value) tuples,
+        the least recently used entry comes first."""
+        self._lock.acquire()
+        try:
+            result = []
+            entry = self._root[_NEXT]
+            while entry is not self._root:
+                result.append((entry[_KEY], entry[_VALUE]))
+                entry = entry[_NEXT]
+            return result
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def used(self):
+        """Sum of all entry sizes."""
+        return self._used
+
+class SurfaceCache(object):
+    """Rendered images addressed by the genome digest and the image size.
+    Cached surfaces are shared, consumers must not draw on them.
+    """
+    _surface_cache = None
+    _subtree_cache = None
+
+    def __init__(self, budget=SURFACE_BUDGET, is_subtree=False):
+        # Guards self._sizes, always taken before the lock of self._cache.
+        self._lock = threading.Lock()
+        self._cache = LruCache(budget, surface_size, self._on_drop)
+        self._is_subtree = is_subtree
+        # Sizes cached for each digest.
+        self._sizes = {}
+
+    @staticmethod
+    def instance():
+        """Cache for finished images."""
+        if SurfaceCache._surface_cache is None:
+            SurfaceCache._surface_cache = SurfaceCache()
+        return SurfaceCache._surface_cache
+
+    @staticmethod
+    def subtree_instance():
+        """Cache for intermediate images of subtrees. They have their own
+        budget, so they don't push finished images out of the cache."""
+        if SurfaceCache._subtree_cache is None:
+            SurfaceCache._subtree_cache = SurfaceCache(SUBTREE_BUDGET, True)
+        return SurfaceCache._subtree_cache
+
+    def get(self, digest, width, height):
+        surface = self._cache.get((digest, width, height))
+        self._update_status()
+        return surface
+
+    def put(self, digest, width, height, surface):
+        """
+        pre: surface is not None
+        """
+        self._lock.acquire()
+        try:
+            if self._cache.put((digest, width, height), surface):
+                self._sizes.setdefault(digest, set()).add((width, height))
+        finally:
+            self._lock.release()
+        self._update_status()
+
+    def _on_drop(self, key, surface):
+        """Forget the size of a dropped surface.
+        Entries are only dropped inside put(), self._lock is held.
+        """
+        digest, width, height = key
+        sizes = self._sizes.get(digest, None)
+        if sizes is not None:
+            sizes.discard((width, height))
+            if not sizes:
+                del self._sizes[digest]
+
+    def get_largest(self, digest):
+        """Returns the largest surface cached for digest in any size or None.
+        Useful as a preview until the image is rendered at the wanted size.
+        """
+        self._lock.acquire()
+        try:
+            sizes = self._sizes.get(digest, set())
+            for width, height in sorted(sizes, reverse=True):
+                surface = self._cache.get((digest, width, height))
+                if surface is not None:
+                    return surface
+            return None
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._cache.clear()
+            self._sizes.clear()
+        finally:
+            self._lock.release()
+        self._update_status()
+
+    def _update_status(self):
+        status = ka_status.Status.instance()
+        if self._is_subtree:
+            status.set(ka_status.TOPIC_CACHE, ka_status.SUB_CACHE_SUBTREES,
+                       '%u, %u kB, %u hits, %u misses' % \
+                       (len(self._cache), self._cache.used() / 1024,
+                        self._cache.hits, self._cache.misses))
+            return
+        status.set(ka_status.TOPIC_CACHE, ka_status.SUB_CACHE_ENTRIES,
+                   '%u, %u kB' % (len(self._cache), self._cache.used() / 1024))
+        status.set(ka_status.TOPIC_CACHE, ka_status.SUB_CACHE_HITS,
+                   '%u hits, %u misses' % (self._cache.hits, self._cache.misses))
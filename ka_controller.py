@@ -15,6 +15,8 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import cairo
+
 import ka_extensionpoint
 import ka_debug
 
@@ -125,3 +127,18 @@ def create_context(widget):
                   widget.allocation.width, widget.allocation.height)
     ctx.clip()
     return ctx
+
+def paint_surface(widget, surface):
+    """ Paint surface to widget. Smaller surfaces, for example previews of
+    a progressive rendering, are stretched to fill the whole widget.
+    pre: widget is not None
+    pre: surface is not None
+    """
+    ctx = create_context(widget)
+    ctx.set_operator(cairo.OPERATOR_SOURCE)
+    if surface.get_width() != widget.allocation.width \
+       or surface.get_height() != widget.allocation.height:
+        ctx.scale(float(widget.allocation.width) / surface.get_width(),
+                  float(widget.allocation.height) / surface.get_height())
+    ctx.set_source_surface(surface)
+    ctx.paint()
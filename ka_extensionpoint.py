@@ -18,6 +18,9 @@
 import traceback
 import sys
 import os
+import time
+import tempfile
+import threading
 from ConfigParser import ConfigParser
 
 import ka_debug
@@ -28,12 +31,37 @@ _SEP = '_'
 
 _extension_types = []
 _extensions = []
+# Extension classes already resolved, keyed by extension key.
+_classes = {}
 revision_number = 0
 
+# Extensions are searched on first demand.
+_scanned = False
+_scan_lock = threading.Lock()
+_scan_seconds = 0.0
+_scan_from_manifest = False
+_MANIFEST_FILE = 'kandid_extensions.manifest'
+_USER_DIRECTORY = '.kandid'
+
+def _ensure_scanned():
+    if not _scanned:
+        scann()
+
+def get_revision_number():
+    """Release number from the activity manifest."""
+    _ensure_scanned()
+    return revision_number
+
+def get_scan_time():
+    """Seconds spent searching for extensions and
+    True if the extensions were taken from the cached manifest."""
+    return _scan_seconds, _scan_from_manifest
+
 def list_extensions(extension_type):
     """
-    pre: extension_type in _extension_types
+    pre: extension_type in list_extension_types()
     """
+    _ensure_scanned()
     e_list = []
     for extension_class in _extensions:
         if extension_class.startswith(extension_type + _SEP):
@@ -42,19 +70,32 @@ def list_extensions(extension_type):
     return e_list
 
 def list_extension_types():
+    _ensure_scanned()
     return _extension_types
 
+def get_class(extension_key):
+    """Returns the class implementing an extension.
+    The extension module is only searched on first use.
+    pre: extension_key in _extensions
+    post: __return__ is not None
+    """
+    a_class = _classes.get(extension_key, None)
+    if a_class is None:
+        a_module = __import__('ep_' + extension_key)
+        for key, value in a_module.__dict__.iteritems():
+#            print '-- ', str(type(value)), key
+            if str(type(value)) == "<type 'type'>":
+                a_class = getattr(a_module, key)
+                break
+        _classes[extension_key] = a_class
+    return a_class
+
 def create(extension_key, *params):
     """
     pre: extension_key in _extensions
     post: __return__ is not None
     """
-    a_module = __import__('ep_' + extension_key)
-    for key, value in a_module.__dict__.iteritems():
-#        print '-- ', str(type(value)), key
-        if str(type(value)) == "<type 'type'>":
-            a_class = getattr(a_module, key)
-            return a_class(*params)
+    return get_class(extension_key)(*params)
 
 def _add(extension_type, extension_class):
     if extension_type not in _extension_types:
@@ -68,6 +109,9 @@ def get_bundle_path():
     if 'SUGAR_BUNDLE_PATH' in os.environ:
         from sugar.activity import activity
         bundle_path = activity.get_bundle_path()
+    elif not os.path.isdir(bundle_path):
+        # running outside Sugar, for example headless batch rendering
+        bundle_path = os.path.dirname(os.path.abspath(__file__))
     return bundle_path
 
 def  _get_manifest_version(bundle_path):
@@ -84,19 +128,122 @@ def  _get_manifest_version(bundle_path):
         traceback.print_exc(file=sys.__stderr__)
     return revision
 
-def scann():
-    global revision_number
-    bundle_path = get_bundle_path()
-    revision_number = _get_manifest_version(bundle_path)
-    ka_debug.info('This is Kandid, release v' + str(revision_number))
+def _get_manifest_path():
+    """The cached list of extensions is written to the activities data
+    directory. Outside Sugar a directory private to the user is used.
+    Returns None if there is no place to keep the manifest."""
+    data_path = None
+    if 'SUGAR_ACTIVITY_ROOT' in os.environ:
+        data_path = os.path.join(os.environ['SUGAR_ACTIVITY_ROOT'], 'data')
+    if data_path is None or not os.path.isdir(data_path):
+        data_path = os.path.join(os.path.expanduser('~'), _USER_DIRECTORY)
+        try:
+            if not os.path.isdir(data_path):
+                os.makedirs(data_path, 0700)
+        except:
+            ka_debug.err('failed creating [%s] [%s] [%s]' % \
+                       (data_path, sys.exc_info()[0], sys.exc_info()[1]))
+            return None
+    return os.path.join(data_path, _MANIFEST_FILE)
+
+def _get_bundle_key(bundle_path):
+    """Changes whenever a file is added to or removed from the bundle
+    or the activity manifest is modified."""
+    info_path = os.path.join(bundle_path, 'activity/activity.info')
+    info_mtime = os.stat(info_path).st_mtime \
+                                      if os.path.exists(info_path) else 0
+    return '%s %r %r' % (bundle_path, os.stat(bundle_path).st_mtime,
+                         info_mtime)
+
+def _read_manifest(bundle_key):
+    """Returns revision and extension keys from the cached manifest
+    or None if there is no valid manifest for this bundle."""
+    manifest_path = _get_manifest_path()
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return None
+    in_file = None
+    try:
+        in_file = open(manifest_path, 'r')
+        lines = in_file.read().splitlines()
+        if len(lines) < 2 or lines[0] != bundle_key:
+            return None
+        return int(lines[1]), lines[2:]
+    except:
+        ka_debug.err('failed reading [%s] [%s] [%s]' % \
+                   (manifest_path, sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+    finally:
+        if in_file:
+            in_file.close()
+    return None
+
+def _write_manifest(bundle_key, revision, extension_keys):
+    """Write to a temporary file first,
+    so concurrent readers never see a partial manifest."""
+    manifest_path = _get_manifest_path()
+    if manifest_path is None:
+        return
+    out_file = None
+    try:
+        handle, tmp_path = tempfile.mkstemp(prefix=_MANIFEST_FILE,
+                                      dir=os.path.dirname(manifest_path))
+        out_file = os.fdopen(handle, 'w')
+        out_file.write('\n'.join([bundle_key, str(revision)]
+                                 + extension_keys) + '\n')
+        out_file.close()
+        out_file = None
+        os.rename(tmp_path, manifest_path)
+    except:
+        ka_debug.err('failed writing [%s] [%s] [%s]' % \
+                   (manifest_path, sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+    finally:
+        if out_file:
+            out_file.close()
+
+def _list_bundle(bundle_path):
+    """Search the bundle directory for extension modules."""
     ka_debug.info('Searching for extensions in ' + bundle_path)
+    extension_keys = []
     for element in os.listdir(bundle_path):
         if element.startswith(_PREFIX) and element.endswith(_PYEXT) \
            and os.path.isfile(os.path.join(bundle_path, element)):
             name_parts = element.split(_SEP)
             if len(name_parts) == 3:
-                _add(name_parts[1], name_parts[2].replace(_PYEXT, ''))
-    _extension_types.sort()
-    _extensions.sort()
+                extension_keys.append(name_parts[1] + _SEP
+                                      + name_parts[2].replace(_PYEXT, ''))
+    extension_keys.sort()
+    return extension_keys
 
-scann()
\ No newline at end of file
+def scann():
+    """Search extensions once. A manifest of all extensions is cached and
+    reused as long as the bundle is unchanged.
+    Extension modules are not imported before they are used.
+    """
+    global revision_number, _scanned, _scan_seconds, _scan_from_manifest
+    _scan_lock.acquire()
+    try:
+        if _scanned:
+            return
+        start = time.time()
+        bundle_path = get_bundle_path()
+        bundle_key = _get_bundle_key(bundle_path)
+        manifest = _read_manifest(bundle_key)
+        _scan_from_manifest = manifest is not None
+        if manifest is None:
+            revision = _get_manifest_version(bundle_path)
+            extension_keys = _list_bundle(bundle_path)
+            _write_manifest(bundle_key, revision, extension_keys)
+        else:
+            revision, extension_keys = manifest
+        revision_number = revision
+        ka_debug.info('This is Kandid, release v' + str(revision_number))
+        for extension_key in extension_keys:
+            extension_type, extension_class = extension_key.split(_SEP, 1)
+            _add(extension_type, extension_class)
+        _extension_types.sort()
+        _extensions.sort()
+        _scan_seconds = time.time() - start
+        _scanned = True
+    finally:
+        _scan_lock.release()
\ No newline at end of file
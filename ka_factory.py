@@ -30,6 +30,8 @@ class LayerFactory(object):
         self.factory_keys = ka_extensionpoint.list_extensions(self.category)
         self.factory_keys = map(lambda x: x.replace(self.category + '_', ''), \
                                 self.factory_keys)
+        self._classes = {}
+        self._permitted = {}
 
     def count(self):
         """
@@ -47,8 +49,12 @@ class LayerFactory(object):
         pre: factory_key in self.factory_keys
         post: __return__ is not None
         """
-        return ka_extensionpoint.create(self.category + '_' + factory_key,
-                                        *params)
+        a_class = self._classes.get(factory_key, None)
+        if a_class is None:
+            a_class = ka_extensionpoint.get_class(self.category + '_'
+                                                  + factory_key)
+            self._classes[factory_key] = a_class
+        return a_class(*params)
 
     def create_random(self, key_filter, *params):
         """
@@ -56,7 +62,11 @@ class LayerFactory(object):
         pre: len(key_filter) > 0
         post: __return__ is not None
         """
-        permitted = [x for x in self.factory_keys if x in key_filter]
+        filter_key = tuple(key_filter)
+        permitted = self._permitted.get(filter_key, None)
+        if permitted is None:
+            permitted = [x for x in self.factory_keys if x in key_filter]
+            self._permitted[filter_key] = permitted
         return self.create(random.choice(permitted), *params)
 
 FACTORY_DICT = {}
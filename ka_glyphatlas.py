@@ -0,0 +1,109 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Pre rasterized glyphs.
+Each glyph is drawn once into an alpha mask at device resolution.
+Stamping a glyph then only masks the current source with this image.
+"""
+
+import math
+import cairo
+
+import ka_cache
+
+# Memory budget for all glyph masks in bytes.
+ATLAS_BUDGET = 4 * 1024 * 1024
+# Transparent border around each mask, in pixels. Keeps antialiasing intact.
+PADDING = 2
+
+def _glyph_size(glyph):
+    return ka_cache.surface_size(glyph.mask)
+
+class Glyph(object):
+    """Alpha mask and extents of a single character."""
+
+    def __init__(self, mask, width, height, scale_x, scale_y):
+        """
+        pre: mask is not None
+        pre: scale_x > 0.0 and scale_y > 0.0
+        """
+        self.mask = mask
+        self.width, self.height = width, height
+        self.scale_x, self.scale_y = scale_x, scale_y
+
+    def stamp(self, ctx, center_x, center_y):
+        """Paint current source through the mask.
+        The glyphs ink rectangle is centered at center_x, center_y.
+        """
+        ctx.save()
+        ctx.translate(center_x - self.width / 2.0 - PADDING / self.scale_x,
+                      center_y - self.height / 2.0 - PADDING / self.scale_y)
+        ctx.scale(1.0 / self.scale_x, 1.0 / self.scale_y)
+        ctx.mask_surface(self.mask, 0.0, 0.0)
+        ctx.restore()
+
+class GlyphAtlas(object):
+    """Glyph masks addressed by font family, font size, character and scale.
+    """
+    _glyph_atlas = None
+
+    def __init__(self):
+        self._cache = ka_cache.LruCache(ATLAS_BUDGET, _glyph_size)
+
+    @staticmethod
+    def instance():
+        if GlyphAtlas._glyph_atlas is None:
+            GlyphAtlas._glyph_atlas = GlyphAtlas()
+        return GlyphAtlas._glyph_atlas
+
+    def clear(self):
+        self._cache.clear()
+
+    def get(self, family, size, uc, scale_x, scale_y):
+        """Returns the glyph for a character.
+        scale_x, scale_y map user space distances to device pixels.
+        pre: size > 0.0
+        pre: scale_x > 0.0 and scale_y > 0.0
+        """
+        key = (family, size, uc, scale_x, scale_y)
+        glyph = self._cache.get(key)
+        if glyph is None:
+            glyph = self._rasterize(family, size, uc, scale_x, scale_y)
+            self._cache.put(key, glyph)
+        return glyph
+
+    def _rasterize(self, family, size, uc, scale_x, scale_y):
+        measure = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A8, 1, 1))
+        measure.scale(scale_x, scale_y)
+        measure.select_font_face(family,
+                                 cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+        measure.set_font_size(size)
+        x_bearing, y_bearing, width, height = measure.text_extents(uc)[:4]
+
+        mask = cairo.ImageSurface(cairo.FORMAT_A8,
+                        int(math.ceil(width * scale_x)) + 2 * PADDING,
+                        int(math.ceil(height * scale_y)) + 2 * PADDING)
+        ctx = cairo.Context(mask)
+        ctx.translate(PADDING, PADDING)
+        ctx.scale(scale_x, scale_y)
+        ctx.select_font_face(family,
+                             cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+        ctx.set_font_size(size)
+        ctx.move_to(-x_bearing, -y_bearing)
+        ctx.show_text(uc)
+        mask.flush()
+        return Glyph(mask, width, height, scale_x, scale_y)
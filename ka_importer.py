@@ -23,7 +23,9 @@ import traceback
 import ka_debug
 import ka_extensionpoint
 
-_marker = 'v' + str(ka_extensionpoint.revision_number)
+def _get_marker():
+    return 'v' + str(ka_extensionpoint.get_revision_number())
+
 _populated = False
 _themes = []
 _rgb_image_list = []
@@ -197,7 +199,7 @@ def _create_icon(is_plus_sign):
 
 def _post_install():
     """
-    pre: len(_marker) >= 2 and int(_marker[1]) > 2
+    pre: len(_get_marker()) >= 2 and int(_get_marker()[1]) > 2
     """
     try:
         tmp_path = get_tmp_path()
@@ -209,7 +211,7 @@ def _post_install():
             try:
                 in_file = open(install_marker, 'r')
                 marker = in_file.read()
-                reinstall = not marker == _marker
+                reinstall = not marker == _get_marker()
             except:
                 reinstall = True
                 ka_debug.err('failed reading [%s] [%s] [%s]' % \
@@ -1070,7 +1072,7 @@ li.basic_active {
         _write_surface_file(tmp_path, '', 'plus.png', _create_icon(True))
 
 #---- write version marker
-        _write_file(import_path, '', 'install.inf', _marker)
+        _write_file(import_path, '', 'install.inf', _get_marker())
     except:
 #        print 'post install failed [%s] [%s]' % \
 #                   (sys.exc_info()[0], sys.exc_info()[1])
@@ -15,21 +15,46 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+"""Protozoans proposed by other buddies.
+Received buffers are decoded by a background task. A protozoon already
+waiting or recently proposed is dropped, protozoans are identified by
+their genome digest. Only the first INCOMMING_CAPACITY protozoans are
+visible, the others wait in a queue of configurable length. Renderings
+for the same buddy are spread by RENDER_INTERVAL seconds.
+"""
+
 from gettext import gettext as _
 
+import time
 import cairo
+import gobject
 import gtk
 
 import ka_debug
 import ka_controller
 import ka_task
+import ka_cache
+import ka_render
+import ka_preference
+import model_population
 
 
 INCOMMING_CAPACITY = 3
+# Minimum seconds between two renderings for the same buddy.
+RENDER_INTERVAL = 5.0
+# Number of genome digests remembered to drop duplicates.
+SEEN_CAPACITY = 64
+
+def _queue_capacity():
+    """Number of protozoans waiting, including the visible ones.
+    post: __return__ >= INCOMMING_CAPACITY
+    """
+    return max(INCOMMING_CAPACITY, ka_preference.Preference.instance().get(
+                                                ka_preference.INCOMING_QUEUE))
 
 class KandidIncoming(object):
     """
-    inv: 0 <= len(self.incoming_protozoans) <= self._capacity
+    inv: 0 <= len(self.incoming_protozoans) <= self._queue_capacity
     inv: 0 <= len(self.incoming_surface_cache) <= self._capacity
     inv: 0 <= len(self.incoming_surface_cache) <= len(self.incoming_protozoans)
     inv: self._capacity > 0
@@ -42,11 +67,18 @@ class KandidIncoming(object):
         pre: widget_list is not None
         """
         self._capacity = INCOMMING_CAPACITY
+        self._queue_capacity = _queue_capacity()
         self._widget_list = widget_list
         self._parent = parent
         self.incoming_id = []
         self.incoming_protozoans = {}
         self.incoming_surface_cache = {}
+        self._digests = {}
+        self._senders = {}
+        self._scheduled = set()
+        self._seen = ka_cache.LruCache(SEEN_CAPACITY)
+        self._next_render = {}
+        self._decode_count = 0
  
     def create_gui(self):
         """ """
@@ -120,31 +152,123 @@ class KandidIncoming(object):
                       else None
         return protozoon, iid
 
+    def receive(self, code_element, sender):
+        """Decode a received protozoon without blocking the GUI.
+        pre: code_element is not None
+        """
+        self._decode_count += 1
+        ka_task.GeneratorTask(self.task_decode, self.on_decoded,
+                              'decode_incoming_%u' % self._decode_count,
+                              ka_task.PRIORITY_BACKGROUND) \
+                                             .start(code_element, sender)
+
+    def task_decode(self, task, *args, **kwargs):
+        """Decode protozoon and compute its digest.
+        pre: len(args) == 2
+        """
+        protozoon = model_population.from_buffer(args[0])
+        digest = protozoon.digest() if protozoon is not None else None
+        return protozoon, digest, args[1]
+
+    def on_decoded(self, *args):
+        """Decoding task has finished"""
+        protozoon, digest, sender = args[0]
+        if protozoon is not None:
+            self.offer_protozoon(protozoon, digest, sender)
+
     def append_protozoon(self, incoming_protozoon):
         """ Append incoming protozoon and manage capacity.
         pre: incoming_protozoon is not None
         """
-#        ka_debug.info('incoming: append protozoon')
-        while len(self.incoming_protozoans) >= self._capacity:
-            iid = self.incoming_id[0]
-            del self.incoming_id[0]
-            del self.incoming_protozoans[iid]
-            if self.incoming_surface_cache.has_key(iid):
-                del self.incoming_surface_cache[iid]
+        self.offer_protozoon(incoming_protozoon, incoming_protozoon.digest(),
+                             None)
+
+    def offer_protozoon(self, incoming_protozoon, digest, sender):
+        """ Append incoming protozoon unless it was seen recently.
+        If the queue is full the oldest waiting protozoon is dropped.
+        Returns False for a duplicate.
+        pre: incoming_protozoon is not None
+        """
+        if self._seen.get(digest) is not None:
+            ka_debug.info('incoming: drop duplicate from [%s]' % sender)
+            return False
+        self._seen.put(digest, True)
+        while len(self.incoming_id) >= self._queue_capacity:
+            # drop the oldest waiting, if nothing waits the oldest visible
+            if len(self.incoming_id) > self._capacity:
+                # never shown, so it is welcome when offered again
+                self._seen.discard(self._digests[
+                                          self.incoming_id[self._capacity]])
+                self._remove(self._capacity)
+            else:
+                self._remove(0)
         KandidIncoming.ids += 1
-        self.incoming_id.append(KandidIncoming.ids)
-        self.incoming_protozoans[KandidIncoming.ids] = incoming_protozoon
-        index = len(self.incoming_id) - 1
-        widget_name = 'incomingarea_' + str(index)
-        widget = self._widget_list.get_widget(widget_name)
-        task = ka_task.GeneratorTask(self.task_render,
-                                     self.on_image_completed,
-                                     widget_name)
-        task.start(incoming_protozoon, KandidIncoming.ids,
-                   widget.allocation.width, widget.allocation.height)
-#        ka_debug.info('incoming: start_calculation %ux%u, iid %u for %s' % 
-#          (widget.allocation.width, widget.allocation.height,
-#           KandidIncoming.ids, widget.name))
+        iid = KandidIncoming.ids
+        self.incoming_id.append(iid)
+        self.incoming_protozoans[iid] = incoming_protozoon
+        self._digests[iid] = digest
+        self._senders[iid] = sender
+        self._render_visible()
+        self.update_incomming_gui()
+        return True
+
+    def _remove(self, index):
+        iid = self.incoming_id.pop(index)
+        del self.incoming_protozoans[iid]
+        del self._digests[iid]
+        del self._senders[iid]
+        self._scheduled.discard(iid)
+        if self.incoming_surface_cache.has_key(iid):
+            del self.incoming_surface_cache[iid]
+
+    def _render_visible(self):
+        """Start rendering protozoans which became visible.
+        Images already rendered for the population are reused.
+        """
+        surface_cache = ka_cache.SurfaceCache.instance()
+        for index, iid in enumerate(self.incoming_id[:self._capacity]):
+            if iid in self._scheduled:
+                continue
+            self._scheduled.add(iid)
+            widget = self._widget_list.get_widget('incomingarea_' + str(index))
+            digest = self._digests[iid]
+            surface = surface_cache.get(digest, widget.allocation.width,
+                                        widget.allocation.height)
+            if surface is not None:
+                self.incoming_surface_cache[iid] = surface
+                continue
+            preview = surface_cache.get_largest(digest)
+            if preview is not None:
+                self.incoming_surface_cache[iid] = preview
+            delay = self._reserve_render(self._senders[iid])
+            if delay > 0.0:
+                gobject.timeout_add(int(delay * 1000), self._start_render, iid)
+            else:
+                self._start_render(iid)
+
+    def _reserve_render(self, sender):
+        """Returns seconds to wait before rendering for this sender."""
+        if sender is None:
+            return 0.0
+        now = time.time()
+        start = max(now, self._next_render.get(sender, now))
+        self._next_render[sender] = start + RENDER_INTERVAL
+        return start - now
+
+    def _start_render(self, iid):
+        if iid in self.incoming_id:
+            index = self.incoming_id.index(iid)
+            widget = self._widget_list.get_widget('incomingarea_' + str(index))
+            task = ka_task.GeneratorTask(self.task_render,
+                                         self.on_image_completed,
+                                         'incoming_' + str(iid),
+                                         ka_task.PRIORITY_BACKGROUND)
+            task.start(self.incoming_protozoans[iid], iid,
+                       widget.allocation.width, widget.allocation.height)
+#            ka_debug.info('incoming: start_calculation %ux%u, iid %u for %s' % 
+#              (widget.allocation.width, widget.allocation.height,
+#               iid, widget.name))
+        return False
 
     def accept_protozoon(self, index):
         """ Move protozoon from incoming list to image population.
@@ -153,10 +277,8 @@ class KandidIncoming(object):
         protozoon, iid = self.at_index(index)
         if protozoon is not None:
 #            ka_debug.info('incoming: accept incoming protozoon %u' % iid)
-            del self.incoming_id[index]
-            del self.incoming_protozoans[iid]
-            if self.incoming_surface_cache.has_key(iid):
-                del self.incoming_surface_cache[iid]
+            self._remove(index)
+            self._render_visible()
             self.update_incomming_gui()
         return protozoon
 
@@ -164,13 +286,10 @@ class KandidIncoming(object):
         """ Remove protozoon from incoming list
         pre: 0 <= index < self._capacity
         """
-        if index < len(self.incoming_protozoans):
+        if index < len(self.incoming_id):
 #            ka_debug.info('incoming: decline incoming protozoon %u' % index)
-            iid = self.incoming_id[index]
-            del self.incoming_id[index]
-            del self.incoming_protozoans[iid]
-            if self.incoming_surface_cache.has_key(iid):
-                del self.incoming_surface_cache[iid]
+            self._remove(index)
+            self._render_visible()
             self.update_incomming_gui()
 
     def task_render(self, task, *args, **kwargs):
@@ -180,10 +299,8 @@ class KandidIncoming(object):
         protozoon, iid, width, height = \
                                              args[0], args[1], args[2], args[3]
 #        ka_debug.info('incoming: task_render entry: ' + str(iid))
-        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
-        ctx = cairo.Context(surface)
-        protozoon.render(task, ctx, width, height)
-        if self.incoming_protozoans.has_key(iid):
+        surface = ka_render.render(task, protozoon, width, height)
+        if surface is not None and self.incoming_protozoans.has_key(iid):
             self.incoming_surface_cache[iid] = surface
 #        ka_debug.info('incoming: task_render exit: ' + str(iid))
         return iid
@@ -213,9 +330,13 @@ class KandidIncoming(object):
         if index < len(self.incoming_id):
             iid = self.incoming_id[index]
         if self.incoming_surface_cache.has_key(iid):
-            # draw protozoon to screen
+            # draw protozoon to screen, a preview is scaled to fit
+            surface = self.incoming_surface_cache[iid]
             ctx.set_operator(cairo.OPERATOR_SOURCE)
-            ctx.set_source_surface(self.incoming_surface_cache[iid])
+            if surface.get_width() != width or surface.get_height() != height:
+                ctx.scale(float(width) / surface.get_width(),
+                          float(height) / surface.get_height())
+            ctx.set_source_surface(surface)
             ctx.paint()
         else:
             ctx.set_source_rgba(0.65, 0.65, 0.65, 0.0)
@@ -0,0 +1,81 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Reusable Pango layouts.
+Shaping text is expensive, but the same buzzwords are rendered again and
+again. Shaped layouts and their pixel extents are kept for reuse.
+A layout is lent to a single rendering at a time: take it with
+checkout() and hand it back with checkin() when finished.
+"""
+
+import threading
+
+import ka_cache
+
+# Number of distinct layout keys kept.
+LAYOUT_CAPACITY = 256
+# Idle layouts kept per key. More are only needed by concurrent renderings.
+MAX_IDLE = 4
+
+class LayoutCache(object):
+    """Idle layouts addressed by text and font description."""
+    _layout_cache = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = ka_cache.LruCache(LAYOUT_CAPACITY)
+
+    @staticmethod
+    def instance():
+        if LayoutCache._layout_cache is None:
+            LayoutCache._layout_cache = LayoutCache()
+        return LayoutCache._layout_cache
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._idle.clear()
+        finally:
+            self._lock.release()
+
+    def checkout(self, key):
+        """Returns an idle (layout, pixel_size) tuple or None.
+        The caller owns the layout until it is checked in again.
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+            return None
+        finally:
+            self._lock.release()
+
+    def checkin(self, key, entry):
+        """Hand back a (layout, pixel_size) tuple for later reuse.
+        pre: entry is not None
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle is None:
+                idle = []
+                self._idle.put(key, idle)
+            if len(idle) < MAX_IDLE:
+                idle.append(entry)
+        finally:
+            self._lock.release()
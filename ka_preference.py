@@ -22,6 +22,11 @@ import sys
 import traceback
 
 EXPORT_SIZE       = 'export_size'
+RENDER_PROCESSES  = 'render_processes'
+PROGRESSIVE       = 'progressive'
+PROFILE           = 'profile'
+INCOMING_QUEUE    = 'incoming_queue'
+HISTORY_SPILL     = 'history_spill'
 
 class Preference(object):
     """
@@ -55,7 +60,6 @@ class Preference(object):
         pre: topic is not None
         """
         if not self._first_get:
-            self._default()
             self.recall();
             self._first_get = True
         return self._preference_dict[topic] if topic in self._preference_dict \
@@ -69,7 +73,12 @@ class Preference(object):
         return os.path.join(target_path, 'user_prefereces')
 
     def _default(self):
-        self._preference_dict = {EXPORT_SIZE: (400, 400)}
+        self._preference_dict = {EXPORT_SIZE: (400, 400),
+                                 RENDER_PROCESSES: False,
+                                 PROGRESSIVE: True,
+                                 PROFILE: False,
+                                 INCOMING_QUEUE: 12,
+                                 HISTORY_SPILL: False}
 
     def store(self):
         """Write textual content to the file system.
@@ -91,15 +100,17 @@ class Preference(object):
                     out_file.close()
 
     def recall(self):
+        """Start from the defaults and update them with the stored values.
+        So preferences added by a newer release get their default value.
         """
-        """
+        self._default()
         in_file = None
         fn = ''
         try:
             fn = self._file_name()
             if os.path.exists(fn):
                 in_file = open(fn, 'r')
-                self._preference_dict = eval(in_file.read())
+                self._preference_dict.update(eval(in_file.read()))
         except:
             ka_debug.err('failed reading [%s] [%s] [%s]' % \
                        (fn, sys.exc_info()[0], sys.exc_info()[1]))
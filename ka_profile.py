@@ -0,0 +1,185 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Optional profiling of the rendering of tree nodes.
+While profiling is switched on, each rendering records a tree of profile
+nodes. Every node counts the wall time, allocated surfaces and painted
+stamps of a tree node, layer, merger or modifier. Rendering done by
+worker processes is not profiled.
+"""
+
+import sys
+import time
+import threading
+import traceback
+
+import ka_debug
+import ka_status
+
+# Counter names
+SURFACES = 'surfaces'
+STAMPS = 'stamps'
+CACHE_HITS = 'cache_hits'
+
+# Number of finished profiles kept for inspection.
+RECENT_CAPACITY = 16
+
+_enabled = False
+_local = threading.local()
+_recent = []
+_recent_lock = threading.Lock()
+
+class ProfileNode(object):
+    """Measurements for a single step of the rendering.
+    inv: self.seconds >= 0.0
+    """
+    __slots__ = ['label', 'seconds', 'counters', 'children', '_start']
+
+    def __init__(self, label):
+        self.label = label
+        self.seconds = 0.0
+        self.counters = {}
+        self.children = []
+        self._start = time.time()
+
+    def stop(self):
+        self.seconds = time.time() - self._start
+
+    def own_seconds(self):
+        """Time spent in this node without its children."""
+        return max(0.0, self.seconds - sum([child.seconds
+                                            for child in self.children]))
+
+    def total(self, counter):
+        """Sum of a counter in this node and all its descendants."""
+        return self.counters.get(counter, 0) \
+               + sum([child.total(counter) for child in self.children])
+
+    def slowest(self):
+        """Returns the node with the highest own time."""
+        result = self
+        for child in self.children:
+            candidate = child.slowest()
+            if candidate.own_seconds() > result.own_seconds():
+                result = candidate
+        return result
+
+    def to_dict(self):
+        return {'label': self.label,
+                'seconds': self.seconds,
+                'own_seconds': self.own_seconds(),
+                'counters': dict(self.counters),
+                'children': [child.to_dict() for child in self.children],
+               }
+
+def is_enabled():
+    return _enabled
+
+def set_enabled(flag):
+    global _enabled
+    _enabled = bool(flag)
+
+def _stack():
+    return getattr(_local, 'stack', None)
+
+def begin_profile(label):
+    """Start a new profile for the calling thread.
+    Returns None while profiling is switched off.
+    """
+    if not _enabled:
+        return None
+    root = ProfileNode(label)
+    _local.stack = [root]
+    return root
+
+def end_profile(root):
+    """Finish profile and keep it for inspection."""
+    if root is None:
+        return
+    root.stop()
+    _local.stack = None
+    _recent_lock.acquire()
+    try:
+        _recent.append(root)
+        del _recent[:-RECENT_CAPACITY]
+    finally:
+        _recent_lock.release()
+    _update_status(root)
+
+def begin(label):
+    """Open a node below the current node.
+    Returns None if no profile is recorded by the calling thread.
+    """
+    stack = _stack()
+    if not _enabled or not stack:
+        return None
+    node = ProfileNode(label)
+    stack[-1].children.append(node)
+    stack.append(node)
+    return node
+
+def end(node):
+    """Close node. Nodes left open by an exception are closed, too."""
+    stack = _stack()
+    if node is None or not stack or node not in stack:
+        return
+    while stack:
+        open_node = stack.pop()
+        open_node.stop()
+        if open_node is node:
+            break
+
+def count(counter, amount=1):
+    """Add amount to a counter of the current node."""
+    stack = _stack()
+    if _enabled and stack:
+        counters = stack[-1].counters
+        counters[counter] = counters.get(counter, 0) + amount
+
+def recent_profiles():
+    """Profiles of the latest renderings, oldest first."""
+    _recent_lock.acquire()
+    try:
+        return _recent[:]
+    finally:
+        _recent_lock.release()
+
+def dump(file_path):
+    """Write latest profiles as JSON."""
+    import json
+    out_file = None
+    try:
+        out_file = open(file_path, 'w')
+        json.dump([root.to_dict() for root in recent_profiles()],
+                  out_file, indent=1, sort_keys=True)
+    except:
+        ka_debug.err('failed writing [%s] [%s] [%s]' % \
+                   (file_path, sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+    finally:
+        if out_file:
+            out_file.close()
+
+def _update_status(root):
+    status = ka_status.Status.instance()
+    status.set(ka_status.TOPIC_PROFILE, ka_status.SUB_PROFILE_LATEST,
+               '%s %.3f s, %u surfaces, %u stamps, %u cache hits' % \
+               (root.label, root.seconds, root.total(SURFACES),
+                root.total(STAMPS), root.total(CACHE_HITS)))
+    slowest = root.slowest()
+    status.set(ka_status.TOPIC_PROFILE, ka_status.SUB_PROFILE_SLOWEST,
+               '%s %.3f s' % (slowest.label, slowest.own_seconds()))
@@ -0,0 +1,303 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Render protozoa to image surfaces.
+Rendering is done inside the calling thread or, if enabled in the
+preferences, by a pool of worker processes. Worker processes receive the
+serialized protozoon and return the pixels through a shared memory file.
+Finished images are kept in a cache addressed by the genome digest."""
+
+import os
+import sys
+import mmap
+import tempfile
+import threading
+import traceback
+import cairo
+
+import ka_debug
+import ka_cache
+import ka_profile
+import ka_preference
+import model_population
+
+_SHM_PATH = '/dev/shm'
+_POLL_INTERVAL = 0.1
+
+# Previews of a progressive rendering are scaled down by these divisors.
+PROGRESSIVE_DIVISORS = [8, 4, 2]
+# Previews smaller than this are not worth the effort.
+MIN_PREVIEW_SIZE = 32
+
+# Number of renderings which may be in the pool at the same time.
+_SLOT_COUNT = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+# Shared with the worker processes, a set flag cancels the rendering.
+_cancel_flags = None
+_free_slots = []
+# Cancel flags inside a worker process.
+_worker_flags = None
+
+class DetachedTask(object):
+    """Replaces ka_task.GeneratorTask where no GUI is involved."""
+
+    def __init__(self, work_for):
+        self.quit = False
+        self.work_for = work_for
+
+class _WorkerTask(object):
+    """Task inside a worker process, told to quit through its cancel flag."""
+
+    def __init__(self, slot):
+        self.work_for = 'worker'
+        self._slot = slot
+
+    def get_quit(self):
+        return bool(_worker_flags[self._slot])
+
+    quit = property(get_quit)
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except:
+        return 1
+
+def is_process_backend():
+    """True if rendering should be delegated to worker processes.
+    The pool is only available if it was started with the activity.
+    """
+    preference = ka_preference.Preference.instance()
+    return bool(preference.get(ka_preference.RENDER_PROCESSES)) \
+           and _pool is not None
+
+def _init_worker(cancel_flags):
+    global _worker_flags
+    _worker_flags = cancel_flags
+
+def start_pool():
+    """Start the worker processes if enabled in the preferences.
+    Must be called before any other thread is started. Forking a process
+    running several threads copies locks held by the other threads.
+    """
+    global _pool, _cancel_flags
+    preference = ka_preference.Preference.instance()
+    if not preference.get(ka_preference.RENDER_PROCESSES) \
+       or _cpu_count() < 2:
+        return
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            import multiprocessing
+            import multiprocessing.sharedctypes
+            _cancel_flags = multiprocessing.sharedctypes.RawArray('b',
+                                                                  _SLOT_COUNT)
+            _free_slots[:] = range(_SLOT_COUNT)
+            _pool = multiprocessing.Pool(processes=_cpu_count(),
+                                         initializer=_init_worker,
+                                         initargs=(_cancel_flags,))
+            ka_debug.info('started %u render processes' % _cpu_count())
+    except:
+        ka_debug.err('starting render processes failed [%s] [%s]' % \
+               (sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+    finally:
+        _pool_lock.release()
+
+def _acquire_slot():
+    """Returns a free cancel flag or None if all are in use."""
+    _pool_lock.acquire()
+    try:
+        if not _free_slots:
+            return None
+        slot = _free_slots.pop()
+        _cancel_flags[slot] = 0
+        return slot
+    finally:
+        _pool_lock.release()
+
+def _release_slot(slot):
+    _pool_lock.acquire()
+    try:
+        _free_slots.append(slot)
+    finally:
+        _pool_lock.release()
+
+def _render_local(task, protozoon, width, height):
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    ka_profile.count(ka_profile.SURFACES)
+    ctx = cairo.Context(surface)
+    protozoon.render(task, ctx, width, height)
+    return surface
+
+def _render_in_worker(code_element, width, height, slot):
+    """Executed inside a worker process.
+    Returns stride, name of a shared memory file and the pixels.
+    Pixels are only returned if there is no shared memory.
+    Returns None if the rendering was cancelled or failed.
+    """
+    task = _WorkerTask(slot)
+    if task.quit:
+        return None
+    try:
+        protozoon = model_population.from_buffer(code_element)
+        surface = _render_local(task, protozoon, width, height)
+    except:
+        ka_debug.err('rendering in worker failed [%s] [%s]' % \
+               (sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+        return None
+    if task.quit:
+        return None
+    surface.flush()
+    data = surface.get_data()
+    if os.path.isdir(_SHM_PATH):
+        handle, shm_name = tempfile.mkstemp(prefix='kandid_', dir=_SHM_PATH)
+        try:
+            os.write(handle, data)
+        finally:
+            os.close(handle)
+        return surface.get_stride(), shm_name, None
+    return surface.get_stride(), None, str(data)
+
+def _discard(result):
+    """Remove shared memory file of an abandoned rendering."""
+    if result is not None and result[1] is not None:
+        try:
+            os.unlink(result[1])
+        except OSError:
+            pass
+
+def _to_surface(result, width, height):
+    """Wrap pixels received from a worker process in an image surface."""
+    stride, shm_name, data = result
+    if shm_name is not None:
+        handle = os.open(shm_name, os.O_RDWR)
+        try:
+            data = mmap.mmap(handle, stride * height)
+        finally:
+            os.close(handle)
+            os.unlink(shm_name)
+    else:
+        import array
+        data = array.array('c', data)
+    return cairo.ImageSurface.create_for_data(data, cairo.FORMAT_ARGB32,
+                                              width, height, stride)
+
+def _render_in_pool(task, protozoon, width, height):
+    slot = _acquire_slot()
+    if slot is None:
+        return _render_local(task, protozoon, width, height)
+    # The pool calls on_result before async_result is ready, so the
+    # result is handed over under a lock. Whoever comes last cleans up.
+    handoff = threading.Lock()
+    received, abandoned = [], []
+    def on_result(result):
+        _release_slot(slot)
+        handoff.acquire()
+        try:
+            if abandoned:
+                _discard(result)
+            else:
+                received.append(result)
+        finally:
+            handoff.release()
+    code_element = model_population.to_buffer(protozoon)
+    async_result = _pool.apply_async(_render_in_worker,
+                                     (code_element, width, height, slot),
+                                     callback=on_result)
+    while not received:
+        async_result.wait(_POLL_INTERVAL)
+        if async_result.ready() and not async_result.successful():
+            _release_slot(slot)
+            # raises the exception of the worker process
+            async_result.get()
+        if task.quit:
+            # a waiting job is skipped, a running one stops soon
+            _cancel_flags[slot] = 1
+            handoff.acquire()
+            try:
+                abandoned.append(True)
+                if received:
+                    _discard(received[0])
+                return None
+            finally:
+                handoff.release()
+    if received[0] is None:
+        raise RuntimeError('render process failed')
+    return _to_surface(received[0], width, height)
+
+def _render_uncached(task, protozoon, width, height):
+    if is_process_backend():
+        try:
+            return _render_in_pool(task, protozoon, width, height)
+        except:
+            ka_debug.err('render process failed [%s] [%s]' % \
+                   (sys.exc_info()[0], sys.exc_info()[1]))
+            traceback.print_exc(file=sys.__stderr__)
+    return _render_local(task, protozoon, width, height)
+
+def render(task, protozoon, width, height):
+    """Render protozoon to an image surface.
+    The returned surface may be shared with the cache, don't draw on it.
+    Returns None if the task was told to quit before the image was ready.
+    pre: protozoon is not None
+    pre: width > 0
+    pre: height > 0
+    """
+    surface_cache = ka_cache.SurfaceCache.instance()
+    digest = protozoon.digest()
+    surface = surface_cache.get(digest, width, height)
+    if surface is None:
+        profile = ka_profile.begin_profile('%s %ux%u' % \
+                                 (protozoon.get_unique_id(), width, height))
+        surface = _render_uncached(task, protozoon, width, height)
+        ka_profile.end_profile(profile)
+        if surface is not None and not task.quit:
+            surface_cache.put(digest, width, height, surface)
+    return surface
+
+def is_progressive():
+    """True if coarse previews should be rendered first."""
+    preference = ka_preference.Preference.instance()
+    return bool(preference.get(ka_preference.PROGRESSIVE))
+
+def render_progressive(task, protozoon, width, height, on_preview):
+    """Render protozoon to an image surface. Unless the image is already
+    cached, coarse previews at 1/8, 1/4 and 1/2 of the size are rendered
+    first and handed to on_preview.
+    Returns None if the task was told to quit before the image was ready.
+    pre: on_preview is not None and callable(on_preview)
+    pre: width > 0
+    pre: height > 0
+    """
+    if is_progressive():
+        surface_cache = ka_cache.SurfaceCache.instance()
+        if surface_cache.get(protozoon.digest(), width, height) is None:
+            for divisor in PROGRESSIVE_DIVISORS:
+                preview_width, preview_height = width / divisor, \
+                                                height / divisor
+                if min(preview_width, preview_height) >= MIN_PREVIEW_SIZE:
+                    preview = render(task, protozoon,
+                                     preview_width, preview_height)
+                    if preview is None or task.quit:
+                        return None
+                    on_preview(preview)
+    return render(task, protozoon, width, height)
@@ -18,6 +18,7 @@
 from gettext import gettext as _
 import os
 import sys
+import time
 import traceback
 
 import ka_debug
@@ -42,9 +43,21 @@ SUB_VM_SIZE               =    3
 SUB_VM_PEAK               =    4
 SUB_VM_RSS                =    5
 SUB_PID                =    6
+SUB_QUEUED                =    7
+
+TOPIC_CACHE               = 3000
+SUB_CACHE_ENTRIES         =    1
+SUB_CACHE_HITS            =    2
+SUB_CACHE_HISTORY         =    3
+SUB_CACHE_SUBTREES        =    4
+
+TOPIC_PROFILE             = 4000
+SUB_PROFILE_LATEST        =    1
+SUB_PROFILE_SLOWEST       =    2
 
 TOPIC_ACTIVTY             = 9000
 SUB_REVISION              =    1
+SUB_STARTUP               =    2
 
 TOPIC = {TOPIC_COLLABORATION: _('Collaboration'),
          TOPIC_COLLABORATION+SUB_ID: _('My ID'),
@@ -63,9 +76,21 @@ TOPIC = {TOPIC_COLLABORATION: _('Collaboration'),
          TOPIC_TASK+SUB_VM_PEAK: _('Virtual memory peak size'),
          TOPIC_TASK+SUB_VM_RSS: _('Resident set size'),
          TOPIC_TASK+SUB_PID: _('Process ID'),
+         TOPIC_TASK+SUB_QUEUED: _('Queued tasks'),
+
+         TOPIC_CACHE: _('Image cache'),
+         TOPIC_CACHE+SUB_CACHE_ENTRIES: _('Cached images'),
+         TOPIC_CACHE+SUB_CACHE_HITS: _('Requests'),
+         TOPIC_CACHE+SUB_CACHE_HISTORY: _('Ancestor images'),
+         TOPIC_CACHE+SUB_CACHE_SUBTREES: _('Subtree images'),
+
+         TOPIC_PROFILE: _('Profiling'),
+         TOPIC_PROFILE+SUB_PROFILE_LATEST: _('Latest image'),
+         TOPIC_PROFILE+SUB_PROFILE_SLOWEST: _('Slowest step'),
 
          TOPIC_ACTIVTY: _('Activity'),
          TOPIC_ACTIVTY+SUB_REVISION: _('Running'),
+         TOPIC_ACTIVTY+SUB_STARTUP: _('Startup'),
         }
 
 class Status(object):
@@ -80,11 +105,16 @@ class Status(object):
         """
         self._dirty_flag = True
         self._status_dict = {}
-        value = 'Kandid, release v' + str(ka_extensionpoint.revision_number)
+        self._started_at = time.time()
+        self._startup_steps = []
+        self.set(TOPIC_TASK, SUB_PID, str(os.getpid()))
+
+    def _set_revision(self):
+        """The release is only known after searching the extensions."""
+        value = 'Kandid, release v' + str(ka_extensionpoint.get_revision_number())
         value = value + ', DoB activated' if ka_debug.is_DbC_activated \
                                           else value
         self.set(TOPIC_ACTIVTY, SUB_REVISION, value)
-        self.set(TOPIC_TASK, SUB_PID, str(os.getpid()))
 
     @staticmethod
     def instance():
@@ -92,6 +122,27 @@ class Status(object):
             Status._status = Status()
         return Status._status
     
+    def set_start_time(self, started_at):
+        """Startup steps are measured from started_at."""
+        self._started_at = started_at
+
+    def startup_step(self, step):
+        """Record the seconds since start when step is reached the first time.
+        pre: step is not None
+        """
+        for known_step, dummy in self._startup_steps:
+            if known_step == step:
+                return
+        seconds = time.time() - self._started_at
+        self._startup_steps.append((step, seconds))
+        ka_debug.info('startup: %s after %.3f s' % (step, seconds))
+        scan_seconds, from_manifest = ka_extensionpoint.get_scan_time()
+        value = 'extensions %.3f s' % scan_seconds
+        value = value + ' (cached)' if from_manifest else value
+        for known_step, seconds in self._startup_steps:
+            value += ', %s %.3f s' % (known_step, seconds)
+        self.set(TOPIC_ACTIVTY, SUB_STARTUP, value)
+
     def set(self, topic, sub, value):
         """
         pre: topic >= 1000 and topic <= TOPIC_ACTIVTY and topic % 1000 == 0
@@ -113,6 +164,8 @@ class Status(object):
         """
         post: __return__ is not None
         """
+        if not self._status_dict.has_key(TOPIC_ACTIVTY+SUB_REVISION):
+            self._set_revision()
         self._dirty_flag = False
         keys = self._status_dict.keys()
         keys.sort()
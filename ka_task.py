@@ -18,120 +18,207 @@
 import sys
 import traceback
 import threading
+import heapq
 import gobject
 
 import ka_debug
 import ka_status
 
+# Lower numbers are served first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_VISIBLE = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_EXPORT = 3
+
+# Maximum number of tasks waiting for a worker thread.
+QUEUE_CAPACITY = 48
+
+def _pool_size():
+    """Number of worker threads. Rendering is mostly done inside the
+    interpreter, so more threads than cores will not speed up anything.
+    post: 2 <= __return__ <= 4
+    """
+    try:
+        import multiprocessing
+        cores = multiprocessing.cpu_count()
+    except:
+        cores = 2
+    return max(2, min(cores, 4))
+
 class GeneratorTask(object):
     """Decoupling rendering and GUI.
+    All tasks are executed by a fixed size pool of worker threads.
+    Waiting tasks are ordered by priority. A new task replaces a waiting
+    task working for the same target and asks a running one to quit.
     inv: GeneratorTask._internal_task_count >= 0
     """
-    _internal_task_list_lock = threading.Lock()
-    _internal_serialize_lock = threading.Lock()
-    _internal_leave_condition = threading.Condition()
+    _internal_condition = threading.Condition()
     _internal_task_count = 0
-    _internal_task_list = {}
-    
+    _internal_pending = []
+    _internal_running = {}
+    _internal_sequence = 0
+    _internal_workers = []
+
     @staticmethod
-    def _enter(task):
-        """Used for counting of running tasks.
-        pre: GeneratorTask._internal_task_count >= 0
-        #pre: not GeneratorTask._internal_task_list.has_key(task.work_for)
-        post: GeneratorTask. _internal_task_count >= 1
-        #post: __old__.GeneratorTask._internal_task_count-1 == GeneratorTask._internal_task_count
+    def _ensure_workers():
+        """Start worker threads on first use.
+        Caller must hold GeneratorTask._internal_condition.
         """
-        GeneratorTask._internal_task_list_lock.acquire()
-#        GeneratorTask._wait(task.work_for)
-
-        GeneratorTask._internal_task_count += 1
-        GeneratorTask._internal_task_list[task.work_for] = task
-#        ka_debug.info('enter task: [%s], count aprox.= %u' % \
-#               (task.work_for, GeneratorTask._internal_task_count))
-        GeneratorTask._internal_task_list_lock.release()
-        ka_status.Status.instance(). \
-                       set(ka_status.TOPIC_TASK, ka_status.SUB_UNFINISHED,
-                           str(GeneratorTask._internal_task_count))
-    
+        while len(GeneratorTask._internal_workers) < _pool_size():
+            worker = threading.Thread(target=GeneratorTask._work)
+            worker.setDaemon(True)
+            GeneratorTask._internal_workers.append(worker)
+            worker.start()
+
     @staticmethod
-    def _leave(work_for):
-        """Used for counting of running tasks.
-        pre: GeneratorTask._internal_task_count >= 1
-        #pre: GeneratorTask._internal_task_list.has_key(work_for)
-        post: GeneratorTask._internal_task_count >= 0
-        #post: __old__.GeneratorTask._internal_task_count+1 == GeneratorTask._internal_task_count
+    def _coalesce(work_for):
+        """Drop waiting tasks and stop the running task for the same target.
+        Caller must hold GeneratorTask._internal_condition.
         """
-        GeneratorTask._internal_task_list_lock.acquire()
+        superseded = [entry for entry in GeneratorTask._internal_pending
+                                            if entry[2].work_for == work_for]
+        for entry in superseded:
+            entry[2].quit = True
+            GeneratorTask._internal_pending.remove(entry)
+            GeneratorTask._internal_task_count -= 1
+        if len(superseded) > 0:
+            heapq.heapify(GeneratorTask._internal_pending)
+        if GeneratorTask._internal_running.has_key(work_for):
+            GeneratorTask._internal_running[work_for].quit = True
+
+    @staticmethod
+    def _make_room(entry):
+        """Keep the queue bounded. Drops the least important waiting task.
+        Returns False if the new entry itself is the least important one.
+        Caller must hold GeneratorTask._internal_condition.
+        """
+        if len(GeneratorTask._internal_pending) < QUEUE_CAPACITY:
+            return True
+        lowest = max(GeneratorTask._internal_pending)
+        if lowest[0] <= entry[0]:
+            return False
+        lowest[2].quit = True
+        GeneratorTask._internal_pending.remove(lowest)
+        heapq.heapify(GeneratorTask._internal_pending)
         GeneratorTask._internal_task_count -= 1
+        ka_debug.err('task queue is full, dropped [%s]' % lowest[2].work_for)
+        return True
+
+    @staticmethod
+    def _next_runnable():
+        """Remove and return the most important waiting task.
+        Tasks are skipped while an older task for the same target is running.
+        Caller must hold GeneratorTask._internal_condition.
+        """
+        for entry in sorted(GeneratorTask._internal_pending):
+            if not GeneratorTask._internal_running.has_key(entry[2].work_for):
+                GeneratorTask._internal_pending.remove(entry)
+                heapq.heapify(GeneratorTask._internal_pending)
+                return entry[2]
+        return None
 
-        GeneratorTask._internal_leave_condition.acquire()
-        if GeneratorTask._internal_task_list.has_key(work_for):
-            del GeneratorTask._internal_task_list[work_for]
-        GeneratorTask._internal_leave_condition.notifyAll()
-        GeneratorTask._internal_leave_condition.release()
-
-#        ka_debug.info('leave task: [%s], count aprox.= %u' % \
-#               (work_for, GeneratorTask._internal_task_count))
-        GeneratorTask._internal_task_list_lock.release()
-        ka_status.Status.instance(). \
-                       set(ka_status.TOPIC_TASK, ka_status.SUB_UNFINISHED,
-                           str(GeneratorTask._internal_task_count))
-    
     @staticmethod
-    def _wait(work_for):
-        GeneratorTask._internal_task_list_lock.acquire()
-        if GeneratorTask._internal_task_list.has_key(work_for):
-            GeneratorTask._internal_task_list[work_for].quit = True
-            ka_debug.info('set quit task: [%s], count aprox.= %u' % \
-                   (work_for, GeneratorTask._internal_task_count))
-            ka_debug.print_call_stack()
-        GeneratorTask._internal_task_list_lock.release()
-
-        GeneratorTask._internal_leave_condition.acquire()
-        while GeneratorTask._internal_task_list.has_key(work_for):
-#            ka_debug.info('wait task: [%s], count aprox.= %u' % \
-#                   (work_for, GeneratorTask._internal_task_count))
-            GeneratorTask._internal_leave_condition.wait()
-        GeneratorTask._internal_leave_condition.release()
-            
+    def _work():
+        """Main loop of a worker thread."""
+        condition = GeneratorTask._internal_condition
+        while True:
+            condition.acquire()
+            try:
+                task = GeneratorTask._next_runnable()
+                while task is None:
+                    condition.wait()
+                    task = GeneratorTask._next_runnable()
+                GeneratorTask._internal_running[task.work_for] = task
+            finally:
+                condition.release()
+            GeneratorTask._update_status()
+
+            task._run()
+
+            condition.acquire()
+            try:
+                del GeneratorTask._internal_running[task.work_for]
+                GeneratorTask._internal_task_count -= 1
+                condition.notifyAll()
+            finally:
+                condition.release()
+            GeneratorTask._update_status()
+
+    @staticmethod
+    def _update_status():
+        status = ka_status.Status.instance()
+        status.set(ka_status.TOPIC_TASK, ka_status.SUB_UNFINISHED,
+                   str(GeneratorTask._internal_task_count))
+        status.set(ka_status.TOPIC_TASK, ka_status.SUB_QUEUED,
+                   str(len(GeneratorTask._internal_pending)))
+
     @staticmethod
     def is_completed():
         """Check that all tasks are terminated.
         pre: GeneratorTask._internal_task_count >= 0
         """
         return GeneratorTask._internal_task_count < 1
-    
-    def __init__(self, task_function, on_task_completed, work_for):
+
+    def __init__(self, task_function, on_task_completed, work_for,
+                 priority=PRIORITY_INTERACTIVE, on_task_progress=None):
         """
         pre: task_function is not None and callable(task_function)
         pre: on_task_completed is not None and callable(on_task_completed)
+        pre: on_task_progress is None or callable(on_task_progress)
+        pre: PRIORITY_INTERACTIVE <= priority <= PRIORITY_EXPORT
         """
         self.quit = False
         self._on_task_completed = on_task_completed
+        self._on_task_progress = on_task_progress
         self._task_function = task_function
         self.work_for = work_for
+        self.priority = priority
+        self._args = ()
 
-    def _start(self, *args, **dummy):
+    def _run(self):
+        if self.quit:
+            ka_debug.info('quitting task: [%s], count aprox.= %u' % \
+                   (self.work_for, GeneratorTask._internal_task_count))
+            return
         try:
-            GeneratorTask._internal_serialize_lock.acquire()
-            GeneratorTask._wait(self.work_for)
-            GeneratorTask._enter(self)
-            GeneratorTask._internal_serialize_lock.release()
-
-            result = self._task_function(self, *args)
+            result = self._task_function(self, *self._args)
             if not self.quit:
                 # GTK will start this 'completed task' whenever there are no higher
                 # priority events pending to the default main loop.
                 gobject.idle_add(self._on_task_completed, result)
             else:
                 ka_debug.info('quitting task: [%s], count aprox.= %u' % \
-                       (self.work_for, GeneratorTask._internal_task_count))                
+                       (self.work_for, GeneratorTask._internal_task_count))
         except:
             ka_debug.err('failed calculating [%s] [%s] [%s]' % \
                    (self._task_function, sys.exc_info()[0], sys.exc_info()[1]))
             traceback.print_exc(file=sys.__stderr__)
-        finally:
-            GeneratorTask._leave(self.work_for)
 
-    def start(self, *args, **kwargs):
-        threading.Thread(target=self._start, args=args, kwargs=kwargs).start()
+    def progress(self, result):
+        """Hand an intermediate result to the GUI while still running."""
+        if not self.quit and self._on_task_progress is not None:
+            gobject.idle_add(self._on_task_progress, result)
+
+    def start(self, *args, **dummy):
+        """Queue this task for one of the worker threads.
+        Returns False if the queue is full of more important tasks.
+        """
+        self._args = args
+        condition = GeneratorTask._internal_condition
+        condition.acquire()
+        try:
+            GeneratorTask._coalesce(self.work_for)
+            GeneratorTask._internal_sequence += 1
+            entry = (self.priority, GeneratorTask._internal_sequence, self)
+            accepted = GeneratorTask._make_room(entry)
+            if accepted:
+                heapq.heappush(GeneratorTask._internal_pending, entry)
+                GeneratorTask._internal_task_count += 1
+                GeneratorTask._ensure_workers()
+                condition.notify()
+            else:
+                ka_debug.err('task queue is full, rejected [%s]' % self.work_for)
+        finally:
+            condition.release()
+        GeneratorTask._update_status()
+        return accepted
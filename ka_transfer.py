@@ -0,0 +1,298 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Chunked transfer of populations between participants of a tube.
+A buffer is split into chunks, each chunk carries its own checksum and is
+acknowledged by the receiver. Only a few chunks are on their way at any
+time, so the main loop is never blocked by a large population. Partially
+received buffers are kept, sending the same buffer again resumes at the
+first missing chunk.
+
+    sender                         receiver
+    BeginTransfer(md5, ...)  --->  first missing chunk
+    SendChunk(md5, 0, ...)   --->  next missing chunk
+    ...
+"""
+
+import sys
+import zlib
+import base64
+import hashlib
+
+import ka_debug
+
+# Limit for the size of a single message, after base64 encoding.
+MAX_MESSAGE_SIZE = 64 * 1024
+# Chunks sent without waiting for an acknowledge.
+WINDOW = 4
+# Times a transfer starts over from a rejected chunk.
+MAX_RETRIES = 8
+# Partially received buffers kept for resuming.
+MAX_PARTIAL = 4
+
+def chunk_size(total_size):
+    """Size of the raw chunks for a buffer of total_size bytes.
+    Chunks grow by a third when base64 encoded, so the raw size is derived
+    from the message limit. The buffer is split into chunks of equal size.
+    Buffers are already compressed by model_codec, compressing the chunks
+    again would not pay.
+    post: __return__ >= 1
+    """
+    max_raw = MAX_MESSAGE_SIZE / 4 * 3
+    count = max(1, (total_size + max_raw - 1) / max_raw)
+    return max(1, (total_size + count - 1) / count)
+
+def _checksum(data):
+    return zlib.crc32(data) & 0xffffffff
+
+class Sender(object):
+    """Sends a buffer to a single peer.
+    peer is a D-Bus proxy of the receiving tube or a LocalTube proxy.
+    on_done is called with True after the receiver got the whole buffer,
+    with False if the transfer failed. on_unsupported is called
+    if the peer does not know about chunked transfers.
+    """
+
+    def __init__(self, peer, code_type, code_element,
+                 on_done=None, on_unsupported=None):
+        self._peer = peer
+        self._code_type = code_type
+        self._code_element = code_element
+        self._on_done = on_done
+        self._on_unsupported = on_unsupported
+        self.code_md5 = hashlib.md5(code_element).hexdigest()
+        self._chunk_size = chunk_size(len(code_element))
+        self.chunk_count = max(1, (len(code_element) + self._chunk_size - 1)
+                                   / self._chunk_size)
+        self._next = 0
+        self._acknowledged = 0
+        self._in_flight = 0
+        self._epoch = 0
+        self._retries = 0
+        self._finished = False
+
+    def start(self):
+        self._peer.BeginTransfer(self._code_type, len(self._code_element),
+                                 self.chunk_count, self.code_md5,
+                                 reply_handler=self._on_begin,
+                                 error_handler=self._on_begin_error)
+
+    def _on_begin(self, first_missing):
+        if first_missing > 0:
+            ka_debug.info('transfer [%s] resumes at chunk %u of %u' % \
+                       (self.code_md5, first_missing, self.chunk_count))
+        self._next = self._acknowledged = int(first_missing)
+        self._send_window()
+
+    def _on_begin_error(self, exception):
+        if self._on_unsupported is not None \
+           and 'UnknownMethod' in str(getattr(exception, 'get_dbus_name',
+                                              lambda: '')()):
+            self._finish(None)
+            self._on_unsupported()
+        else:
+            self._on_error(exception)
+
+    def _send_window(self):
+        while not self._finished and self._in_flight < WINDOW \
+              and self._next < self.chunk_count:
+            self._send_chunk(self._next)
+            self._next += 1
+        if self._in_flight == 0 and self._acknowledged >= self.chunk_count:
+            self._finish(True)
+
+    def _send_chunk(self, index):
+        start = index * self._chunk_size
+        chunk = self._code_element[start:start+self._chunk_size]
+        epoch = self._epoch
+        self._in_flight += 1
+        self._peer.SendChunk(self.code_md5, index, base64.b64encode(chunk),
+                             _checksum(chunk),
+                             reply_handler=lambda next_missing:
+                                 self._on_acknowledge(index, epoch,
+                                                      next_missing),
+                             error_handler=self._on_error)
+
+    def _on_acknowledge(self, index, epoch, next_missing):
+        self._in_flight -= 1
+        next_missing = int(next_missing)
+        if self._finished:
+            return
+        if next_missing <= index and epoch == self._epoch:
+            # chunk was rejected, chunks sent after it will be rejected too
+            self._retries += 1
+            if self._retries > MAX_RETRIES:
+                ka_debug.err('transfer [%s] failed, too many retries' % \
+                             self.code_md5)
+                self._finish(False)
+                return
+            self._epoch += 1
+            self._next = next_missing
+        self._acknowledged = max(self._acknowledged, next_missing)
+        self._send_window()
+
+    def _on_error(self, exception):
+        ka_debug.err('transfer [%s] failed [%s]' % (self.code_md5, exception))
+        self._finish(False)
+
+    def _finish(self, success):
+        if not self._finished:
+            self._finished = True
+            if success is not None and self._on_done is not None:
+                self._on_done(success)
+
+class _Partial(object):
+    """A buffer while it is received."""
+
+    def __init__(self, code_type, total_size, chunk_count):
+        self.code_type = code_type
+        self.total_size = total_size
+        self.chunk_count = chunk_count
+        self.chunks = []
+
+class Receiver(object):
+    """Collects the chunks of all incoming transfers.
+    on_complete is called with code type, buffer and sender
+    after a buffer was received and its MD5 checksum matches.
+    """
+
+    def __init__(self, on_complete):
+        """
+        pre: callable(on_complete)
+        """
+        self._on_complete = on_complete
+        self._partials = {}
+        self._order = []
+
+    def begin_transfer(self, code_type, total_size, chunk_count, code_md5,
+                       sender=None):
+        """Returns the index of the first chunk missing."""
+        partial = self._partials.get(code_md5, None)
+        if partial is None or partial.chunk_count != chunk_count:
+            partial = _Partial(code_type, total_size, chunk_count)
+            self._partials[code_md5] = partial
+        if code_md5 in self._order:
+            self._order.remove(code_md5)
+        self._order.append(code_md5)
+        while len(self._order) > MAX_PARTIAL:
+            del self._partials[self._order.pop(0)]
+        return len(partial.chunks)
+
+    def receive_chunk(self, code_md5, index, chunk_base64, chunk_crc,
+                      sender=None):
+        """Store chunk if it is the next one expected.
+        Returns the index of the next chunk missing.
+        """
+        partial = self._partials.get(code_md5, None)
+        if partial is None:
+            return 0
+        if index == len(partial.chunks):
+            try:
+                chunk = base64.b64decode(chunk_base64)
+                if _checksum(chunk) == chunk_crc:
+                    partial.chunks.append(chunk)
+                else:
+                    ka_debug.err('chunk %u of [%s] is corrupt' % \
+                                 (index, code_md5))
+            except:
+                ka_debug.err('failed decoding chunk %u of [%s] [%s] [%s]' % \
+                             (index, code_md5,
+                              sys.exc_info()[0], sys.exc_info()[1]))
+        if len(partial.chunks) < partial.chunk_count:
+            return len(partial.chunks)
+        code_element = ''.join(partial.chunks)
+        if len(code_element) != partial.total_size \
+           or hashlib.md5(code_element).hexdigest() != code_md5:
+            ka_debug.err('transfer [%s] is corrupt, starting over' % code_md5)
+            partial.chunks = []
+            return 0
+        del self._partials[code_md5]
+        self._order.remove(code_md5)
+        self._on_complete(partial.code_type, code_element, sender)
+        return partial.chunk_count
+
+class LocalBus(object):
+    """Stands in for a D-Bus tube. Transfers between Sender and Receiver
+    objects inside a single process, without D-Bus or Telepathy.
+    Calls are queued until pump() is called, so participants can be
+    dropped while a transfer is on its way.
+    """
+    _METHODS = {'BeginTransfer': 'begin_transfer',
+                'SendChunk': 'receive_chunk',
+               }
+
+    def __init__(self):
+        self._receivers = {}
+        self._queue = []
+        self.delivered = 0
+
+    def join(self, bus_name, receiver):
+        """Add participant, returns the tube as seen by this participant."""
+        self._receivers[bus_name] = receiver
+        return LocalTube(self, bus_name)
+
+    def drop(self, bus_name):
+        """Remove participant, calls on their way to it fail."""
+        self._receivers.pop(bus_name, None)
+
+    def call(self, sender, bus_name, method_name, args,
+             reply_handler, error_handler):
+        self._queue.append((sender, bus_name, method_name, args,
+                            reply_handler, error_handler))
+
+    def pump(self, limit=-1):
+        """Deliver queued calls, including calls queued meanwhile.
+        Returns number of delivered calls."""
+        count = 0
+        while self._queue and count != limit:
+            sender, bus_name, method_name, args, reply_handler, \
+                                              error_handler = self._queue.pop(0)
+            count += 1
+            receiver = self._receivers.get(bus_name, None)
+            if receiver is None:
+                error_handler(IOError('participant %s dropped' % bus_name))
+                continue
+            method = getattr(receiver, LocalBus._METHODS[method_name])
+            reply_handler(method(*args, **{'sender': sender}))
+        self.delivered += count
+        return count
+
+class LocalTube(object):
+    """Tube of a single participant of a LocalBus."""
+
+    def __init__(self, bus, bus_name):
+        self._bus = bus
+        self._bus_name = bus_name
+
+    def get_unique_name(self):
+        return self._bus_name
+
+    def get_object(self, bus_name, path):
+        return _LocalProxy(self._bus, self._bus_name, bus_name)
+
+class _LocalProxy(object):
+
+    def __init__(self, bus, sender, bus_name):
+        self._bus = bus
+        self._sender = sender
+        self._bus_name = bus_name
+
+    def __getattr__(self, method_name):
+        def call(*args, **kwargs):
+            self._bus.call(self._sender, self._bus_name, method_name, args,
+                           kwargs['reply_handler'], kwargs['error_handler'])
+        return call
@@ -15,14 +15,17 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import sys
 import hashlib 
 import base64
 
+import gobject
 from dbus.service import method, signal
 from dbus.gobject_service import ExportedGObject
 
 import ka_debug
 import ka_status
+import ka_transfer
 
 SERVICE = 'net.sourceforge.kandid'
 IFACE = SERVICE
@@ -30,6 +33,7 @@ PATH = '/net/sourceforge/kandid/minimal'
 
 SEND_POPULATION = 'P'
 SEND_PROTOZOON = 'I'
+SEND_DELTA = 'D'
 
 class KandidTube(ExportedGObject):
     """The bit that talks over the tubes"""
@@ -45,6 +49,10 @@ class KandidTube(ExportedGObject):
         self.get_buddy_by_handle = get_buddy  # Converts handle to Buddy object
         self._entered = False  # Have we set up the tube?
         self._participating_buddies = set([])
+        # Version of the population held by each peer,
+        # only peers understanding deltas announce their version.
+        self._peer_versions = {}
+        self._receiver = ka_transfer.Receiver(self._on_transfer_completed)
         self._status = ka_status.Status.instance()
         self._tube.watch_participants(self.on_participant_change)
 
@@ -73,6 +81,7 @@ class KandidTube(ExportedGObject):
             if self._is_initiator:
                 ka_debug.info("I'm initiating the tube, will watch for hellos.")
                 self.add_hello_handler()
+                self.add_holding_handler()
                 self.add_publish_handler()
             else:
                 ka_debug.info('Hello, everyone! What did I miss?')
@@ -85,6 +94,12 @@ class KandidTube(ExportedGObject):
         self._tube.add_signal_receiver(self.on_hello, 'Hello',
                                 IFACE, path=PATH, sender_keyword='sender')
 
+    def add_holding_handler(self):
+        ka_debug.info('I am initiating. Adding holding handler.')
+        self._tube.add_signal_receiver(self.on_holding_population,
+                                'HoldingPopulation',
+                                IFACE, path=PATH, sender_keyword='sender')
+
     def add_publish_handler(self):
         ka_debug.info('I am entered. Adding input handler.')
         self._tube.add_signal_receiver(self.on_publish_protozoon, 'PublishProtozoon',
@@ -103,6 +118,52 @@ class KandidTube(ExportedGObject):
         ka_debug.info('on_hello: Newcomer [%s] has joined. World them.' % sender)
         self.send_population(self._controller.serialize_model(), sender)
 
+    def announce_population(self, version):
+        """Tell the initiator which population I hold now."""
+        self.HoldingPopulation(version)
+
+    @signal(dbus_interface=IFACE, signature='s')
+    def HoldingPopulation(self, version):
+        """Announce version of the population."""
+        ka_debug.info('HoldingPopulation: I hold version [%s]' % version)
+
+    def on_holding_population(self, version, sender=None):
+        """A peer took over a population, later changes are sent as deltas."""
+        if sender == self._tube.get_unique_name():
+            # sender is my bus name, so ignore my own signal
+            return
+        ka_debug.info('on_holding_population: [%s] holds version [%s]' % \
+                   (sender, version))
+        self._peer_versions[sender] = version
+
+    def send_changes(self, version, make_delta, make_population):
+        """Send changes of my population to all peers holding an older version.
+        make_delta returns a delta since the version held by a peer or None,
+        in this case the whole population from make_population is sent.
+        The version held by a peer is only updated when the peer announces it.
+        """
+        for sender, peer_version in self._peer_versions.items():
+            if peer_version == version:
+                continue
+            code_element = make_delta(peer_version)
+            code_type = SEND_DELTA
+            if code_element is None:
+                code_element, code_type = make_population(), SEND_POPULATION
+            try:
+                self.send_population(code_element, sender, code_type,
+                                     lambda success, sender=sender: \
+                                         self._on_changes_sent(sender,
+                                                               success))
+            except:
+                ka_debug.err('failed sending to [%s] [%s] [%s]' % \
+                           (sender, sys.exc_info()[0], sys.exc_info()[1]))
+                del self._peer_versions[sender]
+
+    def _on_changes_sent(self, sender, success):
+        if not success:
+            # version of the peer is unknown now
+            self._peer_versions.pop(sender, None)
+
     def publish_protozoon(self, code_element):
         code_element_base64 = base64.b64encode(code_element)
         code_md5 = hashlib.md5(code_element).hexdigest() 
@@ -131,12 +192,33 @@ class KandidTube(ExportedGObject):
         else:
             ka_debug.err('Somebody called me with a corrupt data model.')
 
-    def send_population(self, code_element, sender=None):
+    def send_population(self, code_element, sender=None,
+                        code_type=SEND_POPULATION, on_done=None):
+        """Send population in chunks. Peers running an older release
+        receive the population in the former format in a single message."""
+        transfer = ka_transfer.Sender(self._tube.get_object(sender, PATH),
+                                      code_type, code_element, on_done,
+                                      on_unsupported=lambda: \
+                                          self._send_population_at_once(
+                                              sender, code_type))
+        ka_debug.info('send_population: Sending %u bytes in %u chunks, type: [%s] md5: [%s]' % \
+                   (len(code_element), transfer.chunk_count, code_type,
+                    transfer.code_md5))
+        transfer.start()
+
+    def _send_population_at_once(self, sender, code_type):
+        if code_type != SEND_POPULATION:
+            # older releases don't understand anything else
+            return
+        # older releases can only read pickled populations
+        code_element = self._controller.serialize_legacy_model()
+        if code_element is None:
+            return
         code_element_base64 = base64.b64encode(code_element)
         code_md5 = hashlib.md5(code_element).hexdigest() 
         ka_debug.info('send_population: Sent %u bytes, type: [%s] md5: [%s]' % \
-                   (len(code_element), SEND_POPULATION, code_md5))
-        self._tube.get_object(sender, PATH).SendPopulation(SEND_POPULATION,
+                   (len(code_element), code_type, code_md5))
+        self._tube.get_object(sender, PATH).SendPopulation(code_type,
                                                            code_element_base64,
                                                            code_md5)
 
@@ -153,6 +235,37 @@ class KandidTube(ExportedGObject):
         else:
             ka_debug.err('Somebody called me with a corrupt data model.')
 
+    @method(dbus_interface=IFACE, in_signature='suus', out_signature='u',
+            sender_keyword='sender')
+    def BeginTransfer(self, code_type, total_size, chunk_count, code_md5,
+                      sender=None):
+        """Prepare receiving a population in chunks.
+        Returns index of the first missing chunk."""
+        ka_debug.info('BeginTransfer: %u bytes in %u chunks, type: [%s] md5: [%s]' \
+                   % (total_size, chunk_count, code_type, code_md5))
+        return self._receiver.begin_transfer(str(code_type), total_size,
+                                             chunk_count, str(code_md5),
+                                             sender)
+
+    @method(dbus_interface=IFACE, in_signature='susu', out_signature='u',
+            sender_keyword='sender')
+    def SendChunk(self, code_md5, index, chunk_base64, chunk_crc, sender=None):
+        """Receive a single chunk. Returns index of the next missing chunk."""
+        return self._receiver.receive_chunk(str(code_md5), index,
+                                            str(chunk_base64), chunk_crc,
+                                            sender)
+
+    def _on_transfer_completed(self, code_type, code_element, sender):
+        """Whole population received, process it after replying."""
+        ka_debug.info('_on_transfer_completed: Received %u bytes, type: [%s]' \
+                   % (len(code_element), code_type))
+        nick = self._map_to_nick(sender)
+        gobject.idle_add(self._process_received, code_type, code_element, nick)
+
+    def _process_received(self, code_type, code_element, nick):
+        self._controller.on_received(code_type, code_element, nick)
+        return False
+
     #TODO How to map from sender to buddy / nick?
     def _map_to_nick(self, sender):
         nick = '?'
@@ -15,10 +15,74 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import types
+import struct
+import hashlib
+
 import model_locus
 
+# Members identifying an allele instance, not describing its phenotype.
+IDENTITY_MEMBERS = ['_pattern', '_unique_id', 'path']
+
+_FLOAT = struct.Struct('>d')
+
+def _feed_digest(md5, value):
+    """Feed a canonical representation of value into md5."""
+    if isinstance(value, model_locus.Locus):
+        md5.update('<' + value.__class__.__name__)
+        feed_members(md5, value, [])
+        md5.update('>')
+    elif type(value) in [types.ListType, types.TupleType]:
+        md5.update('[')
+        for elem in value:
+            _feed_digest(md5, elem)
+            md5.update(',')
+        md5.update(']')
+    elif type(value) == types.DictType:
+        md5.update('{')
+        for key in sorted(value.keys()):
+            _feed_digest(md5, key)
+            md5.update(':')
+            _feed_digest(md5, value[key])
+            md5.update(',')
+        md5.update('}')
+    elif value is None:
+        md5.update('N')
+    elif type(value) == types.BooleanType:
+        md5.update('T' if value else 'F')
+    elif type(value) in [types.IntType, types.LongType]:
+        md5.update('i' + str(value))
+    elif type(value) == types.FloatType:
+        md5.update('f' + _FLOAT.pack(value))
+    elif type(value) == types.StringType:
+        md5.update('s%u:' % len(value))
+        md5.update(value)
+    elif type(value) == types.UnicodeType:
+        encoded = value.encode('utf-8')
+        md5.update('u%u:' % len(encoded))
+        md5.update(encoded)
+    else:
+        raise TypeError('can not digest %s' % type(value))
+
+def feed_members(md5, value, excluded):
+    """Feed all members of a gene describing its phenotype into md5,
+    except the excluded ones."""
+    transient = getattr(value, 'transient_members', [])
+    members = model_locus.get_members(value)
+    for name in sorted(members.keys()):
+        if name not in IDENTITY_MEMBERS and name not in transient \
+           and name not in excluded:
+            md5.update(';' + name + '=')
+            _feed_digest(md5, members[name])
+
 class Allele(model_locus.Locus):
-    
+
+    __slots__ = []
+
+    # Members of a subclass which are only calculated while rendering.
+    # They are ignored by digest().
+    transient_members = []
+
     def __init__(self, root):
         super(Allele, self).__init__(root)
 
@@ -30,3 +94,15 @@ class Allele(model_locus.Locus):
 
     def __hash__(self):
         raise TypeError("Genome objects are unhashable")
+
+    def digest(self):
+        """Content digest of this allele and all its components.
+        Two alleles producing the same image have the same digest.
+        The digest does not depend on identity or position in the genome tree.
+        Genome objects are mutable, so the digest must be recalculated
+        after each modification.
+        post: len(__return__) == 32
+        """
+        md5 = hashlib.md5()
+        _feed_digest(md5, self)
+        return md5.hexdigest()
@@ -0,0 +1,356 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Binary format for genomes.
+Genomes are encoded directly from the live objects, no deep copy is made.
+The stream starts with an uncompressed header followed by zlib compressed
+records. Each record is prefixed by its length, so records can be decoded
+one after the other while the stream is read.
+
+Values are tagged by a single character:
+  N None, T True, F False, i int, L long, f float, s str, u unicode,
+  l list, t tuple, d dict, C class definition, o object.
+Objects are instances of gene classes found in the 'ep_', 'exon_' and
+'model_' modules.
+"""
+
+import sys
+import struct
+import zlib
+import types
+import traceback
+
+import ka_debug
+import model_locus
+import model_allele
+
+MAGIC_NUMBER = 'kc'
+FORMAT_VERSION = '1'
+HEADER_SIZE = len(MAGIC_NUMBER) + 2 + len(FORMAT_VERSION)
+
+# Compressed bytes read at once while decoding a stream.
+CHUNK_SIZE = 64 * 1024
+
+_GENE_MODULES = ('ep_', 'exon_', 'model_')
+
+_INT = struct.Struct('>q')
+_FLOAT = struct.Struct('>d')
+_LENGTH = struct.Struct('>I')
+_INT_MIN, _INT_MAX = -2**63, 2**63-1
+
+# Persistent fields of the current release, learned while migrating.
+_current_fields = {}
+
+def is_encoded(input_buffer):
+    """True if input_buffer starts with the header of this format."""
+    return input_buffer.startswith(MAGIC_NUMBER)
+
+def _encode(value, parts, classes):
+    """Append the encoded value to parts.
+    classes maps already defined classes to their index.
+    """
+    value_type = type(value)
+    if value is None:
+        parts.append('N')
+    elif value_type == types.BooleanType:
+        parts.append('T' if value else 'F')
+    elif value_type == types.IntType or value_type == types.LongType:
+        if _INT_MIN <= value <= _INT_MAX:
+            parts.append('i' + _INT.pack(value))
+        else:
+            _encode_string('L', str(value), parts)
+    elif value_type == types.FloatType:
+        parts.append('f' + _FLOAT.pack(value))
+    elif value_type == types.StringType:
+        _encode_string('s', value, parts)
+    elif value_type == types.UnicodeType:
+        _encode_string('u', value.encode('utf-8'), parts)
+    elif value_type == types.ListType or value_type == types.TupleType:
+        parts.append(('l' if value_type == types.ListType else 't')
+                     + _LENGTH.pack(len(value)))
+        for element in value:
+            _encode(element, parts, classes)
+    elif value_type == types.DictType:
+        parts.append('d' + _LENGTH.pack(len(value)))
+        for key in sorted(value.keys()):
+            _encode(key, parts, classes)
+            _encode(value[key], parts, classes)
+    elif isinstance(value, model_locus.Locus):
+        _encode_object(value, parts, classes)
+    else:
+        raise TypeError('can not encode %s' % value_type)
+
+def _encode_string(tag, value, parts):
+    parts.append(tag + _LENGTH.pack(len(value)))
+    parts.append(value)
+
+def _encode_object(value, parts, classes):
+    """Write all persistent fields of a gene.
+    Transient fields are only calculated while rendering, they are
+    never written."""
+    a_class = value.__class__
+    if a_class not in classes:
+        classes[a_class] = len(classes)
+        parts.append('C')
+        _encode_string('s', a_class.__module__, parts)
+        _encode_string('s', a_class.__name__, parts)
+    transient = getattr(value, 'transient_members', [])
+    members = model_locus.get_members(value)
+    fields = []
+    for name in sorted(members.keys()):
+        if name in transient:
+            continue
+        field_parts = []
+        _encode(members[name], field_parts, classes)
+        fields.append((name, field_parts))
+    parts.append('o' + _LENGTH.pack(classes[a_class])
+                 + _LENGTH.pack(len(fields)))
+    for name, field_parts in fields:
+        _encode_string('s', name, parts)
+        parts.extend(field_parts)
+
+def encode_value(value):
+    """Returns the uncompressed encoding of a value."""
+    parts = []
+    _encode(value, parts, {})
+    return ''.join(parts)
+
+def _resolve_class(module_name, class_name):
+    """Only gene classes may be created while decoding."""
+    if not module_name.startswith(_GENE_MODULES):
+        raise ValueError('unexpected module %s' % module_name)
+    a_module = __import__(module_name)
+    a_class = getattr(a_module, class_name)
+    if not isinstance(a_class, type):
+        raise ValueError('unexpected class %s.%s' % (module_name, class_name))
+    return a_class
+
+def _persistent_fields(obj):
+    transient = getattr(obj, 'transient_members', [])
+    return set([name for name in model_locus.get_members(obj).keys()
+                     if name not in transient
+                        and name not in model_allele.IDENTITY_MEMBERS])
+
+def _migrate(obj):
+    """Genes written by an other release may miss some fields. Only genes
+    missing a field are rebuilt by their copy constructor, which knows
+    how to fill in new fields.
+    """
+    if not hasattr(obj, 'copy'):
+        return obj
+    try:
+        fields = _persistent_fields(obj)
+        expected = _current_fields.get(obj.__class__, None)
+        if expected is None:
+            upgraded = obj.copy()
+            expected = _persistent_fields(upgraded)
+            _current_fields[obj.__class__] = expected
+            return obj if expected <= fields else upgraded
+        return obj if expected <= fields else obj.copy()
+    except:
+        ka_debug.err('failed migrating [%s] [%s] [%s]' % \
+                   (obj.__class__, sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+    return obj
+
+class _Decoder(object):
+    """Decodes a single record."""
+
+    def __init__(self, raw, migrate):
+        self._raw = raw
+        self._pos = 0
+        self._migrate = migrate
+        self._classes = []
+
+    def _take(self, size):
+        start = self._pos
+        self._pos += size
+        if self._pos > len(self._raw):
+            raise ValueError('truncated record')
+        return self._raw[start:self._pos]
+
+    def _length(self):
+        return _LENGTH.unpack(self._take(_LENGTH.size))[0]
+
+    def _string(self):
+        return self._take(self._length())
+
+    def read_value(self):
+        tag = self._take(1)
+        if tag == 'N':
+            return None
+        elif tag == 'T':
+            return True
+        elif tag == 'F':
+            return False
+        elif tag == 'i':
+            return _INT.unpack(self._take(_INT.size))[0]
+        elif tag == 'L':
+            return long(self._string())
+        elif tag == 'f':
+            return _FLOAT.unpack(self._take(_FLOAT.size))[0]
+        elif tag == 's':
+            return self._string()
+        elif tag == 'u':
+            return self._string().decode('utf-8')
+        elif tag == 'l':
+            return [self.read_value() for dummy in xrange(self._length())]
+        elif tag == 't':
+            return tuple([self.read_value()
+                          for dummy in xrange(self._length())])
+        elif tag == 'd':
+            result = {}
+            for dummy in xrange(self._length()):
+                key = self.read_value()
+                result[key] = self.read_value()
+            return result
+        elif tag == 'C':
+            self._take(1)
+            module_name = self._string()
+            self._take(1)
+            self._classes.append(_resolve_class(module_name, self._string()))
+            return self.read_value()
+        elif tag == 'o':
+            return self._read_object()
+        raise ValueError('unknown tag %r' % tag)
+
+    def _read_object(self):
+        a_class = self._classes[self._length()]
+        state = {}
+        for dummy in xrange(self._length()):
+            self._take(1)
+            name = intern(self._string())
+            state[name] = self.read_value()
+        obj = a_class.__new__(a_class)
+        # Locus fills its slots and shares path strings when setting its state
+        if hasattr(obj, '__setstate__'):
+            obj.__setstate__(state)
+        else:
+            obj.__dict__.update(state)
+        return _migrate(obj) if self._migrate else obj
+
+def decode_value(raw, migrate=False):
+    """Decode a single record.
+    Set migrate if the record was written by an other release.
+    """
+    decoder = _Decoder(raw, migrate)
+    value = decoder.read_value()
+    if decoder._pos != len(raw):
+        raise ValueError('garbage after record')
+    return value
+
+class Writer(object):
+    """Writes records to a stream while compressing them."""
+
+    def __init__(self, write, revision):
+        """
+        pre: write is not None and callable(write)
+        pre: len(revision) == 2
+        """
+        self._write = write
+        self._compressor = zlib.compressobj()
+        write(MAGIC_NUMBER + revision + FORMAT_VERSION)
+
+    def write_raw(self, raw):
+        """Write an already encoded record."""
+        compressed = self._compressor.compress(_LENGTH.pack(len(raw)) + raw)
+        if compressed:
+            self._write(compressed)
+
+    def write_value(self, value):
+        self.write_raw(encode_value(value))
+
+    def sync(self):
+        """Flush all records written so far.
+        The stream can be continued by this writer or a fork of it."""
+        self._write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def fork(self, write):
+        """Returns a writer continuing the stream from its current state.
+        The new writer sends its output to write, this writer is not changed.
+        pre: write is not None and callable(write)
+        """
+        forked = Writer.__new__(Writer)
+        forked._write = write
+        forked._compressor = self._compressor.copy()
+        return forked
+
+    def close(self):
+        self._write(self._compressor.flush())
+
+class Reader(object):
+    """Reads records from a stream while decompressing them.
+    inv: len(self.revision) == 2
+    """
+
+    def __init__(self, read):
+        """
+        pre: read is not None and callable(read)
+        """
+        header = read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or not is_encoded(header):
+            raise ValueError('missing magic number')
+        if header[-len(FORMAT_VERSION):] != FORMAT_VERSION:
+            raise ValueError('unknown format version %s' % header[4:])
+        self.revision = header[len(MAGIC_NUMBER):len(MAGIC_NUMBER)+2]
+        self._read = read
+        self._decompressor = zlib.decompressobj()
+        self._data = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size):
+        """Decompress until size bytes are available or the input ends."""
+        while len(self._data) - self._pos < size and not self._eof:
+            chunk = self._read(CHUNK_SIZE)
+            if chunk:
+                more = self._decompressor.decompress(chunk)
+            else:
+                more = self._decompressor.flush()
+                self._eof = True
+            self._data = self._data[self._pos:] + more
+            self._pos = 0
+
+    def _take(self, size):
+        self._fill(size)
+        if len(self._data) - self._pos < size:
+            raise ValueError('truncated stream')
+        start = self._pos
+        self._pos += size
+        return self._data[start:self._pos]
+
+    def at_end(self):
+        """True if all records have been read."""
+        self._fill(1)
+        return self._pos == len(self._data)
+
+    def read_raw(self):
+        """Returns the next record without decoding it."""
+        size = _LENGTH.unpack(self._take(_LENGTH.size))[0]
+        return self._take(size)
+
+    def read_value(self, migrate=False):
+        return decode_value(self.read_raw(), migrate)
+
+def string_reader(input_buffer):
+    """Returns a read function for a buffer held in memory."""
+    position = [0]
+    def read(size):
+        start = position[0]
+        position[0] = min(start + size, len(input_buffer))
+        return input_buffer[start:position[0]]
+    return read
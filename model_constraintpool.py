@@ -24,6 +24,15 @@ FLOAT_RANGE   = 22
 STRING_1_OF_N = 31
 STRING_M_OF_N = 32
 
+def _get_enum(definition):
+    """Enumerations depending on the installed extensions are defined
+    by a function. It is called on first use, not while importing."""
+    enum = definition['enum']
+    if callable(enum):
+        enum = enum()
+        definition['enum'] = enum
+    return enum
+
 class ConstraintPool(object):
     """ConstraintPool is a singleton.
     Use ConstraintPool.get_pool() to get an instance.
@@ -84,17 +93,17 @@ class ConstraintPool(object):
         for definition in caller:
             if definition['bind'] == attribute_key:
                 if definition['domain'] == INT_1_OF_N:
-                    result = [x[1] for x in definition['enum']]
+                    result = [x[1] for x in _get_enum(definition)]
                 if definition['domain'] == INT_M_OF_N:
-                    result = [x[1] for x in definition['enum']]
+                    result = [x[1] for x in _get_enum(definition)]
                 if definition['domain'] == INT_RANGE:
                     result = (definition['min'], definition['max'])
                 if definition['domain'] == FLOAT_RANGE:
                     result = (definition['min'], definition['max'])
                 if definition['domain'] == STRING_1_OF_N:
-                    result = definition['enum']
+                    result = _get_enum(definition)
                 if definition['domain'] == STRING_M_OF_N:
-                    result = definition['enum']
+                    result = _get_enum(definition)
         return result
 
     def is_overwritten(self, caller, attribute_key):
@@ -15,20 +15,391 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+"""Ancestry of protozoans.
+The parents of each protozoon are remembered together with a small
+image. Images are kept inside a memory budget, least recently used images
+are dropped first. Optionally dropped images are compressed and written
+to disk, so deep ancestry survives long sessions.
+The ancestry is saved with the population as an edge list, images read
+back from the journal are decompressed when they are drawn first.
+"""
+
+import os
+import sys
+import zlib
+import errno
+import array
+import struct
+import shutil
+import tempfile
+import threading
+import traceback
+import cairo
+
+import ka_debug
+import ka_cache
+import ka_status
+import ka_importer
+import ka_preference
+
+# Longest edge of the stored images in pixels.
+THUMBNAIL_SIZE = 128
+# Memory budget for all images in bytes.
+HISTORY_BUDGET = 4 * 1024 * 1024
+# Disk budget for images written to disk in bytes.
+SPILL_BUDGET = 32 * 1024 * 1024
+
+_SPILL_HEADER = struct.Struct('>III')
+# Directories for images written to disk start with this prefix
+# followed by the process id.
+_SPILL_PREFIX = 'history_'
+
+def make_thumbnail(surface):
+    """Returns a copy of surface scaled down to THUMBNAIL_SIZE.
+    Small surfaces are returned unchanged.
+    pre: surface is not None
+    """
+    width, height = surface.get_width(), surface.get_height()
+    scale = float(THUMBNAIL_SIZE) / max(width, height, 1)
+    if scale >= 1.0:
+        return surface
+    thumb_width = max(1, int(width * scale))
+    thumb_height = max(1, int(height * scale))
+    thumbnail = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                   thumb_width, thumb_height)
+    ctx = cairo.Context(thumbnail)
+    ctx.scale(float(thumb_width) / width, float(thumb_height) / height)
+    ctx.set_operator(cairo.OPERATOR_SOURCE)
+    ctx.set_source_surface(surface)
+    ctx.paint()
+    return thumbnail
+
+def _decompress_surface(width, height, stride, data):
+    """Create an image surface from compressed pixels."""
+    pixels = array.array('c', zlib.decompress(data))
+    return cairo.ImageSurface.create_for_data(pixels, cairo.FORMAT_ARGB32,
+                                              width, height, stride)
+
+class ThumbnailStore(object):
+    """Images addressed by the protozoon id.
+    Least recently used images are dropped first when the memory budget
+    is exceeded. Dropped images may be written to disk, the oldest files
+    are removed first when the disk budget is exceeded.
+    Files are written and removed without holding self._lock, so drawing
+    is never blocked by disk access.
+    """
+
+    def __init__(self, budget=HISTORY_BUDGET, spill_path=None,
+                 spill_budget=SPILL_BUDGET):
+        """
+        pre: budget > 0
+        """
+        # Guards all members, always taken before the locks of both caches.
+        self._lock = threading.Lock()
+        # Serializes disk access, always taken before self._lock.
+        self._disk_lock = threading.Lock()
+        self._entries = ka_cache.LruCache(budget, ka_cache.surface_size,
+                                          self._on_evict)
+        self._spill_path = spill_path
+        # Sizes of the compressed images on disk.
+        self._spilled = ka_cache.LruCache(spill_budget, lambda size: size,
+                                          self._on_unspill)
+        # evicted images waiting to be written to disk
+        self._evicted = {}
+        # evicted images currently written to disk
+        self._writing = {}
+        # files waiting to be removed
+        self._doomed = []
+        # compressed images read from the journal, not drawn yet
+        self._pending = {}
+
+    def put(self, my_id, surface):
+        """Store a surface already scaled down."""
+        self._lock.acquire()
+        try:
+            self._discard(my_id)
+            self._entries.put(my_id, surface)
+        finally:
+            self._lock.release()
+        self._sync_disk()
+        self._update_status()
+
+    def get(self, my_id):
+        """Returns the surface or None.
+        A surface written to disk is read back into memory.
+        """
+        pending, spill_file = None, None
+        self._lock.acquire()
+        try:
+            surface = self._entries.get(my_id)
+            if surface is not None:
+                return surface
+            surface = self._evicted.pop(my_id, None)
+            if surface is None:
+                surface = self._writing.pop(my_id, None)
+            if surface is None:
+                pending = self._pending.pop(my_id, None)
+                if pending is None:
+                    if self._spilled.get(my_id) is None:
+                        return None
+                    spill_file = self._spill_file(my_id)
+        finally:
+            self._lock.release()
+        if pending is not None:
+            surface = _decompress_surface(*pending)
+        elif spill_file is not None:
+            surface = _read_spilled(spill_file)
+        if surface is not None:
+            self.put(my_id, surface)
+        return surface
+
+    def put_compressed(self, my_id, width, height, stride, data):
+        """Store a compressed image, it is decompressed on first use."""
+        self._lock.acquire()
+        try:
+            self._discard(my_id)
+            self._pending[my_id] = (width, height, stride, data)
+        finally:
+            self._lock.release()
+        self._sync_disk()
+
+    def export(self):
+        """Returns all images in memory as compressed tuples
+        (id, width, height, stride, compressed pixels).
+        Images written to disk are left out.
+        """
+        self._lock.acquire()
+        try:
+            entries = self._entries.items() + self._evicted.items() \
+                                            + self._writing.items()
+            exported = [(my_id,) + pending
+                        for my_id, pending in self._pending.iteritems()]
+        finally:
+            self._lock.release()
+        for my_id, surface in entries:
+            exported.append((my_id, surface.get_width(), surface.get_height(),
+                             surface.get_stride(), _compress_surface(surface)))
+        return exported
+
+    def remove(self, my_id):
+        self._lock.acquire()
+        try:
+            self._discard(my_id)
+        finally:
+            self._lock.release()
+        self._sync_disk()
+        self._update_status()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._pending.clear()
+            self._evicted.clear()
+            self._writing.clear()
+            self._forget_spilled()
+        finally:
+            self._lock.release()
+        self._sync_disk()
+        self._update_status()
+
+    def set_spill_path(self, spill_path):
+        """Enable writing dropped images to disk, None disables it."""
+        self._lock.acquire()
+        try:
+            self._forget_spilled()
+            self._evicted.clear()
+            self._spill_path = spill_path
+        finally:
+            self._lock.release()
+        self._sync_disk()
+
+    def close(self):
+        """Stop writing to disk and remove the directory of this session."""
+        spill_path = self._spill_path
+        self.set_spill_path(None)
+        if spill_path is not None:
+            shutil.rmtree(spill_path, True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def used(self):
+        """Memory used by all images in memory."""
+        return self._entries.used()
+
+    def _discard(self, my_id):
+        """Caller must hold self._lock."""
+        self._entries.discard(my_id)
+        self._pending.pop(my_id, None)
+        self._evicted.pop(my_id, None)
+        self._writing.pop(my_id, None)
+        if self._spilled.get(my_id) is not None:
+            self._spilled.discard(my_id)
+            self._doomed.append(self._spill_file(my_id))
+
+    def _forget_spilled(self):
+        """Caller must hold self._lock."""
+        for my_id, dummy in self._spilled.items():
+            self._doomed.append(self._spill_file(my_id))
+        self._spilled.clear()
+
+    def _on_evict(self, my_id, surface):
+        """Remember an image dropped from memory, it is written
+        to disk later. Called inside put(), self._lock is held.
+        """
+        if self._spill_path is not None:
+            self._evicted[my_id] = surface
+
+    def _on_unspill(self, my_id, size):
+        """Forget a file dropped to stay within the disk budget.
+        Called inside _write_spilled(), self._lock is held.
+        """
+        self._doomed.append(self._spill_file(my_id))
+
+    def _spill_file(self, my_id):
+        return os.path.join(self._spill_path, my_id + '.thumb')
+
+    def _sync_disk(self):
+        """Write evicted images to disk and remove dropped files.
+        Caller must not hold self._lock.
+        """
+        self._disk_lock.acquire()
+        try:
+            while True:
+                self._lock.acquire()
+                try:
+                    batch = self._evicted.items()
+                    self._evicted.clear()
+                    self._writing.update(batch)
+                    doomed, self._doomed = self._doomed, []
+                    spill_path = self._spill_path
+                finally:
+                    self._lock.release()
+                for file_path in doomed:
+                    _remove_file(file_path)
+                if not batch:
+                    return
+                for my_id, surface in batch:
+                    self._write_spilled(spill_path, my_id, surface)
+        finally:
+            self._disk_lock.release()
+
+    def _write_spilled(self, spill_path, my_id, surface):
+        """Write compressed pixels of an evicted surface.
+        Caller must hold self._disk_lock.
+        """
+        file_path = os.path.join(spill_path, my_id + '.thumb')
+        size = None
+        try:
+            data = _compress_surface(surface)
+            out_file = open(file_path, 'wb')
+            try:
+                out_file.write(_SPILL_HEADER.pack(surface.get_width(),
+                                                  surface.get_height(),
+                                                  surface.get_stride()))
+                out_file.write(data)
+            finally:
+                out_file.close()
+            size = len(data)
+        except:
+            ka_debug.err('failed spilling [%s] [%s] [%s]' % \
+                       (my_id, sys.exc_info()[0], sys.exc_info()[1]))
+            traceback.print_exc(file=sys.__stderr__)
+        self._lock.acquire()
+        try:
+            # image may have been used or removed while it was written
+            if self._writing.pop(my_id, None) is surface \
+               and size is not None and self._spill_path == spill_path \
+               and self._spilled.put(my_id, size):
+                return
+        finally:
+            self._lock.release()
+        _remove_file(file_path)
+
+    def _update_status(self):
+        ka_status.Status.instance().set(ka_status.TOPIC_CACHE,
+                                        ka_status.SUB_CACHE_HISTORY,
+                   '%u, %u kB, %u on disk' % (len(self._entries),
+                                              self._entries.used() / 1024,
+                                              len(self._spilled)))
+
+def _compress_surface(surface):
+    surface.flush()
+    return zlib.compress(str(surface.get_data()), 1)
+
+def _read_spilled(file_path):
+    in_file = None
+    try:
+        in_file = open(file_path, 'rb')
+        width, height, stride = _SPILL_HEADER.unpack(
+                                         in_file.read(_SPILL_HEADER.size))
+        return _decompress_surface(width, height, stride, in_file.read())
+    except:
+        ka_debug.err('failed reading spilled [%s] [%s] [%s]' % \
+                   (file_path, sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+    finally:
+        if in_file:
+            in_file.close()
+    return None
+
+def _remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+def _is_running(pid):
+    """True if a process with this id exists."""
+    try:
+        os.kill(pid, 0)
+    except OSError, err:
+        return err.errno != errno.ESRCH
+    return True
+
+def _remove_stale_spill_paths(data_path):
+    """Images of sessions which did not end properly are useless.
+    Directories of other running sessions are kept."""
+    for name in os.listdir(data_path):
+        if name.startswith(_SPILL_PREFIX):
+            pid = name[len(_SPILL_PREFIX):].split('_')[0]
+            if pid.isdigit() and not _is_running(int(pid)):
+                shutil.rmtree(os.path.join(data_path, name), True)
+
+def _spill_path():
+    """Directory for images written to disk or None if switched off.
+    Each session writes into a directory of its own.
+    """
+    if not ka_preference.Preference.instance().get(
+                                                ka_preference.HISTORY_SPILL):
+        return None
+    try:
+        data_path = ka_importer.get_data_path()
+        if not os.path.isdir(data_path):
+            os.makedirs(data_path)
+        _remove_stale_spill_paths(data_path)
+        return tempfile.mkdtemp(prefix=_SPILL_PREFIX + '%u_' % os.getpid(),
+                                dir=data_path)
+    except:
+        ka_debug.err('failed creating history path [%s] [%s]' % \
+                   (sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+    return None
+
 class KandidHistory(object):
     """
     """
     _history = None
     _icon_width = 48
-    _newest = 1
 
     class Item(object):
+        __slots__ = ['ref_count', 'parent1_id', 'parent2_id']
+
         def __init__(self, init_parent1_id, init_parent2_id):
             self.ref_count = 0
-            self.surface = None
             self.parent1_id = init_parent1_id
             self.parent2_id = init_parent2_id
-            self.old = 0
 
         def __str__(self):
             return '(' \
@@ -36,8 +407,6 @@ class KandidHistory(object):
                 + (self.parent1_id if self.parent1_id is not None else 'None') \
                 + ', ' \
                 + (self.parent2_id if self.parent2_id is not None else 'None') \
-                + ', ' \
-                + (str(self.surface) if self.surface is not None else 'None') \
                 + ')'
 
     def __init__(self):
@@ -46,7 +415,7 @@ class KandidHistory(object):
         """
         self.parents = {}
         self.assumed_icon_width = KandidHistory._icon_width
-        self.surfaces_referenced = 0
+        self.thumbnails = ThumbnailStore(spill_path=_spill_path())
  
     @staticmethod
     def instance():
@@ -56,7 +425,11 @@ class KandidHistory(object):
     
     def clear(self):
         self.parents = {}
-        self.surfaces_referenced = 0
+        self.thumbnails.clear()
+
+    def close(self):
+        """Remove all images written to disk."""
+        self.thumbnails.close()
 
     def rember_parents(self, my_id, parent1_id, parent2_id):
         """Remember the ids of my parents.
@@ -77,49 +450,70 @@ class KandidHistory(object):
             self.parents[parent2_id].ref_count += 1
 
     def link_surface(self, my_id, my_surface):
-        """Link an id with an surface
+        """Link an id with an surface.
+        Only a thumbnail of the surface is kept.
         pre: my_id is not None and my_id.startswith('_')
         pre: my_surface is not None
         """
         if my_id not in self.parents:
             self.parents[my_id] = KandidHistory.Item(None, None)
 #!!            self.parents[my_id].ref_count += -1
-        if self.parents[my_id].surface is None:
-            self.surfaces_referenced += 1
-        self.parents[my_id].surface = my_surface
-        self.parents[my_id].old = KandidHistory._newest
-        KandidHistory._newest += 1
-        self._limit_memory_usage()
-        
-    def _limit_memory_usage(self):
-        """
-        limit memory usage, forget old surfaces
-        """
-        while self.surfaces_referenced > 25:
-            min_id, min_old = None, 2**31
-            for key, parent in self.parents.iteritems():
-                if parent.surface is not None and parent.old < min_old:
-                    min_id, min_old  = key, parent.old
-            if min_id is not None:
-                self.parents[min_id].surface = None
-                self.surfaces_referenced -= 1
+        self.thumbnails.put(my_id, make_thumbnail(my_surface))
                           
     def unlink(self, my_id):
         """Forget an id and free the linked surface.
         pre: my_id is not None and my_id.startswith('_')
         """
-        if my_id in self.parents:
-            self.parents[my_id].ref_count -= 1
-            if self.parents[my_id].ref_count < 0:
-                my_parents = self.get_parents(my_id)
-                parent1_id, parent2_id = my_parents[0], my_parents[1]
-                if parent1_id in self.parents:
-                    self.unlink(parent1_id)
-                if parent2_id in self.parents:
-                    self.unlink(parent2_id)
-                if self.parents[my_id].surface is not None:
-                    self.surfaces_referenced -= 1
-                del self.parents[my_id]
+        # long chains of ancestors are walked without recursion
+        unlinking = [my_id]
+        while unlinking:
+            an_id = unlinking.pop()
+            item = self.parents.get(an_id, None)
+            if item is None:
+                continue
+            item.ref_count -= 1
+            if item.ref_count < 0:
+                for parent_id in (item.parent1_id, item.parent2_id):
+                    if parent_id in self.parents:
+                        unlinking.append(parent_id)
+                self.thumbnails.remove(an_id)
+                del self.parents[an_id]
+
+    def to_edge_list(self):
+        """Compact form of the ancestry for saving.
+        Returns a list [names, parent indices, reference counts].
+        The first entries of names are the remembered ids, parents no longer
+        remembered follow. Two indices into names per remembered id refer
+        to its parents, -1 for an unknown parent.
+        """
+        names = self.parents.keys()
+        index_of = dict([(name, index) for index, name in enumerate(names)])
+        edges, ref_counts = [], []
+        for name in names[:]:
+            item = self.parents[name]
+            for parent_id in (item.parent1_id, item.parent2_id):
+                if parent_id is None:
+                    edges.append(-1)
+                else:
+                    if parent_id not in index_of:
+                        index_of[parent_id] = len(names)
+                        names.append(parent_id)
+                    edges.append(index_of[parent_id])
+            ref_counts.append(item.ref_count)
+        return [names, edges, ref_counts]
+
+    def from_edge_list(self, edge_list):
+        """Replace the ancestry by a saved one.
+        pre: len(edge_list) == 3
+        """
+        names, edges, ref_counts = edge_list
+        self.clear()
+        for index, ref_count in enumerate(ref_counts):
+            parent1, parent2 = edges[2*index], edges[2*index+1]
+            item = KandidHistory.Item(names[parent1] if parent1 >= 0 else None,
+                                      names[parent2] if parent2 >= 0 else None)
+            item.ref_count = ref_count
+            self.parents[names[index]] = item
 
     def contains(self, my_id):
         """Returns True if my_id can be found.
@@ -140,7 +534,7 @@ class KandidHistory(object):
         """
         pre: my_id is not None and my_id.startswith('_')
         """
-        return self.parents[my_id].surface if my_id in self.parents else None
+        return self.thumbnails.get(my_id) if my_id in self.parents else None
 
 #    def get_pixbuf(self, my_id):
 #        """
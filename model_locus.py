@@ -20,8 +20,57 @@ import random
 
 import ka_debug
 
+# Paths are shared by all genes at the same position in the genome tree.
+# Keys are (trunk, class name) tuples.
+_paths = {}
+# Trunk for each path.
+_trunks = {}
+
+def intern_path(trunk, class_name):
+    """Returns the shared path string of a gene."""
+    key = (trunk, class_name)
+    path = _paths.get(key, None)
+    if path is None:
+        if trunk == '/':
+            path = intern('/' + class_name)
+        else:
+            path = intern(trunk + '/' + class_name)
+        _paths[key] = path
+    return path
+
+# Names of the slots declared by each class and all its base classes.
+_slot_names = {}
+
+def _get_slot_names(a_class):
+    names = _slot_names.get(a_class, None)
+    if names is None:
+        names = []
+        for klass in a_class.__mro__:
+            for name in klass.__dict__.get('__slots__', []):
+                if name not in ['__dict__', '__weakref__'] \
+                   and name not in names:
+                    names.append(name)
+        _slot_names[a_class] = names
+    return names
+
+def get_members(obj):
+    """Returns all members of obj as a new dictionary.
+    Genes keep their members in slots, in their __dict__ or in both."""
+    members = dict(getattr(obj, '__dict__', {}))
+    for name in _get_slot_names(obj.__class__):
+        try:
+            members[name] = getattr(obj, name)
+        except AttributeError:
+            # slot was never set
+            pass
+    return members
+
 class Locus(object):
 
+    # Hot genes like colors and positions declare all their members
+    # as slots. Genes without slots of their own still have a __dict__.
+    __slots__ = ['path', '_pattern', '_unique_id']
+
     def _random_pattern(self):
         pattern = '_'
         for dummy in range(6):
@@ -37,23 +86,43 @@ class Locus(object):
         pre: isinstance(trunk, str)
         pre: not (trunk == '')
         """
-        self.create_unique_id()
-        if trunk == '/':
-            self.path = '/' + self.__class__.__name__
-        else: 
-            self.path = trunk + '/' + self.__class__.__name__ 
-#        print '>>', self.path, self._unique_id
+        # Unique identification is created on demand,
+        # most genes are never asked for it.
+        self.path = intern_path(trunk, self.__class__.__name__)
+#        print '>>', self.path
+
+    def __getstate__(self):
+        """Genes are pickled as a plain dictionary,
+        so releases older than 'v10' can read them."""
+        return get_members(self)
+
+    def __setstate__(self, state):
+        """Share path strings with all other genes after unpickling."""
+        for name, value in state.iteritems():
+            try:
+                setattr(self, name, value)
+            except AttributeError:
+                # member was dropped from a slotted gene in a later release
+                ka_debug.info('ignoring member %s of %s' % \
+                              (name, self.__class__.__name__))
+        if isinstance(state.get('path', None), str):
+            self.path = intern(self.path)
 
     def get_trunk(self):
+        trunk = _trunks.get(self.path, None)
+        if trunk is not None:
+            return trunk
         parts = self.path.split('/')
         if len(parts) > 2:
             trunk = ''
             for part in parts[1:-1]:
                 if len(part) > 0:
                     trunk += '/' + part
-            return trunk
+            trunk = intern(trunk)
         else:
-            return '/'
+            trunk = '/'
+        _trunks[self.path] = trunk
+        return trunk
 
     def create_unique_id(self):
         """ unique identification for this protozoon."""
@@ -64,6 +133,8 @@ class Locus(object):
 
     def get_unique_id(self):
         """ unique identification for this protozoon."""
+        if not hasattr(self, '_unique_id'):
+            self.create_unique_id()
         return self._unique_id
 
     def dot(self):
@@ -73,37 +144,38 @@ def unique_check(cpy, src1, src2):
     """Helper detecting violations against the 'deep copy' schema of 
     Locus subclasses. Only for use in design by contact statements."""
     error = ''
-#    for k, v in cpy.__dict__.items():
+    cpy_members = get_members(cpy)
+    src1_members, src2_members = get_members(src1), get_members(src2)
+#    for k, v in cpy_members.items():
 #        print 'k, id(k), v:', isinstance(v, model_locus.Locus), type(v) == types.ListType, k, id(k), v
-    for slot in cpy.__dict__:
+    for slot in cpy_members:
         serr = None
         try:
-            if isinstance(cpy.__dict__[slot], Locus):
-#                print slot, id(cpy.__dict__[slot]), id(src1.__dict__[slot]), id(src2.__dict__[slot])
+            if isinstance(cpy_members[slot], Locus):
+#                print slot, id(cpy_members[slot]), id(src1_members[slot]), id(src2_members[slot])
                 if slot not in ['constraint']:
-                    if(id(cpy.__dict__[slot]) == id(src1.__dict__[slot])):
+                    if(id(cpy_members[slot]) == id(src1_members[slot])):
                         serr = 'Copy error 1 ' + str(slot) + ': ' \
                                 + str(cpy) + ', ' + str(src1)
-                    if(id(cpy.__dict__[slot]) == id(src2.__dict__[slot])):
+                    if(id(cpy_members[slot]) == id(src2_members[slot])):
                         serr = 'Copy error 2 ' + str(slot) + ': ' \
                                 + str(cpy) + ', ' + str(src2)
-            if type(cpy.__dict__[slot]) == types.ListType:
-#                print slot, cpy.__dict__[slot]
-                for elem in cpy.__dict__[slot]:
+            if type(cpy_members[slot]) == types.ListType:
+#                print slot, cpy_members[slot]
+                for elem in cpy_members[slot]:
                     if type(elem) not in [types.IntType, types.FloatType, types.StringType, types.UnicodeType]:
-                        if ka_debug.contains_by_id(src1.__dict__[slot], elem):
+                        if ka_debug.contains_by_id(src1_members[slot], elem):
                             serr = 'Copy error 3 ' + str(slot) + ' ' + str(elem) \
                                     + ': ' + str(cpy) + ', ' + str(src1)
-                        if ka_debug.contains_by_id(src2.__dict__[slot], elem):
+                        if ka_debug.contains_by_id(src2_members[slot], elem):
                             serr = 'Copy error 4 ' + str(slot) + ' ' + str(elem) \
                                     + ': ' + str(cpy) + ', ' + str(src2)
         except KeyError:
-            error += 'KeyError ' + str(cpy.__dict__[slot]) + '\n' \
-                                 + str(src2.__dict__[slot]) + '\n' \
-                                 + str(src2.__dict__[slot]) + '\n'
+            error += 'KeyError ' + str(cpy_members[slot]) + '\n' \
+                                 + str(src1_members.get(slot, None)) + '\n' \
+                                 + str(src2_members.get(slot, None)) + '\n'
         if serr is not None:
             error += serr
     if len(error) > 0:
         print error
     return error
-
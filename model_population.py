@@ -19,12 +19,18 @@ import ka_extensionpoint
 import copy
 import pickle
 import zlib
+import os
 import sys
+import heapq
+import binascii
+import bisect
 import traceback
 import os.path
 import random
 
 import ka_debug
+import model_codec
+import model_locus
 import model_random
 import model_protozoon
 import model_history
@@ -36,6 +42,21 @@ STATE_EVOLVED = 'E'
 MAGIC_NUMBER = 'mk'
 VERSION_NUMBER = '01'
 
+# Record types of the binary genome format
+RECORD_MODEL = 'M'
+RECORD_OBJECT = 'O'
+RECORD_DELTA = 'D'
+RECORD_LINEAGE = 'H'
+
+# Number of versions remembered for building deltas.
+VERSION_HISTORY = 32
+# Write a new journal snapshot if more protozoans were replaced since the last.
+COMPACT_RATIO = 0.5
+
+def _new_version():
+    """Versions must not be drawn from the seeded random generator."""
+    return binascii.hexlify(os.urandom(8))
+
 class KandidModel(object):
     """
     inv: self.size >= 2
@@ -56,8 +77,50 @@ class KandidModel(object):
         self.protozoans = [model_protozoon.Protozoon()
                                                  for dummy in range(self.size)]
         self.fitness = [3.0 for dummy in range(self.size)]
+        self._reset_versions(_new_version())
         ka_debug.info('initializing model with population size %u' % init_size)
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # upgrade from a release older than 'v10'
+        if not self.__dict__.has_key('_versions'):
+            self._reset_versions(_new_version())
+
+    def _reset_versions(self, version):
+        """Forget all versions, the population is known as version."""
+        self._sequence = 0
+        self._changed_at = [0] * self.size
+        self._versions = [(version, 0)]
+
+    def get_version(self):
+        """Identifies the protozoans of this population.
+        Fitness is not part of the version."""
+        return self._versions[-1][0]
+
+    version = property(get_version)
+
+    def touch(self, indices, version=None):
+        """Start a new version of the population.
+        indices: protozoans replaced or changed since the last version.
+        """
+        self._sequence += 1
+        for index in indices:
+            self._changed_at[index] = self._sequence
+        self._versions.append((version if version else _new_version(),
+                               self._sequence))
+        del self._versions[:-VERSION_HISTORY]
+
+    def changed_since(self, version):
+        """Returns the indices of all protozoans changed since version.
+        Returns None if version is unknown or already forgotten.
+        """
+        for known, sequence in self._versions:
+            if known == version:
+                return [index for index, changed_at
+                                             in enumerate(self._changed_at)
+                                             if changed_at > sequence]
+        return None
+
     def dot(self):
         result = ""
         anchor = ka_debug.dot_id(self) + ' -> '
@@ -89,41 +152,54 @@ class KandidModel(object):
         """Preserve an already evolved population from over writing."""
         return not self._state == STATE_EVOLVED
 
-    def classify(self):
-        """Using fitness to build three distinct sets (good, moderate, poor). 
+    def classify_indices(self):
+        """Using fitness to build three distinct sets of indices
+        (good, moderate, poor). 
         # Return parameter 0: __return__[0] -> good
         # Return parameter 1: __return__[1] -> moderate
         # Return parameter 2: __return__[2] -> poor
         post: len(__return__[0])+len(__return__[1])+len(__return__[2]) == self.size
         post: len(__return__[0]) >= 1
-        
-        # mutual exclusive
-        post: forall(__return__[0], lambda x: not contains_reference(x, __return__[1]))
-        post: forall(__return__[0], lambda x: not contains_reference(x, __return__[2]))
-        post: forall(__return__[2], lambda x: not contains_reference(x, __return__[0]))
-        post: forall(__return__[2], lambda x: not contains_reference(x, __return__[1]))
         """
         good, moderate, poor = [], [], []
-        # a new sorted list: 
-        sorted_fitness = sorted(self.fitness)
-        poor_level = sorted_fitness[self.fade_away-1]
+        poor_level = heapq.nsmallest(self.fade_away, self.fitness)[-1]
         poor_level = 4 if poor_level > 4 else poor_level
-        good_level = sorted_fitness[-1]
-        for protoz, fit in zip(self.protozoans, self.fitness):
+        good_level = max(self.fitness)
+        for index, fit in enumerate(self.fitness):
             if fit >= good_level and len(good) < 1:
-                good.append(protoz)
+                good.append(index)
             elif fit <= 0:
-                poor.append(protoz)
+                poor.append(index)
             elif fit <= poor_level:
                 if len(poor) >= self.fade_away:
-                    index = random.randint(0, len(poor)-1)
-                    moderate.append(poor[index])
-                    del poor[index]
-                poor.append(protoz)
+                    # order of the poor list does not matter,
+                    # move the last entry into the gap
+                    at = random.randint(0, len(poor)-1)
+                    moderate.append(poor[at])
+                    poor[at] = poor[-1]
+                    poor.pop()
+                poor.append(index)
             else:
-                moderate.append(protoz)
+                moderate.append(index)
         return good, moderate, poor
 
+    def classify(self):
+        """Using fitness to build three distinct sets (good, moderate, poor). 
+        # Return parameter 0: __return__[0] -> good
+        # Return parameter 1: __return__[1] -> moderate
+        # Return parameter 2: __return__[2] -> poor
+        post: len(__return__[0])+len(__return__[1])+len(__return__[2]) == self.size
+        post: len(__return__[0]) >= 1
+        
+        # mutual exclusive
+        post: forall(__return__[0], lambda x: not contains_reference(x, __return__[1]))
+        post: forall(__return__[0], lambda x: not contains_reference(x, __return__[2]))
+        post: forall(__return__[2], lambda x: not contains_reference(x, __return__[0]))
+        post: forall(__return__[2], lambda x: not contains_reference(x, __return__[1]))
+        """
+        return [[self.protozoans[index] for index in indices]
+                for indices in self.classify_indices()]
+
     def reduce_fitness(self, index):
         """Set fitness of a protozoon to the lowest value.
         pre: 0 <= index < len(self.fitness)
@@ -146,6 +222,7 @@ class KandidModel(object):
         self._state = STATE_RANDOMIZED
         for protoz in self.protozoans:
             protoz.randomize()
+        self.touch(range(self.size))
 
     def random(self):
         """Randomize protozoans with poor fitness.
@@ -154,13 +231,13 @@ class KandidModel(object):
         """
         new_indices = []
         self._state = STATE_EVOLVED
-        dummy, dummy, poor = self.classify()
-        for new_at, protoz in enumerate(self.protozoans):
-            if protoz in poor:
-                self.protozoans[new_at].create_unique_id()
-                self.protozoans[new_at].randomize()
-                self.fitness[new_at] = 3.0
-                new_indices.append(new_at)
+        dummy, dummy, poor = self.classify_indices()
+        for new_at in sorted(poor):
+            self.protozoans[new_at].create_unique_id()
+            self.protozoans[new_at].randomize()
+            self.fitness[new_at] = 3.0
+            new_indices.append(new_at)
+        self.touch(new_indices)
         return new_indices
 
     def breed_single(self, new_at):
@@ -170,8 +247,9 @@ class KandidModel(object):
         """
         new_indices = [new_at]
         self._state = STATE_EVOLVED
-        good, moderate, dummy = self.classify()
-        self._breed(new_at, good, moderate)
+        good, moderate, dummy = self.classify_indices()
+        self._breed(new_at, good[0], moderate)
+        self.touch(new_indices)
         return new_indices
 
     def breed_generation(self):
@@ -181,48 +259,48 @@ class KandidModel(object):
         """
         new_indices = []
         self._state = STATE_EVOLVED
-        good, moderate, poor = self.classify()
-        for new_at, protoz in enumerate(self.protozoans):
-            if protoz in poor:
-                self._breed(new_at, good, moderate)
-                new_indices.append(new_at)
+        good, moderate, poor = self.classify_indices()
+        for new_at in sorted(poor):
+            self._breed(new_at, good[0], moderate)
+            new_indices.append(new_at)
+        self.touch(new_indices)
         return new_indices
 
-    def _breed(self, new_at, good, moderate):
-        partner = self.find_partner(moderate)
-        new_one = good[0].crossingover(partner)
+    def _breed(self, new_at, good_at, moderate):
+        """Replace protozoon at new_at by an offspring of the best protozoon
+        and a partner chosen from the moderate indices."""
+        good = self.protozoans[good_at]
+        partner = self.protozoans[self.find_partner(moderate)]
+        new_one = good.crossingover(partner)
         new_one.swap_places()
         new_one.mutate()
         history = model_history.KandidHistory.instance()
         history.unlink(self.protozoans[new_at].get_unique_id())
 #        ka_debug.info('new offspring ' + new_one.get_unique_id()
-#                      + ' breeded by ' + good[0].get_unique_id() + ' and '
+#                      + ' breeded by ' + good.get_unique_id() + ' and '
 #                      + partner.get_unique_id() + ' replaced '
 #                      + self.protozoans[new_at].get_unique_id())
         self.protozoans[new_at] = new_one
         self.fitness[new_at] = 4.0
         history.rember_parents(new_one.get_unique_id(),
-                               good[0].get_unique_id(),
+                               good.get_unique_id(),
                                partner.get_unique_id())
 
     def find_partner(self, candidates):
-        """Find a partner from the candidate list by chance.
+        """Find a partner from the candidate indices by chance.
+        The chance of each candidate is weighted by its fitness.
+        Returns the index of the partner.
         pre: len(candidates) > 0
-        pre: forall(candidates, lambda candidate: candidate in self.protozoans)
-        post: __return__ is not None
+        pre: forall(candidates, lambda candidate: 0 <= candidate < self.size)
         post: __return__ in candidates
         """
-        total = 0.0
-        for index, protoz in enumerate(self.protozoans):
-            if protoz in candidates:
-                total += self.fitness[index]
+        cumulated, total = [], 0.0
+        for index in candidates:
+            total += self.fitness[index]
+            cumulated.append(total)
         trigger = random.uniform(0.0, total)
-        total = 0.0
-        for index, protoz in enumerate(self.protozoans):
-            if protoz in candidates:
-                total += self.fitness[index]
-                if trigger < total:
-                    return protoz
+        position = bisect.bisect_right(cumulated, trigger)
+        return candidates[min(position, len(candidates)-1)]
 
     def replace(self, new_one):
         """Replace protozoon with lowest fitness.
@@ -238,21 +316,215 @@ class KandidModel(object):
                 #TODO history, forget former protozoans[new_at]
                 self.protozoans[new_at] = new_one
                 self.fitness[new_at] = 5.0
+                self.touch([new_at])
                 return new_at
         return -1
 
 def _get_my_revision():
-    revision = ka_extensionpoint.revision_number
+    revision = ka_extensionpoint.get_revision_number()
     return str(revision) if revision > 9  else '0' + str(revision)
         
+def _write_model(writer, model):
+    writer.write_value(RECORD_MODEL)
+    writer.write_value([model.size, model.fade_away, model._state,
+                        model.fitness, model.version])
+    writer.write_value(len(model.protozoans))
+    for protoz in model.protozoans:
+        writer.write_value(protoz)
+
+def _write_delta(writer, model, since_version, indices):
+    """Encode protozoans replaced since an older version of the model.
+    The fitness of all protozoans is always included."""
+    writer.write_value(RECORD_DELTA)
+    writer.write_value([since_version, model.version, model._state,
+                        model.fitness])
+    writer.write_value(len(indices))
+    for index in indices:
+        writer.write_value(index)
+        writer.write_value(model.protozoans[index])
+
+def _write_records(writer, obj):
+    """Encode a model protozoon by protozoon, anything else as one record."""
+    if isinstance(obj, KandidModel):
+        _write_model(writer, obj)
+    else:
+        writer.write_value(RECORD_OBJECT)
+        writer.write_value(obj)
+    writer.close()
+
+def _read_delta(reader, migrate):
+    """Read a delta record.
+    Returns a tuple (since version, version, fitness, changes),
+    changes is a list of (index, protozoon) tuples.
+    """
+    since_version, version, dummy, fitness = reader.read_value()
+    changes = []
+    for dummy in xrange(reader.read_value()):
+        index = reader.read_value()
+        changes.append((index, reader.read_value(migrate)))
+    return since_version, version, fitness, changes
+
+def _read_raw_model(reader):
+    """Read the records of a model without decoding the protozoans.
+    A journal entry holds a snapshot followed by the latest changes,
+    these changes are applied to the snapshot.
+    The ancestry may follow at the end.
+    Returns the model header, a list of encoded protozoans and the ancestry
+    or None.
+    """
+    size, fade_away, state, fitness, version = reader.read_value()
+    raws = [reader.read_raw() for dummy in xrange(reader.read_value())]
+    lineage = None
+    while not reader.at_end():
+        record_type = reader.read_value()
+        if record_type == RECORD_LINEAGE:
+            edge_list = reader.read_value()
+            thumbnails = [reader.read_value()
+                          for dummy in xrange(reader.read_value())]
+            lineage = (edge_list, thumbnails)
+            continue
+        if record_type != RECORD_DELTA:
+            raise ValueError('unexpected record after snapshot')
+        since_version, next_version, state, fitness = reader.read_value()
+        if since_version != version:
+            raise ValueError('delta does not fit to the snapshot')
+        version = next_version
+        for dummy in xrange(reader.read_value()):
+            index = reader.read_value()
+            raws[index] = reader.read_raw()
+    return [size, fade_away, state, fitness, version], raws, lineage
+
+def _write_lineage(writer):
+    """Save ancestry and the images of the ancestors."""
+    history = model_history.KandidHistory.instance()
+    writer.write_value(RECORD_LINEAGE)
+    writer.write_value(history.to_edge_list())
+    thumbnails = history.thumbnails.export()
+    writer.write_value(len(thumbnails))
+    for thumbnail in thumbnails:
+        writer.write_value(list(thumbnail))
+
+def _restore_lineage(lineage):
+    """Images are decompressed when the ancestors are shown."""
+    edge_list, thumbnails = lineage
+    history = model_history.KandidHistory.instance()
+    history.from_edge_list(edge_list)
+    for my_id, width, height, stride, data in thumbnails:
+        if history.contains(my_id):
+            history.thumbnails.put_compressed(my_id, width, height, stride,
+                                              data)
+
+def _read_records(reader, restore_lineage=False):
+    migrate = reader.revision != _get_my_revision()
+    record_type = reader.read_value()
+    if record_type == RECORD_OBJECT:
+        return reader.read_value(migrate)
+    elif record_type != RECORD_MODEL:
+        raise ValueError('unknown record type %r' % record_type)
+    header, raws, lineage = _read_raw_model(reader)
+    if restore_lineage and lineage is not None:
+        _restore_lineage(lineage)
+    model = KandidModel.__new__(KandidModel)
+    model.size, model.fade_away, model._state, model.fitness, version = header
+    model._reset_versions(version)
+    model.protozoans = [model_codec.decode_value(raw, migrate)
+                        for raw in raws]
+    return model
+
+def to_delta_buffer(model, since_version):
+    """Encode the protozoans replaced since an older version of model.
+    Returns None if the changes since this version are no longer known.
+    pre: isinstance(model, KandidModel)
+    """
+    indices = model.changed_since(since_version)
+    if indices is None:
+        return None
+    parts = []
+    writer = model_codec.Writer(parts.append, _get_my_revision())
+    _write_delta(writer, model, since_version, indices)
+    writer.close()
+    return ''.join(parts)
+
+def read_delta(input_buffer):
+    """Decode changes received as a delta buffer.
+    Decoding is expensive, it should not be done in the GUI thread.
+    Returns the changes to be passed to apply_delta() or None.
+    """
+    try:
+        reader = model_codec.Reader(model_codec.string_reader(input_buffer))
+        if reader.read_value() == RECORD_DELTA:
+            return _read_delta(reader, reader.revision != _get_my_revision())
+        ka_debug.err('missing delta record')
+    except:
+        ka_debug.err('failed reading delta [%s] [%s]' % \
+                   (sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+    return None
+
+def apply_delta(model, delta):
+    """Apply changes decoded by read_delta() to model.
+    Only the replaced protozoans take over the fitness of the sender,
+    all other protozoans keep their local fitness.
+    Returns the indices of the replaced protozoans or None if the delta
+    does not fit to the version of the model or the model is already
+    evolved.
+    pre: isinstance(model, KandidModel)
+    pre: delta is not None
+    """
+    since_version, version, fitness, changes = delta
+    if not model.is_overwrite_allowed():
+        return None
+    if model.version != since_version or len(fitness) != model.size:
+        return None
+    for index, dummy in changes:
+        if not 0 <= index < model.size:
+            ka_debug.err('delta index %s out of range' % index)
+            return None
+    for index, protoz in changes:
+        model.protozoans[index] = protoz
+        model.fitness[index] = fitness[index]
+    indices = [index for index, dummy in changes]
+    model.touch(indices, version)
+    return indices
+
+def _read_legacy(input_buffer):
+    """Read buffers written by releases using pickle."""
+    obj = pickle.loads(zlib.decompress(input_buffer[4:]))
+    if not input_buffer.startswith(MAGIC_NUMBER+_get_my_revision()):
+        obj = obj.copy()
+    return obj
+
+def iter_protozoa(input_buffer):
+    """Decode protozoa of a buffer lazily, one after the other.
+    A buffer holding a single protozoon yields just this protozoon.
+    """
+    if model_codec.is_encoded(input_buffer):
+        reader = model_codec.Reader(model_codec.string_reader(input_buffer))
+        migrate = reader.revision != _get_my_revision()
+        record_type = reader.read_value()
+        if record_type == RECORD_OBJECT:
+            yield reader.read_value(migrate)
+        elif record_type == RECORD_MODEL:
+            dummy, raws, dummy = _read_raw_model(reader)
+            for raw in raws:
+                yield model_codec.decode_value(raw, migrate)
+    else:
+        obj = from_buffer(input_buffer)
+        if isinstance(obj, KandidModel):
+            for protoz in obj.protozoans:
+                yield protoz
+        elif obj is not None:
+            yield obj
+
 def from_buffer(input_buffer):
 #    ka_debug.info('read from_buffer')
     obj = None
     try:
-        if input_buffer.startswith(MAGIC_NUMBER):
-            obj = pickle.loads(zlib.decompress(input_buffer[4:]))
-            if not input_buffer.startswith(MAGIC_NUMBER+_get_my_revision()):
-                obj = obj.copy()
+        if model_codec.is_encoded(input_buffer):
+            obj = _read_records(model_codec.Reader(
+                                     model_codec.string_reader(input_buffer)))
+        elif input_buffer.startswith(MAGIC_NUMBER):
+            obj = _read_legacy(input_buffer)
         else:
             ka_debug.err('missing magic number')
     except:
@@ -264,21 +536,55 @@ def from_buffer(input_buffer):
 def to_buffer(obj):
 #    ka_debug.info('write %s to_buffer' % type(obj))
     try:
-        return MAGIC_NUMBER + _get_my_revision() \
-               + zlib.compress(pickle.dumps(copy.deepcopy(obj), protocol=2))
+        parts = []
+        _write_records(model_codec.Writer(parts.append, _get_my_revision()),
+                       obj)
+        return ''.join(parts)
     except:
         ka_debug.err('failed writing buffer [%s] [%s]' % \
                    (sys.exc_info()[0], sys.exc_info()[1]))
         traceback.print_exc(file=sys.__stderr__)
             
+def to_legacy_buffer(obj):
+    """Encode obj the way releases older than 'v10' expect it.
+    These releases can only read pickled buffers. Used when sending
+    to peers not known to understand the current format.
+    """
+    try:
+        if isinstance(obj, KandidModel):
+            # the journal snapshot can not be pickled
+            model = KandidModel.__new__(KandidModel)
+            model.__dict__.update([(name, value)
+                                   for name, value in obj.__dict__.iteritems()
+                                   if name != '_snapshot'])
+            obj = model
+        memo = {}
+        obj = copy.deepcopy(obj, memo)
+        # older releases expect every gene to carry its unique id
+        for value in memo.values():
+            if isinstance(value, model_locus.Locus):
+                value.get_unique_id()
+        return MAGIC_NUMBER + _get_my_revision() \
+               + zlib.compress(pickle.dumps(obj, protocol=2))
+    except:
+        ka_debug.err('failed writing legacy buffer [%s] [%s]' % \
+                   (sys.exc_info()[0], sys.exc_info()[1]))
+        traceback.print_exc(file=sys.__stderr__)
+
 def read_file(file_path):
     model = None
     if os.path.isfile(file_path):
         in_file = None
         try:
             ka_debug.info('input file [%s]' % file_path)
-            in_file = open(file_path, 'r')
-            model = from_buffer(in_file.read())
+            in_file = open(file_path, 'rb')
+            header = in_file.read(model_codec.HEADER_SIZE)
+            in_file.seek(0)
+            if model_codec.is_encoded(header):
+                model = _read_records(model_codec.Reader(in_file.read),
+                                      restore_lineage=True)
+            else:
+                model = from_buffer(in_file.read())
             model._state = STATE_INIT
         except:
             ka_debug.err('failed reading [%s] [%s] [%s]' % \
@@ -289,14 +595,39 @@ def read_file(file_path):
                 in_file.close()
     return model
 
+def _get_snapshot(model):
+    """Returns the latest journal snapshot of model as a tuple
+    (version, encoded buffer, writer to continue the buffer).
+    A new snapshot is encoded if too many protozoans were replaced since.
+    """
+    snapshot = model.__dict__.get('_snapshot', None)
+    if snapshot is not None:
+        indices = model.changed_since(snapshot[0])
+        if indices is not None and len(indices) <= COMPACT_RATIO * model.size:
+            return snapshot
+    parts = []
+    writer = model_codec.Writer(parts.append, _get_my_revision())
+    _write_model(writer, model)
+    writer.sync()
+    model._snapshot = (model.version, ''.join(parts), writer)
+    return model._snapshot
+
 def write_file(file_path, model):
-    """Write model to the file system.
+    """Write model and ancestry to the file system.
+    Only the protozoans replaced since the last snapshot are encoded.
     pre: file_path is not None
+    pre: isinstance(model, KandidModel)
     """
     out_file = None
     try:
-        out_file = open(file_path, 'w')
-        out_file.write(to_buffer(model))
+        out_file = open(file_path, 'wb')
+        snapshot = _get_snapshot(model)
+        out_file.write(snapshot[1])
+        writer = snapshot[2].fork(out_file.write)
+        _write_delta(writer, model, snapshot[0],
+                     model.changed_since(snapshot[0]))
+        _write_lineage(writer)
+        writer.close()
     except:
         ka_debug.err('failed writing [%s] [%s] [%s]' % \
                    (file_path, sys.exc_info()[0], sys.exc_info()[1]))
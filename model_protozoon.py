@@ -35,6 +35,8 @@ class Protozoon(model_allele.Allele):
 
     def __init__(self):
         super(Protozoon, self).__init__(TRUNK)
+        # protozoans are identified in history and exported images
+        self.create_unique_id()
         self.treenode = model_treenode.TreeNode(TRUNK)
         self.background = exon_color.Color(self.path, 0, 0, 0, 1)
 
@@ -70,17 +72,16 @@ class Protozoon(model_allele.Allele):
         self.treenode.swap_places()
 
     def crossingover(self, other):
-        """Returns a deep copy mixed from my protozoon and the other protozoon.
+        """Returns a new protozoon mixed from my protozoon and the other protozoon.
         pre: isinstance(other, Protozoon)
         # check for distinct references, needs to copy content, not references
         post: __return__ is not self
         post: __return__ is not other
         post: model_locus.unique_check(__return__, self, other) == ''
         """
-        # deep copy
         new_one = Protozoon()
-        # crossing over the layers
-        new_one.treenode = self.treenode.crossingover(other.treenode).copy()
+        # crossing over the layers, unmodified subtrees are shared
+        new_one.treenode = self.treenode.crossingover(other.treenode)
         # crossing over the background color
         new_one.background = self.background.crossingover(other.background)
         return new_one
@@ -0,0 +1,123 @@
+# coding: UTF-8
+# Copyright 2009, 2010 Thomas Jourdan
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import copy
+import array
+import itertools
+
+import ka_cache
+import model_allele
+import model_locus
+
+# Memory budget for all cached point buffers in bytes.
+POINT_BUDGET = 4 * 1024 * 1024
+
+def _buffer_size(point_buffer):
+    """Approximate memory used by a point buffer in bytes."""
+    return 2 * 8 * len(point_buffer) + 64
+
+_point_cache = ka_cache.LruCache(POINT_BUDGET, _buffer_size)
+
+def clear_point_cache():
+    """Forget all shared point buffers."""
+    _point_cache.clear()
+
+class PointBuffer(object):
+    """Immutable sequence of (x, y) sample points.
+    Coordinates are stored in two arrays of doubles.
+    """
+    __slots__ = ['_x_values', '_y_values']
+
+    def __init__(self, points):
+        self._x_values = array.array('d', [point[0] for point in points])
+        self._y_values = array.array('d', [point[1] for point in points])
+
+    def __len__(self):
+        return len(self._x_values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return zip(self._x_values[index], self._y_values[index])
+        return self._x_values[index], self._y_values[index]
+
+    def __iter__(self):
+        return itertools.izip(self._x_values, self._y_values)
+
+    def __setitem__(self, index, value):
+        raise TypeError("Sample points are immutable.")
+
+    def x_values(self):
+        """All x coordinates. Must not be modified."""
+        return self._x_values
+
+    def y_values(self):
+        """All y coordinates. Must not be modified."""
+        return self._y_values
+
+    def to_list(self):
+        """A modifiable copy as list of tuples."""
+        return zip(self._x_values, self._y_values)
+
+class Sampler(model_allele.Allele):
+    """Sampler is the base class of all samplers.
+    Sample points are calculated once for each state of the genes.
+    Subclasses implement _calculate_points() and must call
+    _invalidate_points() whenever a gene is modified.
+    """
+
+    transient_members = ['_point_buffer']
+
+    def __init__(self, trunk):
+        """Sampler constructor"""
+        super(Sampler, self).__init__(trunk)
+        self._point_buffer = None
+
+    def __deepcopy__(self, memo):
+        """Don't store transient members."""
+        new_one = self.__class__(self.get_trunk())
+        memo[id(self)] = new_one
+        for name, value in model_locus.get_members(self).iteritems():
+            if name not in self.transient_members:
+                setattr(new_one, name, copy.deepcopy(value, memo))
+        return new_one
+
+    def _calculate_points(self):
+        """Sampler is an abstract class.
+        Call _calculate_points() on sub classes only.
+        """
+        raise TypeError("Sampler is an abstract class. " \
+                        "Call _calculate_points() on sub classes only.")
+
+    def _invalidate_points(self):
+        """Forget sample points after modifying the genes."""
+        self._point_buffer = None
+
+    def get_sample_points(self):
+        """Produces an immutable sequence of sampling points.
+        Samplers with equal genes share the same point buffer.
+        post: isinstance(__return__, PointBuffer)
+        """
+        # instances unpickled from an older release have no point buffer
+        point_buffer = self.__dict__.get('_point_buffer', None)
+        if point_buffer is None:
+            key = self.digest()
+            point_buffer = _point_cache.get(key)
+            if point_buffer is None:
+                point_buffer = PointBuffer(self._calculate_points())
+                _point_cache.put(key, point_buffer)
+            self._point_buffer = point_buffer
+        return point_buffer
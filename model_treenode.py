@@ -19,10 +19,14 @@ from gettext import gettext as _
 
 import sys
 import traceback
+import threading
+import hashlib
 import cairo
 import random
 
 import ka_debug
+import ka_cache
+import ka_profile
 import ka_factory
 import model_random
 import model_constraintpool
@@ -35,6 +39,35 @@ NUMBER_OF_LAYERS_CONSTRAINT = 'layernumberofconstraint'
 MERGERTYPE_CONSTRAINT = 'mergertypeconstraint'
 MODIFIERTYPE_CONSTRAINT = 'modifiertypeconstraint'
 
+# Components a tree node may share with other tree nodes.
+SHARABLE_MEMBERS = ['left_treenode', 'right_treenode',
+                    'left_background', 'right_background',
+                    'layer', 'merger', 'modifier']
+
+# Digests of subtrees known inside the current rendering of this thread.
+_render_pass = threading.local()
+
+def _subtree_digest(treenode):
+    """Digest of a subtree, built from the digests of its child nodes.
+    While rendering each tree node is hashed only once.
+    """
+    digests = getattr(_render_pass, 'digests', None)
+    if digests is None:
+        digests = {}
+    digest = digests.get(id(treenode), None)
+    if digest is None:
+        md5 = hashlib.md5()
+        md5.update('<' + treenode.__class__.__name__)
+        model_allele.feed_members(md5, treenode,
+                                  ['left_treenode', 'right_treenode'])
+        for child in [treenode.left_treenode, treenode.right_treenode]:
+            md5.update(';' + (_subtree_digest(child) if child is not None
+                                                     else 'N'))
+        md5.update('>')
+        digest = md5.hexdigest()
+        digests[id(treenode)] = digest
+    return digest
+
 class TreeNode(model_allele.Allele):
     """
     inv: (self.left_treenode is None) or isinstance(self.left_treenode, TreeNode)
@@ -47,7 +80,7 @@ class TreeNode(model_allele.Allele):
     cdef = [{'bind'  : LAYERTYPE_CONSTRAINT,
              'name'  : 'Permitted layer types',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('layer').keys()
+             'enum'  : lambda: ka_factory.get_factory('layer').keys()
             },
             {'bind'  : NUMBER_OF_LAYERS_CONSTRAINT,
              'name'  : 'Number of layers',
@@ -57,17 +90,21 @@ class TreeNode(model_allele.Allele):
             {'bind'  : MERGERTYPE_CONSTRAINT,
              'name'  : 'Permitted merging strategies for layers',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('merger').keys()
+             'enum'  : lambda: ka_factory.get_factory('merger').keys()
             },
             {'bind'  : MODIFIERTYPE_CONSTRAINT,
              'name'  : 'Permitted merging strategies for layers',
              'domain': model_constraintpool.STRING_M_OF_N,
-             'enum'  : ka_factory.get_factory('modifier').keys()
+             'enum'  : lambda: ka_factory.get_factory('modifier').keys()
             },
            ]
+
+    # Names of components shared with other tree nodes.
+    transient_members = ['_shared']
     
     def __init__(self, trunk):
         super(TreeNode, self).__init__(trunk)
+        self._shared = []
         self.left_treenode = None
         self.right_treenode = None
         self.left_background = exon_color.Color(self.path, 0, 0, 0, 1)
@@ -79,6 +116,47 @@ class TreeNode(model_allele.Allele):
         modifier_factory = ka_factory.get_factory('modifier')
         self.modifier = modifier_factory.create(modifier_factory.keys()[0], self.path)
 
+    @staticmethod
+    def _blank(path, shared):
+        """Tree node without default components.
+        Caller must set all components.
+        """
+        new_one = TreeNode.__new__(TreeNode)
+        new_one.path = path
+        new_one._shared = shared
+        return new_one
+
+    def _share(self):
+        """Cheap copy sharing all components with this tree node."""
+        new_one = TreeNode._blank(self.path, SHARABLE_MEMBERS[:])
+        for name in SHARABLE_MEMBERS:
+            setattr(new_one, name, getattr(self, name))
+        return new_one
+
+    def _own(self, name):
+        """Returns a component which is not shared with other tree nodes.
+        Shared components are replaced before they are modified. Child tree
+        nodes are shared one level deeper, all other components are copied.
+        pre: name in SHARABLE_MEMBERS
+        """
+        # tree nodes from an older release share nothing
+        if name in self.__dict__.get('_shared', []):
+            self._shared.remove(name)
+            member = getattr(self, name)
+            if isinstance(member, TreeNode):
+                setattr(self, name, member._share())
+            elif member is not None:
+                setattr(self, name, member.copy())
+        return getattr(self, name)
+
+    def _set_own(self, name, member):
+        """Replace a component by a new one.
+        pre: name in SHARABLE_MEMBERS
+        """
+        if name in self.__dict__.get('_shared', []):
+            self._shared.remove(name)
+        setattr(self, name, member)
+
     def dot(self):
         result = ""
         anchor = ka_debug.dot_id(self) + ' -> '
@@ -133,28 +211,28 @@ class TreeNode(model_allele.Allele):
         """
         cpool = model_constraintpool.ConstraintPool.get_pool()
 
-        self.left_background.randomize()
-        self.right_background.randomize()
+        self._own('left_background').randomize()
+        self._own('right_background').randomize()
         
         # create layer
         layer_factory = ka_factory.get_factory('layer')
         layertype_constraint = cpool.get(self, LAYERTYPE_CONSTRAINT)
-        self.layer = layer_factory.create_random(layertype_constraint,
-                                                       self.path)
+        self._set_own('layer', layer_factory.create_random(layertype_constraint,
+                                                           self.path))
         self.layer.randomize()
 
         # create strategy for merging 'left' and 'right' layer
         merger_factory = ka_factory.get_factory('merger')
         mergertype_constraint = cpool.get(self, MERGERTYPE_CONSTRAINT)
-        self.merger = merger_factory.create_random(mergertype_constraint,
-                                                       self.path)
+        self._set_own('merger', merger_factory.create_random(mergertype_constraint,
+                                                             self.path))
         self.merger.randomize()
 
         # create strategy for modifying stacked layers
         modifier_factory = ka_factory.get_factory('modifier')
         modifiertype_constraint = cpool.get(self, MODIFIERTYPE_CONSTRAINT)
-        self.modifier = modifier_factory.create_random(modifiertype_constraint,
-                                                       self.path)
+        self._set_own('modifier', modifier_factory.create_random(
+                                          modifiertype_constraint, self.path))
         self.modifier.randomize()
 
         number_of_constraint = cpool.get(self, NUMBER_OF_LAYERS_CONSTRAINT)
@@ -162,49 +240,54 @@ class TreeNode(model_allele.Allele):
         if (depth <= number_of_constraint[0] or \
            (depth > number_of_constraint[0] and random.choice([False, True]))) \
            and  depth <= number_of_constraint[1]:
-            self.left_treenode = TreeNode(self.path)
+            self._set_own('left_treenode', TreeNode(self.path))
             self.left_treenode.path += 'Left'
             self.left_treenode.randomize()
         if (depth <= number_of_constraint[0] or \
            (depth > number_of_constraint[0] and random.choice([False, True]))) \
            and  depth <= number_of_constraint[1]:
-            self.right_treenode = TreeNode(self.path)
+            self._set_own('right_treenode', TreeNode(self.path))
             self.right_treenode.path += 'Right'
             self.right_treenode.randomize()
 
 
     def mutate(self):
         """Make random changes to the tree node.
+        Shared components are replaced before they are modified.
         """
         cpool = model_constraintpool.ConstraintPool.get_pool()
 
         # delegate mutating to the nodes child components
         if self.left_treenode is not None:
-            self.left_treenode.mutate()
+            self._own('left_treenode').mutate()
         if self.right_treenode is not None:
-            self.right_treenode.mutate()
+            self._own('right_treenode').mutate()
         # mutating my details
-        self.left_background.mutate()
-        self.right_background.mutate()
+        self._own('left_background').mutate()
+        self._own('right_background').mutate()
         if model_random.is_mutating():
-            self.layer.mutate()
+            self._own('layer').mutate()
         if model_random.is_mutating():
             if model_random.is_mutating():
                 merger_factory = ka_factory.get_factory('merger')
                 mergertype_constraint = cpool.get(self, MERGERTYPE_CONSTRAINT)
-                self.merger = merger_factory.create_random(mergertype_constraint,
-                                                               self.path)
-            self.merger.randomize()
+                self._set_own('merger', merger_factory.create_random(
+                                            mergertype_constraint, self.path))
+            self._own('merger').randomize()
         if model_random.is_mutating():
             if model_random.is_mutating():
                 modifier_factory = ka_factory.get_factory('modifier')
                 modifiertype_constraint = cpool.get(self, MODIFIERTYPE_CONSTRAINT)
-                self.modifier = modifier_factory.create_random(modifiertype_constraint,
-                                                               self.path)
-            self.modifier.randomize()
+                self._set_own('modifier', modifier_factory.create_random(
+                                          modifiertype_constraint, self.path))
+            self._own('modifier').randomize()
 
     def swap_places(self):
-        """Swap 'left' and 'right' tree node delegate swapping to the nodes components."""
+        """Swap 'left' and 'right' tree node delegate swapping to the nodes components.
+        Shared components are replaced before they are modified.
+        """
+        for name in SHARABLE_MEMBERS:
+            self._own(name)
         # shuffle tree node
         self.left_treenode, self.right_treenode = \
                           model_random.swap_parameters(self.left_treenode,
@@ -222,38 +305,36 @@ class TreeNode(model_allele.Allele):
         self.modifier.swap_places()
 
     def crossingover(self, other):
-        """Returns a deep copy mixed from my tree node and the other tree node.
+        """Returns a tree node mixed from my tree node and the other tree node.
+        Child tree nodes, layer, merger and modifier are shared with the
+        parents. They are replaced by copies as soon as they are modified.
         pre: isinstance(other, TreeNode)
-        # check for distinct references, needs to copy content, not references
         post: __return__ is not self
         post: __return__ is not other
-        post: model_locus.unique_check(__return__, self, other) == ''
         post: __return__.layer is not None
         """
-        # deep copy
-        new_one = TreeNode(self.get_trunk())
+        new_one = TreeNode._blank(model_locus.intern_path(self.get_trunk(),
+                                                          'TreeNode'),
+                                  ['left_treenode', 'right_treenode',
+                                   'layer', 'merger', 'modifier'])
         # crossing over the layers
         new_one.left_treenode = other.left_treenode \
                                     if model_random.is_crossing() \
                                     else self.left_treenode
-        if new_one.left_treenode is not None:
-            new_one.left_treenode = new_one.left_treenode.copy()
         new_one.right_treenode = other.right_treenode \
                                     if model_random.is_crossing() \
                                     else self.right_treenode
-        if new_one.right_treenode is not None:
-            new_one.right_treenode = new_one.right_treenode.copy()
         new_one.left_background = self.left_background.crossingover(other.left_background)
         new_one.right_background = self.right_background.crossingover(other.right_background)
-        new_one.layer = other.layer.copy() \
+        new_one.layer = other.layer \
                                     if model_random.is_crossing() \
-                                    else self.layer.copy()
-        new_one.merger = other.merger.copy() \
+                                    else self.layer
+        new_one.merger = other.merger \
                                     if model_random.is_crossing() \
-                                    else self.merger.copy()
-        new_one.modifier = other.modifier.copy() \
+                                    else self.merger
+        new_one.modifier = other.modifier \
                                     if model_random.is_crossing() \
-                                    else self.modifier.copy()
+                                    else self.modifier
         return new_one
 
     def render(self, task, ctx, width, height):
@@ -263,49 +344,94 @@ class TreeNode(model_allele.Allele):
         pre: height > 0
         pre: width == height
         """
+        outermost = getattr(_render_pass, 'digests', None) is None
+        if outermost:
+            _render_pass.digests = {}
+        try:
+            self._render(task, ctx, width, height)
+        finally:
+            if outermost:
+                _render_pass.digests = None
+
+    def _render(self, task, ctx, width, height):
         if task.quit:
 #            ka_debug.info('quitting task: [%s], %s' % \
 #                   (task.work_for, self.path))
             return
 #!!        time.sleep(0.001)
+        profile_node = ka_profile.begin(self.path)
         try:
             ctx.save()
 #            ka_debug.matrix_s(ctx.get_matrix())
             if (self.left_treenode is None) and (self.right_treenode is None):
                 # I am a leaf, use my own layer painting strategy
+                layer_node = ka_profile.begin(self.layer.__class__.__name__)
                 self.layer.render(task, ctx, width, height)
+                ka_profile.end(layer_node)
             elif (self.left_treenode is not None) and (self.right_treenode is not None):
                 # merge 'left' and 'right' tree node
-                left_surface, left_ctx = self._prepare_surface(ctx, width, height, \
-                                                               self.left_background)
-                self.left_treenode.render(task, left_ctx, width, height)
+                left_surface = self._render_subtree(task, ctx, width, height,
+                                                    self.left_treenode,
+                                                    self.left_background, None)
     #            left_surface.write_to_png('/dev/shm/left_' + self.left_treenode.get_unique_id() + '.png')
-                right_surface, right_ctx = self._prepare_surface(ctx, width, height, \
-                                                                 self.right_background)
-                right_ctx.set_operator(cairo.OPERATOR_SOURCE)
-                self.right_treenode.render(task, right_ctx, width, height)
+                right_surface = self._render_subtree(task, ctx, width, height,
+                                                     self.right_treenode,
+                                                     self.right_background,
+                                                     cairo.OPERATOR_SOURCE)
     #            right_surface.write_to_png('/dev/shm/right_' + self.right_treenode.get_unique_id() + '.png')
     
                 if not task.quit:
+                    merger_node = ka_profile.begin(
+                                             self.merger.__class__.__name__)
                     self.merger.merge_layers(left_surface, right_surface, \
                                              ctx, width, height)
+                    ka_profile.end(merger_node)
             elif (self.left_treenode is not None) and (self.right_treenode is None):
+                modifier_node = ka_profile.begin(self.modifier.__class__.__name__)
                 self.modifier.render_single_layer(task, self.layer, self.left_treenode,
                                                   ctx, width, height)
+                ka_profile.end(modifier_node)
             elif (self.left_treenode is None) and (self.right_treenode is not None):
+                modifier_node = ka_profile.begin(self.modifier.__class__.__name__)
                 self.modifier.render_single_layer(task, self.layer, self.right_treenode, 
                                                   ctx, width, height)
+                ka_profile.end(modifier_node)
 #            ka_debug.matrix_r(ctx.get_matrix())
             ctx.restore()
         except:
             ka_debug.err('failed calculating [%s] [%s] [%s]' % \
                    (self.get_unique_id(), sys.exc_info()[0], sys.exc_info()[1]))
             traceback.print_exc(file=sys.__stderr__)
+        ka_profile.end(profile_node)
 #            ka_debug.matrix(ctx.get_matrix())
 
+    def _render_subtree(self, task, ctx, width, height,
+                        treenode, background, operator):
+        """Render child node to an intermediate surface.
+        Surfaces are memoized by the subtrees digest. After crossing over most
+        subtrees are unchanged copies of a parents subtree, so they are
+        taken from the cache. Merging strategies only read these surfaces.
+        """
+        surface_cache = ka_cache.SurfaceCache.subtree_instance()
+        key = '%s/%s/%s' % (_subtree_digest(treenode), repr(background.rgba),
+                            operator)
+        surface = surface_cache.get(key, width, height)
+        if surface is not None:
+            ka_profile.count(ka_profile.CACHE_HITS)
+        else:
+            surface, sub_ctx = self._prepare_surface(ctx, width, height,
+                                                     background)
+            if operator is not None:
+                sub_ctx.set_operator(operator)
+            treenode.render(task, sub_ctx, width, height)
+            if not task.quit:
+                surface_cache.put(key, width, height, surface)
+        return surface
+
     def _prepare_surface(self, ctx, width, height, background):
         new_surface = ctx.get_target().create_similar(cairo.CONTENT_COLOR_ALPHA, 
                                                       width, height)
+        ka_profile.count(ka_profile.SURFACES)
         new_ctx = cairo.Context(new_surface)
         new_ctx.scale(float(width), float(height))
 #        ka_debug.matrix(new_ctx.get_matrix())
@@ -381,8 +507,7 @@ class TreeNode(model_allele.Allele):
         """ The tree nodes copy constructor.
         post: __return__.layer is not None
         """
-        new_one = TreeNode(self.get_trunk())
-        new_one.path = self.path[:]
+        new_one = TreeNode._blank(self.path, [])
         new_one.left_treenode = self.left_treenode.copy() \
                                 if self.left_treenode is not None \
                                 else None